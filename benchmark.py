@@ -0,0 +1,479 @@
+#!/usr/bin/python3
+"""Benchmarks de sdn_controller.py contra un Floodlight simulado en local"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yaml
+
+import sdn_controller as sdn
+
+
+def dpid(i):
+    return ":".join(f"{b:02x}" for b in (i + 1).to_bytes(8, 'big'))
+
+
+class FakeFloodlight:
+    """Servidor HTTP que imita la API REST de Floodlight sobre una topología lineal.
+
+    Cada switch usa el puerto 1 hacia el anterior, el 2 hacia el siguiente
+    y del 3 en adelante para los hosts.
+    """
+    def __init__(self, switches=4, latencia=0.0):
+        self.switches = [dpid(i) for i in range(switches)]
+        self.indice = {d: i for i, d in enumerate(self.switches)}
+        self.latencia = latencia
+        self.devices = []
+        self.flows = {}
+        self.peticiones = 0
+        self.lock = threading.Lock()
+        self.puertos_libres = [3] * switches
+        # Cambia con cada alta o movimiento de host; se publica como ETag de /wm/device/
+        self.version_devices = 0
+        # DPID -> controlador que lo gestiona cuando se simulan varios
+        self.dominios = {d: 0 for d in self.switches}
+        self.servers = []
+
+    def agregar_host(self, mac, ip=None, switch=None):
+        if switch is None:
+            switch = random.randrange(len(self.switches))
+        puerto = self.puertos_libres[switch]
+        self.puertos_libres[switch] += 1
+        self.devices.append({
+            'mac': [mac],
+            'ipv4': [ip] if ip else [],
+            'attachmentPoint': [{'switchDPID': self.switches[switch], 'port': puerto}],
+            'lastSeen': int(time.time() * 1000),
+        })
+        self.version_devices += 1
+
+    def mover_host(self, mac, switch):
+        """Reubica un host en otro switch, como si hubiera cambiado de punto de conexión"""
+        device = next(d for d in self.devices if mac in d['mac'])
+        puerto = self.puertos_libres[switch]
+        self.puertos_libres[switch] += 1
+        device['attachmentPoint'] = [{'switchDPID': self.switches[switch], 'port': puerto}]
+        device['lastSeen'] = max(int(time.time() * 1000), device['lastSeen'] + 1)
+        self.version_devices += 1
+
+    def etag_devices(self):
+        return f'"{self.version_devices}"'
+
+    def enlaces(self):
+        return [{'src-switch': self.switches[i], 'src-port': 2,
+                 'dst-switch': self.switches[i + 1], 'dst-port': 1,
+                 'type': 'internal', 'direction': 'bidirectional'}
+                for i in range(len(self.switches) - 1)]
+
+    def propio(self, dpid, dominio):
+        return dominio is None or self.dominios.get(dpid) == dominio
+
+    def enlaces_entre_dominios(self):
+        return [l for l in self.enlaces() if self.dominios[l['src-switch']] != self.dominios[l['dst-switch']]]
+
+    def ruta(self, src, dst):
+        a, b = self.indice[src], self.indice[dst]
+        paso, salida, entrada = (1, 2, 1) if b > a else (-1, 1, 2)
+        ruta = []
+        for i in range(a, b, paso):
+            ruta.append({'switch': self.switches[i], 'port': salida})
+            ruta.append({'switch': self.switches[i + paso], 'port': entrada})
+        return ruta
+
+    def responder(self, metodo, ruta, cuerpo, cabeceras=None, dominio=None):
+        """Atiende una petición; con dominio solo ve los switches de ese controlador"""
+        if self.latencia:
+            time.sleep(self.latencia)
+        with self.lock:
+            self.peticiones += 1
+
+        if metodo == 'GET' and ruta == '/wm/device/':
+            if cabeceras and cabeceras.get('If-None-Match') == self.etag_devices():
+                return 304, None
+            return 200, [d for d in self.devices if self.propio(d['attachmentPoint'][0]['switchDPID'], dominio)]
+        if metodo == 'GET' and ruta == '/wm/topology/links/json':
+            return 200, [l for l in self.enlaces()
+                         if self.propio(l['src-switch'], dominio) and self.propio(l['dst-switch'], dominio)]
+        if metodo == 'GET' and ruta == '/wm/core/controller/switches/json':
+            return 200, [{'switchDPID': d} for d in self.switches if self.propio(d, dominio)]
+        m = re.fullmatch(r'/wm/path/([^/]+)/([^/]+)/json', ruta)
+        if metodo == 'GET' and m:
+            if not all(sw in self.indice and self.propio(sw, dominio) for sw in m.groups()):
+                return 404, {'error': 'switch desconocido'}
+            return 200, {'path': self.ruta(m.group(1), m.group(2))}
+        if ruta == '/wm/staticflowpusher/json' and metodo == 'POST':
+            if not self.propio(cuerpo['switch'], dominio):
+                return 400, {'error': f"switch {cuerpo['switch']} no conectado a este controlador"}
+            with self.lock:
+                self.flows[cuerpo['name']] = cuerpo
+            return 200, {'status': 'Entry pushed'}
+        if ruta == '/wm/staticflowpusher/json' and metodo == 'DELETE':
+            with self.lock:
+                flow = self.flows.get(cuerpo.get('name'))
+                if flow and self.propio(flow['switch'], dominio):
+                    del self.flows[cuerpo['name']]
+            return 200, {'status': 'Entry deleted'}
+        if metodo == 'GET' and ruta == '/wm/staticflowpusher/list/all/json':
+            listado = {d: [] for d in self.switches if self.propio(d, dominio)}
+            with self.lock:
+                for nombre, flow in self.flows.items():
+                    if self.propio(flow['switch'], dominio):
+                        listado.setdefault(flow['switch'], []).append({nombre: flow})
+            return 200, listado
+        return 404, {'error': f'{metodo} {ruta} no soportado'}
+
+    def iniciar(self):
+        """Un único controlador con todos los switches"""
+        return self._servir(None)
+
+    def iniciar_dominios(self, n):
+        """Reparte los switches en n controladores contiguos; devuelve la URL de cada uno"""
+        for i, d in enumerate(self.switches):
+            self.dominios[d] = i * n // len(self.switches)
+        return [self._servir(dominio) for dominio in range(n)]
+
+    def _servir(self, dominio):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _atender(self, metodo):
+                largo = int(self.headers.get('Content-Length') or 0)
+                cuerpo = json.loads(self.rfile.read(largo)) if largo else None
+                estado, respuesta = fake.responder(metodo, self.path, cuerpo, self.headers, dominio)
+                datos = b'' if respuesta is None else json.dumps(respuesta).encode()
+                self.send_response(estado)
+                if self.path == '/wm/device/':
+                    self.send_header('ETag', fake.etag_devices())
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def do_GET(self):
+                self._atender('GET')
+
+            def do_POST(self):
+                self._atender('POST')
+
+            def do_DELETE(self):
+                self._atender('DELETE')
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # El backlog por defecto (5) descarta conexiones cuando se envían muchos flows a la vez
+            request_queue_size = 256
+
+        server = Server(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/wm"
+
+    def detener(self):
+        while self.servers:
+            server = self.servers.pop()
+            server.shutdown()
+            server.server_close()
+
+
+def generar_roster(n_alumnos, n_cursos, n_servidores, servicios_por_servidor=3,
+                   alumnos_por_curso=40, semilla=0):
+    """Roster sintético con el mismo formato que el YAML de importación"""
+    rnd = random.Random(semilla)
+    nombres_servicio = ['ssh', 'web', 'ftp', 'dns', 'db', 'git'][:servicios_por_servidor]
+    alumnos = [{'nombre': f'Alumno {i}', 'codigo': 20000000 + i,
+                'mac': ':'.join(f'{b:02x}' for b in (0x020000000000 + i).to_bytes(6, 'big'))}
+               for i in range(n_alumnos)]
+    servidores = [{'nombre': f'Servidor {i + 1}', 'ip': f'10.0.{i // 250}.{i % 250 + 1}',
+                   'servicios': [{'nombre': sv, 'protocolo': 'UDP' if sv == 'dns' else 'TCP',
+                                  'puerto': 22 + j} for j, sv in enumerate(nombres_servicio)]}
+                  for i in range(n_servidores)]
+    cursos = []
+    for i in range(n_cursos):
+        servidor = servidores[i % n_servidores]
+        cursos.append({
+            'codigo': f'TEL{100 + i}',
+            'nombre': f'Curso {i}',
+            'estado': 'DICTANDO' if i % 4 else 'CERRADO',
+            'alumnos': [a['codigo'] for a in rnd.sample(alumnos, min(alumnos_por_curso, n_alumnos))],
+            'servidores': [{'nombre': servidor['nombre'],
+                            'servicios_permitidos': nombres_servicio[:2]}],
+        })
+    return {'alumnos': alumnos, 'cursos': cursos, 'servidores': servidores}
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return 0.0
+    k = min(len(ordenados) - 1, max(0, round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[k]
+
+
+def resumen(nombre, tiempos, operaciones=None):
+    total = sum(tiempos)
+    operaciones = operaciones or len(tiempos)
+    return {
+        'benchmark': nombre,
+        'n': operaciones,
+        'total_s': total,
+        'ops_por_s': operaciones / total if total else float('inf'),
+        'p50_ms': percentil(tiempos, 50) * 1000,
+        'p99_ms': percentil(tiempos, 99) * 1000,
+    }
+
+
+def cronometrar(fn, *args, **kwargs):
+    inicio = time.perf_counter()
+    resultado = fn(*args, **kwargs)
+    return time.perf_counter() - inicio, resultado
+
+
+def importar_yaml(archivo):
+    """Importación parseando el YAML, sin aprovechar la instantánea de la corrida anterior"""
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(sdn._ruta_snapshot(archivo))
+    return sdn.importar(archivo)
+
+
+def medir_arranque(archivo, directorio, repeticiones):
+    """Tiempo de una invocación completa de la CLI en un proceso nuevo"""
+    script = os.path.abspath(sdn.__file__)
+    estado = os.path.join(directorio, 'arranque.db')
+    variantes = [
+        ('arranque_import', [sys.executable, '-c', 'import sdn_controller'], None),
+        ('arranque_cli', [sys.executable, script, '--estado', estado, 'servidores'], None),
+        ('arranque_cli_yaml', [sys.executable, script, '--estado', estado, '--datos', archivo, 'servidores'],
+         sdn._ruta_snapshot(archivo)),
+        ('arranque_cli_snapshot', [sys.executable, script, '--estado', estado, '--datos', archivo, 'servidores'],
+         None),
+    ]
+    resultados = []
+    for nombre, comando, borrar in variantes:
+        tiempos = []
+        for _ in range(repeticiones):
+            if borrar:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(borrar)
+            inicio = time.perf_counter()
+            subprocess.run(comando, cwd=os.path.dirname(script), check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            tiempos.append(time.perf_counter() - inicio)
+        resultados.append(resumen(nombre, tiempos))
+    return resultados
+
+
+def reiniciar_estado(fake):
+    sdn.conexiones.limpiar()
+    sdn.carga_enlaces.limpiar()
+    sdn.flows_compartidos.limpiar()
+    fake.flows.clear()
+    sdn.device_cache.invalidar()
+    sdn.path_cache.invalidar()
+    sdn.reconciliador.huella = None
+    sdn.reconciliador.afectadas.clear()
+
+
+def medir_reconciliacion(fake, mover, repeticiones):
+    """Ciclos de reconciliación sin cambios y moviendo algunos hosts entre ciclos"""
+    sdn.reconciliador.max_por_segundo = 0
+    sdn.reconciliador.ciclo()
+    sin_cambios = [cronometrar(sdn.reconciliador.ciclo)[0] for _ in range(repeticiones)]
+    macs = [c.alumno_mac for c in sdn.conexiones]
+    con_cambios = []
+    for _ in range(repeticiones):
+        for mac in random.sample(macs, min(mover, len(macs))):
+            fake.mover_host(mac, random.randrange(len(fake.switches)))
+        con_cambios.append(cronometrar(sdn.reconciliador.ciclo)[0])
+    return [resumen('reconciliar_sin_cambios', sin_cambios), resumen('reconciliar_con_cambios', con_cambios)]
+
+
+def medir_admision(curso, alumnos, servidores, clics=2):
+    """Toda la clase pide su conexión a la vez y cada alumno pulsa clics veces"""
+    sdn.admision = sdn.Admision()
+    permiso = curso.servidores[0]
+    servidor = servidores[permiso['nombre']]
+    servicio = next(sv for sv in servidor.servicios if sv.nombre == permiso['servicios_permitidos'][0])
+    solicitudes = [alumnos[codigo].mac for codigo in sorted(curso.alumnos, key=str) if codigo in alumnos] * clics
+    barrera = threading.Barrier(len(solicitudes))
+    tiempos = [None] * len(solicitudes)
+
+    def pedir(i):
+        barrera.wait()
+        tiempos[i], _ = cronometrar(sdn.registrar_conexion, solicitudes[i], servidor.ip, servicio)
+
+    hilos = [threading.Thread(target=pedir, args=(i,)) for i in range(len(solicitudes))]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return resumen('admision_rafaga', tiempos), sdn.admision.estadisticas()
+
+
+def triples_autorizados(roster):
+    triples = []
+    for curso in roster['cursos']:
+        if curso['estado'] != 'DICTANDO':
+            continue
+        for srv in curso['servidores']:
+            for servicio in srv['servicios_permitidos']:
+                for codigo in curso['alumnos']:
+                    triples.append((codigo, srv['nombre'], servicio))
+    return triples
+
+
+def ejecutar(args):
+    random.seed(args.semilla)
+    roster = generar_roster(args.alumnos, args.cursos, args.servidores,
+                            alumnos_por_curso=args.alumnos_por_curso, semilla=args.semilla)
+    directorio = tempfile.mkdtemp(prefix='sdn_bench_')
+    archivo = os.path.join(directorio, 'roster.yaml')
+    with open(archivo, 'w') as f:
+        yaml.safe_dump(roster, f)
+
+    fake = FakeFloodlight(args.switches, args.latencia)
+    for a in roster['alumnos']:
+        fake.agregar_host(a['mac'])
+    for s in roster['servidores']:
+        fake.agregar_host(f"fe:00:00:00:{int(s['ip'].split('.')[2]):02x}:{int(s['ip'].split('.')[3]):02x}",
+                          s['ip'], switch=len(fake.switches) - 1)
+    if args.controladores > 1:
+        sdn.fl_client = sdn.ControllerPool(
+            [sdn.FloodlightClient(url) for url in fake.iniciar_dominios(args.controladores)],
+            fake.enlaces_entre_dominios())
+    else:
+        sdn.fl_client = sdn.FloodlightClient(fake.iniciar())
+    sdn.ROUTING_ENGINE = args.motor
+    sdn.FLOW_AGGREGATION = args.agregar_flows
+
+    resultados = []
+    silencio = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(silencio):
+            tiempos = [cronometrar(importar_yaml, archivo)[0] for _ in range(args.repeticiones)]
+            resultados.append(resumen('importar', tiempos))
+            tiempos = [cronometrar(sdn.importar, archivo)[0] for _ in range(args.repeticiones)]
+            resultados.append(resumen('importar_snapshot', tiempos))
+
+            salida = os.path.join(directorio, 'export.yaml')
+            tiempos = [cronometrar(sdn.exportar, salida)[0] for _ in range(args.repeticiones)]
+            resultados.append(resumen('exportar', tiempos))
+
+            triples = triples_autorizados(roster)
+            consultas = [random.choice(triples) for _ in range(args.consultas)] if triples else []
+            tiempos = [cronometrar(sdn.politicas.autorizado, *t)[0] for t in consultas]
+            resultados.append(resumen('politica', tiempos))
+
+            # Primera página de un listado ordenado, como la pide la CLI con --orden y --limite
+            pagina = lambda: list(sdn.iterar_alumnos(orden='nombre', limite=sdn.LISTADO_PAGINA))
+            tiempos = [cronometrar(pagina)[0] for _ in range(args.repeticiones)]
+            resultados.append(resumen('listar_pagina', tiempos))
+
+            # Conexiones individuales, como las crearía crear_conexion
+            alumnos = {a.codigo: a for a in sdn.alumnos}
+            servidores = {s.nombre: s for s in sdn.servidores}
+            muestra = random.sample(triples, min(args.conexiones, len(triples)))
+            reiniciar_estado(fake)
+            tiempos = []
+            for codigo, nombre_servidor, nombre_servicio in muestra:
+                servidor = servidores[nombre_servidor]
+                servicio = next(sv for sv in servidor.servicios if sv.nombre == nombre_servicio)
+                tiempos.append(cronometrar(sdn.registrar_conexion, alumnos[codigo].mac,
+                                           servidor.ip, servicio)[0])
+            resultados.append(resumen('crear_conexion', tiempos))
+
+            # Aprovisionamiento masivo de un curso
+            curso = next((c for c in sdn.cursos if c.estado == 'DICTANDO'), None)
+            if curso:
+                reiniciar_estado(fake)
+                tiempo, reporte = cronometrar(sdn.provisionar_curso, curso.codigo)
+                resultados.append(resumen('provisionar_curso', [tiempo],
+                                          len(reporte['resultados']) if reporte else 1))
+                flows_curso = len(fake.flows)
+                resultados += medir_reconciliacion(fake, args.mover, args.repeticiones)
+
+                # Ráfaga de solicitudes de toda la clase contra la admisión
+                reiniciar_estado(fake)
+                fila, admision = medir_admision(curso, alumnos, servidores)
+                resultados.append(fila)
+
+            # Motor asíncrono sobre la misma muestra
+            reiniciar_estado(fake)
+            lote = []
+            for codigo, nombre_servidor, nombre_servicio in muestra:
+                servidor = servidores[nombre_servidor]
+                servicio = next(sv for sv in servidor.servicios if sv.nombre == nombre_servicio)
+                lote.append(sdn.Conexion(f"bench_{len(lote)}", alumnos[codigo].mac, servidor.ip, servicio))
+            if lote:
+                tiempo, _ = cronometrar(sdn.build_routes, lote)
+                resultados.append(resumen('build_routes_async', [tiempo], len(lote)))
+            if args.arranque:
+                resultados += medir_arranque(archivo, directorio, args.repeticiones)
+    finally:
+        fake.detener()
+
+    return {'parametros': vars(args), 'peticiones_rest': fake.peticiones,
+            'flows_provisionar': flows_curso if curso else 0,
+            'admision': admision if curso else None, 'resultados': resultados}
+
+
+def construir_parser():
+    parser = argparse.ArgumentParser(description='Benchmarks de sdn_controller.py')
+    parser.add_argument('--alumnos', type=int, default=2000)
+    parser.add_argument('--cursos', type=int, default=50)
+    parser.add_argument('--servidores', type=int, default=10)
+    parser.add_argument('--alumnos-por-curso', type=int, default=40)
+    parser.add_argument('--switches', type=int, default=6)
+    parser.add_argument('--latencia', type=float, default=0.0, help='Latencia inyectada por petición (s)')
+    parser.add_argument('--conexiones', type=int, default=200)
+    parser.add_argument('--consultas', type=int, default=10000)
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--motor', choices=('rest', 'local', 'balanceado'), default='rest', help='Motor de cálculo de rutas')
+    parser.add_argument('--agregar-flows', action='store_true', help='Comparte los flows fuera del switch del alumno')
+    parser.add_argument('--controladores', type=int, default=1,
+                        help='Controladores simulados; los switches se reparten entre ellos')
+    parser.add_argument('--mover', type=int, default=5,
+                        help='Hosts que se mueven entre ciclos de reconciliación')
+    parser.add_argument('--arranque', action='store_true',
+                        help='Mide también el arranque de la CLI en procesos nuevos')
+    parser.add_argument('--json', action='store_true', help='Imprime el reporte en JSON')
+    return parser
+
+
+def main():
+    args = construir_parser().parse_args()
+    reporte = ejecutar(args)
+    if args.json:
+        print(json.dumps(reporte, indent=2))
+        return
+
+    print(f"{'benchmark':<20} {'n':>7} {'ops/s':>12} {'p50 ms':>10} {'p99 ms':>10}")
+    for r in reporte['resultados']:
+        print(f"{r['benchmark']:<20} {r['n']:>7} {r['ops_por_s']:>12.1f} "
+              f"{r['p50_ms']:>10.3f} {r['p99_ms']:>10.3f}")
+    print(f"\nPeticiones REST atendidas por el Floodlight simulado: {reporte['peticiones_rest']}")
+    print(f"Flows instalados al provisionar un curso: {reporte['flows_provisionar']}")
+    if reporte['admision']:
+        adm = reporte['admision']
+        print(f"Admisión en la ráfaga: {adm['admitidas']} admitidas, {adm['unidas']} unidas, "
+              f"rechazadas {adm['rechazadas']}, espera media {adm['espera_media_s'] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,153 +1,1612 @@
 #!/usr/bin/python3
 
-import yaml
-import requests
+import argparse
+import contextlib
+import hashlib
+import heapq
+import importlib
+import io
+import itertools
+import json
+import os
+import pickle
+import re
+import shlex
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
 from enum import Enum
 
+class _ModuloDiferido:
+    """Importa el módulo recién la primera vez que se usa uno de sus atributos"""
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+
+    def __getattr__(self, atributo):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nombre)
+        return getattr(self._modulo, atributo)
+
+def _importar_opcional(nombre):
+    try:
+        return importlib.import_module(nombre)
+    except ImportError:
+        return None
+
+# Dependencias pesadas: cada comando solo paga la importación de lo que usa
+asyncio = _ModuloDiferido('asyncio')
+futures = _ModuloDiferido('concurrent.futures')
+requests = _ModuloDiferido('requests')
+yaml = _ModuloDiferido('yaml')
+
 # Clases base
 class Alumno:
+    __slots__ = ('nombre', 'codigo', 'mac')
+
     def __init__(self, nombre, codigo, mac):
         self.nombre = nombre
         self.codigo = codigo
         self.mac = mac
 
 class Curso:
+    __slots__ = ('codigo', 'nombre', 'estado', 'alumnos', 'servidores')
+
     def __init__(self, codigo, nombre, estado):
         self.codigo = codigo
         self.nombre = nombre
         self.estado = estado
-        self.alumnos = []
+        self.alumnos = set()
         self.servidores = []
 
 class Servidor:
+    __slots__ = ('nombre', 'ip', 'servicios')
+
     def __init__(self, nombre, ip):
         self.nombre = nombre
         self.ip = ip
         self.servicios = []
 
 class Servicio:
+    __slots__ = ('nombre', 'protocolo', 'puerto')
+
     def __init__(self, nombre, protocolo, puerto):
         self.nombre = nombre
         self.protocolo = protocolo
         self.puerto = puerto
 
 class Conexion:
+    __slots__ = ('handler', 'alumno_mac', 'servidor_ip', 'servicio', 'hops', 'flows', 'grupos')
+
     def __init__(self, handler, alumno_mac, servidor_ip, servicio):
         self.handler = handler
         self.alumno_mac = alumno_mac
         self.servidor_ip = servidor_ip
         self.servicio = servicio
+        self.hops = []
+        self.flows = []
+        # Claves de los grupos compartidos (agg_ y ARP) a los que se unió al instalarse
+        self.grupos = []
+
+    @property
+    def identidad(self):
+        return identidad_conexion(self.alumno_mac, self.servidor_ip, self.servicio)
+
+def identidad_conexion(alumno_mac, servidor_ip, servicio):
+    """(MAC, IP, protocolo, puerto) que distingue a una conexión de cualquier otra"""
+    return (alumno_mac.lower(), servidor_ip, servicio.protocolo.upper(), str(servicio.puerto))
+
+def handler_de(alumno_mac, servidor_ip, servicio):
+    """Handler determinista: la misma conexión siempre recibe el mismo"""
+    huella = hashlib.sha1('|'.join(identidad_conexion(alumno_mac, servidor_ip, servicio)).encode())
+    return f"conn_{huella.hexdigest()[:12]}"
+
+def _normalizar_codigo(codigo):
+    # Los códigos del YAML son numéricos y los ingresados por menú son texto
+    return str(codigo).strip()
+
+def _normalizar_nombre(nombre):
+    return nombre.strip().lower()
+
+class Registro:
+    """Colección con índice por clave primaria, índices únicos secundarios y grupos (índices no únicos)"""
+    __slots__ = ('clave', 'normalizar', 'items', 'indices', 'grupos', 'observador')
+
+    def __init__(self, clave, *indices, normalizar=None, grupos=()):
+        self.clave = clave
+        self.normalizar = normalizar or {}
+        self.items = {}
+        self.indices = {indice: {} for indice in indices}
+        # Atributo -> valor -> {clave primaria: objeto}
+        self.grupos = {atributo: {} for atributo in grupos}
+        # Función (evento, obj) que se llama en cada mutación; la usa el almacén persistente
+        self.observador = None
+
+    def _notificar(self, evento, obj):
+        if self.observador is not None:
+            self.observador(evento, obj)
+
+    def _k(self, atributo, valor):
+        funcion = self.normalizar.get(atributo)
+        return funcion(valor) if funcion else valor
+
+    def clave_de(self, obj):
+        return self._k(self.clave, getattr(obj, self.clave))
+
+    def __iter__(self):
+        return iter(list(self.items.values()))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, valor):
+        return self._k(self.clave, valor) in self.items
+
+    def get(self, valor, default=None):
+        return self.items.get(self._k(self.clave, valor), default)
+
+    def buscar(self, atributo, valor):
+        return self.indices[atributo].get(self._k(atributo, valor))
+
+    def grupo(self, atributo, valor):
+        """Objetos que comparten el valor del atributo"""
+        return list(self.grupos[atributo].get(self._k(atributo, valor), {}).values())
+
+    def agregar(self, obj):
+        anterior = self.items.get(self.clave_de(obj))
+        if anterior is not None:
+            self.quitar(anterior)
+        self.items[self.clave_de(obj)] = obj
+        for atributo, indice in self.indices.items():
+            indice[self._k(atributo, getattr(obj, atributo))] = obj
+        for atributo, grupo in self.grupos.items():
+            grupo.setdefault(self._k(atributo, getattr(obj, atributo)), {})[self.clave_de(obj)] = obj
+        self._notificar('guardar', obj)
+        return obj
+
+    def quitar(self, obj):
+        self.items.pop(self.clave_de(obj), None)
+        for atributo, indice in self.indices.items():
+            k = self._k(atributo, getattr(obj, atributo))
+            if indice.get(k) is obj:
+                del indice[k]
+        for atributo, grupo in self.grupos.items():
+            k = self._k(atributo, getattr(obj, atributo))
+            miembros = grupo.get(k)
+            if miembros is not None and miembros.get(self.clave_de(obj)) is obj:
+                del miembros[self.clave_de(obj)]
+                if not miembros:
+                    del grupo[k]
+        self._notificar('borrar', obj)
+
+    def tocar(self, obj):
+        """Avisa que un objeto registrado cambió sin pasar por actualizar()"""
+        self._notificar('guardar', obj)
+
+    def actualizar(self, obj, **cambios):
+        """Modifica atributos de un objeto registrado manteniendo los índices"""
+        self.quitar(obj)
+        for atributo, valor in cambios.items():
+            setattr(obj, atributo, valor)
+        self.agregar(obj)
+
+    def limpiar(self):
+        self.items.clear()
+        for indice in self.indices.values():
+            indice.clear()
+        for grupo in self.grupos.values():
+            grupo.clear()
+        self._notificar('limpiar', None)
+
+# Métricas: contadores e histogramas de latencia en memoria, exportables en formato Prometheus
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+AYUDA_METRICAS = {
+    'sdn_floodlight_peticion_segundos': 'Latencia de las peticiones REST a Floodlight',
+    'sdn_floodlight_errores_total': 'Peticiones REST a Floodlight que fallaron',
+    'sdn_build_route_segundos': 'Duración de cada etapa de build_route',
+    'sdn_build_route_total': 'Conexiones construidas por resultado',
+    'sdn_admision_espera_segundos': 'Espera en la cola de admisión antes de build_route',
+    'sdn_admision_total': 'Solicitudes de conexión por resultado de la admisión',
+    'sdn_revocaciones_total': 'Conexiones retiradas por dejar de estar autorizadas',
+}
+
+def _plantilla_endpoint(ruta):
+    """Agrupa las rutas que llevan DPIDs bajo una misma etiqueta (/path/{dpid}/{dpid}/json)"""
+    return '/'.join('{dpid}' if ':' in parte else parte for parte in ruta.split('?')[0].split('/'))
+
+def _etiquetas_prometheus(pares):
+    """{k="v",...} con las barras invertidas, comillas y saltos de línea de los valores escapados"""
+    if not pares:
+        return ''
+    escapar = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escapar(v)}"' for k, v in pares) + '}'
+
+class Metricas:
+    """Contadores e histogramas etiquetados, seguros entre hilos"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.contadores = {}
+        self.histogramas = {}
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self.lock:
+            self.contadores[clave] = self.contadores.get(clave, 0) + valor
+
+    def observar(self, nombre, segundos, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self.lock:
+            h = self.histogramas.get(clave)
+            if h is None:
+                h = self.histogramas[clave] = {'buckets': [0] * len(self.buckets), 'suma': 0.0, 'cuenta': 0}
+            for i, limite in enumerate(self.buckets):
+                if segundos <= limite:
+                    h['buckets'][i] += 1
+                    break
+            h['suma'] += segundos
+            h['cuenta'] += 1
+
+    @contextlib.contextmanager
+    def cronometro(self, nombre, **etiquetas):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nombre, time.perf_counter() - inicio, **etiquetas)
+
+    def percentil(self, h, q):
+        """Límite superior del bucket donde cae el percentil q (aproximado)"""
+        objetivo = q * h['cuenta']
+        acumulado = 0
+        for limite, n in zip(self.buckets, h['buckets']):
+            acumulado += n
+            if acumulado >= objetivo:
+                return limite
+        return float('inf')
+
+    def resumen(self):
+        """Cuentas, media y p95 de cada histograma, y el valor de cada contador"""
+        with self.lock:
+            histogramas = {clave: dict(h, buckets=list(h['buckets'])) for clave, h in self.histogramas.items()}
+            contadores = dict(self.contadores)
+        filas = []
+        for (nombre, etiquetas), h in sorted(histogramas.items()):
+            p95 = self.percentil(h, 0.95)
+            filas.append(dict(etiquetas, metrica=nombre, cuenta=h['cuenta'],
+                              media_ms=round(h['suma'] / h['cuenta'] * 1000, 3) if h['cuenta'] else 0,
+                              p95_ms=p95 * 1000 if p95 != float('inf') else None))
+        for (nombre, etiquetas), valor in sorted(contadores.items()):
+            filas.append(dict(etiquetas, metrica=nombre, valor=valor))
+        return filas
+
+    @staticmethod
+    def _etiquetas(etiquetas, **extra):
+        return _etiquetas_prometheus(list(etiquetas) + list(extra.items()))
 
+    def exportar(self):
+        """Texto en formato de exposición de Prometheus"""
+        lineas = []
+        with self.lock:
+            por_nombre = {}
+            for (nombre, etiquetas), h in self.histogramas.items():
+                por_nombre.setdefault(nombre, ('histogram', []))[1].append((etiquetas, h))
+            for (nombre, etiquetas), valor in self.contadores.items():
+                por_nombre.setdefault(nombre, ('counter', []))[1].append((etiquetas, valor))
+            for nombre in sorted(por_nombre):
+                tipo, series = por_nombre[nombre]
+                lineas.append(f"# HELP {nombre} {AYUDA_METRICAS.get(nombre, nombre)}")
+                lineas.append(f"# TYPE {nombre} {tipo}")
+                for etiquetas, valor in sorted(series, key=lambda x: x[0]):
+                    if tipo == 'counter':
+                        lineas.append(f"{nombre}{self._etiquetas(etiquetas)} {valor}")
+                        continue
+                    acumulado = 0
+                    for limite, n in zip(self.buckets, valor['buckets']):
+                        acumulado += n
+                        lineas.append(f"{nombre}_bucket{self._etiquetas(etiquetas, le=limite)} {acumulado}")
+                    lineas.append(f"{nombre}_bucket{self._etiquetas(etiquetas, le='+Inf')} {valor['cuenta']}")
+                    lineas.append(f"{nombre}_sum{self._etiquetas(etiquetas)} {valor['suma']}")
+                    lineas.append(f"{nombre}_count{self._etiquetas(etiquetas)} {valor['cuenta']}")
+        return '\n'.join(lineas) + '\n' if lineas else ''
 
+    def limpiar(self):
+        with self.lock:
+            self.contadores.clear()
+            self.histogramas.clear()
+
+metricas = Metricas()
 
 # Configuración del controlador Floodlight
 FL_CONTROLLER_IP = "10.20.12.228" 
 FL_CONTROLLER_PORT = "8080"
 FL_BASE_URL = f"http://{FL_CONTROLLER_IP}:{FL_CONTROLLER_PORT}/wm"
 
-def get_attachment_point(mac):
+# Parámetros del cliente HTTP hacia Floodlight
+FL_CONNECT_TIMEOUT = 3
+FL_READ_TIMEOUT = 10
+FL_MAX_RETRIES = 3
+FL_BACKOFF_FACTOR = 0.3
+FL_POOL_SIZE = 10
+
+class FloodlightClient:
+    """Cliente REST de Floodlight con sesión persistente, timeouts y reintentos"""
+    def __init__(self, base_url=FL_BASE_URL, pool_size=FL_POOL_SIZE,
+                 connect_timeout=FL_CONNECT_TIMEOUT, read_timeout=FL_READ_TIMEOUT,
+                 max_retries=FL_MAX_RETRIES, backoff_factor=FL_BACKOFF_FACTOR):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        # La sesión (y requests) se crea con la primera petición
+        self.session = None
+        self.lock = threading.Lock()
+
+    def _sesion(self):
+        with self.lock:
+            if self.session is None:
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+                session = requests.Session()
+                # Solo los GET son idempotentes, así que solo ellos se reintentan
+                retry = Retry(
+                    total=self.max_retries,
+                    backoff_factor=self.backoff_factor,
+                    status_forcelist=(500, 502, 503, 504),
+                    allowed_methods=frozenset(['GET']),
+                )
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size,
+                                      max_retries=retry)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.session = session
+            return self.session
+
+    def request(self, metodo, ruta, timeout=None, **kwargs):
+        endpoint = _plantilla_endpoint(ruta)
+        inicio = time.perf_counter()
+        try:
+            response = (self.session or self._sesion()).request(
+                metodo, f"{self.base_url}{ruta}", timeout=timeout or self.timeout, **kwargs
+            )
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            metricas.incrementar('sdn_floodlight_errores_total', metodo=metodo, endpoint=endpoint)
+            raise
+        finally:
+            metricas.observar('sdn_floodlight_peticion_segundos', time.perf_counter() - inicio,
+                              metodo=metodo, endpoint=endpoint)
+        return response
+
+    def get(self, ruta, timeout=None):
+        return self.request('GET', ruta, timeout).json()
+
+    def post(self, ruta, data, timeout=None):
+        return self.request('POST', ruta, timeout, json=data)
+
+    def delete(self, ruta, data, timeout=None):
+        return self.request('DELETE', ruta, timeout, json=data)
+
+# Controladores adicionales: cada uno es dueño de los switches conectados a él
+FL_CONTROLADORES = [FL_BASE_URL]
+# Enlaces entre switches de controladores distintos (ninguno de ellos los descubre por LLDP)
+FL_ENLACES_DOMINIO = []
+# Periodo mínimo (segundos) entre consultas de qué switches tiene cada controlador
+FL_DESCUBRIMIENTO_INTERVALO = 30
+
+class RespuestaCombinada:
+    """Respuesta armada por el pool con la misma interfaz que requests.Response"""
+    __slots__ = ('datos', 'status_code', 'headers')
+
+    def __init__(self, datos, status_code=200, headers=None):
+        self.datos = datos
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return self.datos
+
+    def raise_for_status(self):
+        pass
+
+def _fusionar_enlaces(listas):
+    vistos = {}
+    for enlaces in listas:
+        for l in enlaces or []:
+            vistos.setdefault((l.get('src-switch'), str(l.get('src-port')),
+                               l.get('dst-switch'), str(l.get('dst-port'))), l)
+    return list(vistos.values())
+
+def _fusionar_listados(listas):
+    fusion = {}
+    for listado in listas:
+        fusion.update(listado or {})
+    return fusion
+
+def _concatenar(listas):
+    return [elemento for lista in listas for elemento in lista or []]
+
+class ControllerPool:
+    """Varios controladores Floodlight con la interfaz de FloodlightClient.
+
+    Cada switch pertenece al controlador al que está conectado; las peticiones
+    de un switch van a su dueño y las consultas globales se reparten en paralelo
+    y se fusionan.
+    """
+    # Consultas globales: se piden a todos los controladores y se combinan así
+    FUSIONES = {
+        "/topology/links/json": _fusionar_enlaces,
+        "/statistics/bandwidth/all/all/json": _concatenar,
+        "/staticflowpusher/list/all/json": _fusionar_listados,
+        "/core/controller/switches/json": _concatenar,
+    }
+
+    def __init__(self, clientes, enlaces=(), switches=None):
+        self.clientes = list(clientes)
+        # No hay una única URL; el cliente asíncrono pasa por request() en hilos
+        self.base_url = None
+        self.enlaces = [dict(l) for l in enlaces]
+        self.puertos_borde = {(l['src-switch'], str(l['src-port'])) for l in self.enlaces} | \
+                             {(l['dst-switch'], str(l['dst-port'])) for l in self.enlaces}
+        # DPID -> índice del controlador dueño
+        self.duenos = dict(switches or {})
+        # Nombre de flow -> índice del controlador donde se instaló
+        self.flows_por_nombre = {}
+        # Índice -> (ETag, dispositivos) de la última consulta a cada controlador
+        self.dispositivos = {}
+        self.ultimo_descubrimiento = None
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def _en_paralelo(self, funcion):
+        """Llama funcion(indice) para cada controlador a la vez y devuelve los resultados en orden"""
+        if len(self.clientes) == 1:
+            return [funcion(0)]
+        with self.lock:
+            if self.executor is None:
+                self.executor = futures.ThreadPoolExecutor(max_workers=len(self.clientes),
+                                                           thread_name_prefix="controladores")
+        return list(self.executor.map(funcion, range(len(self.clientes))))
+
+    def descubrir(self):
+        """Pregunta a cada controlador qué switches tiene conectados"""
+        respuestas = self._en_paralelo(
+            lambda i: self.clientes[i].get("/core/controller/switches/json") or [])
+        with self.lock:
+            for i, switches in enumerate(respuestas):
+                for sw in switches:
+                    self.duenos[sw.get('switchDPID') or sw.get('dpid')] = i
+            self.ultimo_descubrimiento = time.monotonic()
+
+    def indice_de(self, dpid):
+        """Controlador dueño del switch; ante un DPID desconocido se vuelve a descubrir"""
+        if dpid not in self.duenos and (self.ultimo_descubrimiento is None or
+                time.monotonic() - self.ultimo_descubrimiento > FL_DESCUBRIMIENTO_INTERVALO):
+            try:
+                self.descubrir()
+            except requests.exceptions.RequestException as e:
+                print(f"Error al descubrir los switches de los controladores: {e}")
+        return self.duenos.get(dpid, 0)
+
+    def request(self, metodo, ruta, timeout=None, **kwargs):
+        if metodo == 'GET':
+            if ruta == "/device/":
+                return self._dispositivos(kwargs.get('headers'), timeout)
+            m = re.fullmatch(r'/path/([^/]+)/([^/]+)/json', ruta)
+            if m:
+                return RespuestaCombinada({'path': self.ruta(m.group(1), m.group(2), timeout)})
+            if ruta in self.FUSIONES:
+                listas = self._en_paralelo(lambda i: self.clientes[i].get(ruta, timeout))
+                if ruta == "/topology/links/json":
+                    listas.append(self.enlaces)
+                return RespuestaCombinada(self.FUSIONES[ruta](listas))
+        elif ruta == "/staticflowpusher/json":
+            flow = kwargs.get('json') or {}
+            if metodo == 'POST':
+                i = self.indice_de(flow.get('switch'))
+                response = self.clientes[i].request(metodo, ruta, timeout, **kwargs)
+                self.flows_por_nombre[flow.get('name')] = i
+                return response
+            i = self.flows_por_nombre.pop(flow.get('name'), None)
+            if i is None:
+                # Flow instalado antes de arrancar este proceso: se borra en todos
+                return self._en_paralelo(lambda j: self.clientes[j].request(metodo, ruta, timeout, **kwargs))[0]
+            return self.clientes[i].request(metodo, ruta, timeout, **kwargs)
+        return self.clientes[0].request(metodo, ruta, timeout, **kwargs)
+
+    def get(self, ruta, timeout=None):
+        return self.request('GET', ruta, timeout).json()
+
+    def post(self, ruta, data, timeout=None):
+        return self.request('POST', ruta, timeout, json=data)
+
+    def delete(self, ruta, data, timeout=None):
+        return self.request('DELETE', ruta, timeout, json=data)
+
+    def _dispositivos(self, cabeceras, timeout):
+        """Fusiona las tablas de dispositivos; cada controlador se consulta con su propio ETag"""
+        def consultar(i):
+            etag, devices = self.dispositivos.get(i, (None, None))
+            response = self.clientes[i].request('GET', "/device/", timeout,
+                                                headers={'If-None-Match': etag} if etag else None)
+            if response.status_code == 304 and devices is not None:
+                return etag, devices
+            devices = response.json()
+            if isinstance(devices, dict):
+                devices = devices.get('devices', [])
+            etag = response.headers.get('ETag')
+            self.dispositivos[i] = (etag, devices)
+            return etag, devices
+
+        resultados = self._en_paralelo(consultar)
+        etags = [etag for etag, _ in resultados]
+        etag = "|".join(etags) if all(etags) else None
+        if etag and cabeceras and cabeceras.get('If-None-Match') == etag:
+            return RespuestaCombinada(None, 304, {'ETag': etag})
+
+        fusion = {}
+        for _, devices in resultados:
+            for device in devices:
+                # Un host de otro dominio aparece colgado del puerto de borde; ese punto no vale
+                puntos = [p for p in device.get('attachmentPoint') or []
+                          if (p.get('switchDPID'), str(p.get('port'))) not in self.puertos_borde]
+                if device.get('attachmentPoint') and not puntos:
+                    continue
+                clave = tuple(device.get('mac', []))
+                previo = fusion.get(clave)
+                if previo is None or (device.get('lastSeen') or 0) > (previo.get('lastSeen') or 0):
+                    fusion[clave] = dict(device, attachmentPoint=puntos)
+        return RespuestaCombinada(list(fusion.values()), headers={'ETag': etag} if etag else None)
+
+    def _cadena_dominios(self, origen, destino):
+        """Enlaces de borde (orientados) que llevan del dominio origen al destino, por BFS"""
+        vecinos = {}
+        for l in self.enlaces:
+            for a, pa, b, pb in ((l['src-switch'], l['src-port'], l['dst-switch'], l['dst-port']),
+                                 (l['dst-switch'], l['dst-port'], l['src-switch'], l['src-port'])):
+                vecinos.setdefault(self.indice_de(a), []).append(
+                    (self.indice_de(b), {'src-switch': a, 'src-port': pa, 'dst-switch': b, 'dst-port': pb}))
+        previo = {origen: None}
+        cola = deque([origen])
+        while cola:
+            dominio = cola.popleft()
+            if dominio == destino:
+                cadena = []
+                while previo[dominio] is not None:
+                    dominio, enlace = previo[dominio]
+                    cadena.append(enlace)
+                return cadena[::-1]
+            for siguiente, enlace in vecinos.get(dominio, []):
+                if siguiente not in previo:
+                    previo[siguiente] = (dominio, enlace)
+                    cola.append(siguiente)
+        return None
+
+    def ruta(self, src_switch, dst_switch, timeout=None):
+        """Ruta en formato /wm/path/; si cruza dominios se arma con tramos de cada dueño y enlaces de borde"""
+        origen, destino = self.indice_de(src_switch), self.indice_de(dst_switch)
+        if origen == destino:
+            return self.clientes[origen].get(f"/path/{src_switch}/{dst_switch}/json", timeout).get('path', [])
+        cadena = self._cadena_dominios(origen, destino)
+        if cadena is None:
+            return []
+        ruta, entrada = [], src_switch
+        for enlace in cadena + [None]:
+            salida = enlace['src-switch'] if enlace else dst_switch
+            if entrada != salida:
+                tramo = self.clientes[self.indice_de(entrada)].get(
+                    f"/path/{entrada}/{salida}/json", timeout).get('path', [])
+                if not tramo:
+                    return []
+                ruta += tramo
+            if enlace:
+                ruta += [{'switch': enlace['src-switch'], 'port': enlace['src-port']},
+                         {'switch': enlace['dst-switch'], 'port': enlace['dst-port']}]
+                entrada = enlace['dst-switch']
+        return ruta
+
+    def estado(self):
+        """Switches de cada controlador"""
+        return [{'url': cliente.base_url,
+                 'switches': sorted(dpid for dpid, i in self.duenos.items() if i == indice)}
+                for indice, cliente in enumerate(self.clientes)]
+
+def crear_cliente(urls, enlaces=()):
+    """Un solo controlador usa FloodlightClient; varios, un ControllerPool"""
+    if len(urls) == 1 and not enlaces:
+        return FloodlightClient(urls[0])
+    return ControllerPool([FloodlightClient(url) for url in urls], enlaces)
+
+fl_client = crear_cliente(FL_CONTROLADORES, FL_ENLACES_DOMINIO)
+
+# Tiempo de vida (segundos) de la tabla de dispositivos en caché
+DEVICE_CACHE_TTL = 30
+
+class DeviceCache:
+    """Tabla de dispositivos de Floodlight indexada por MAC y por IPv4"""
+    def __init__(self, ttl=DEVICE_CACHE_TTL):
+        self.ttl = ttl
+        self.por_mac = {}
+        self.por_ip = {}
+        self.actualizado = None
+        self.hits = 0
+        self.misses = 0
+
+    def expirado(self):
+        return self.actualizado is None or time.monotonic() - self.actualizado > self.ttl
+
+    def refrescar(self):
+        """Sondea el feed de dispositivos; los cambios llegan a aplicar_cambios por suscripción"""
+        device_feed.sondear()
+        self.actualizado = time.monotonic()
+
+    def _vigente(self, forzar):
+        if forzar or self.expirado():
+            self.misses += 1
+            self.refrescar()
+        else:
+            self.hits += 1
+
+    def buscar_por_mac(self, mac, forzar=False):
+        self._vigente(forzar)
+        return self.por_mac.get(mac, (None, None))
+
+    def buscar_por_ip(self, ip, forzar=False):
+        self._vigente(forzar)
+        return self.por_ip.get(ip, (None, None))
+
+    def aplicar_cambios(self, cambios):
+        """Actualiza solo los hosts nuevos, movidos o desaparecidos"""
+        for cambio in cambios:
+            for indice, claves in ((self.por_mac, cambio['macs']), (self.por_ip, cambio['ips_anteriores'])):
+                for clave in claves:
+                    if indice.get(clave) == cambio['anterior']:
+                        indice.pop(clave, None)
+            if cambio['punto'] is not None:
+                for mac in cambio['macs']:
+                    self.por_mac[mac] = cambio['punto']
+                for ip in cambio['ips']:
+                    self.por_ip[ip] = cambio['punto']
+
+    def invalidar(self):
+        self.actualizado = None
+
+device_cache = DeviceCache()
+
+class DeviceFeed:
+    """Sondea /wm/device/ y avisa a los suscriptores solo de los hosts nuevos, movidos o desaparecidos"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.suscriptores = []
+        # MACs del dispositivo -> (lastSeen, punto de conexión, IPs)
+        self.vistos = {}
+        self.etag = None
+        self.sondeos = 0
+        self.no_modificados = 0
+        self.cambios_emitidos = 0
+
+    def suscribir(self, funcion):
+        """funcion(cambios) recibe una lista de dicts con macs, ips, punto y punto anterior"""
+        self.suscriptores.append(funcion)
+
+    def sondear(self):
+        """Consulta los dispositivos y notifica los cambios; devuelve la lista de cambios"""
+        with self.lock:
+            # Si el controlador entrega ETag, la consulta es condicional y sin cambios no hay cuerpo
+            cabeceras = {'If-None-Match': self.etag} if self.etag else None
+            response = fl_client.request('GET', "/device/", headers=cabeceras)
+            self.sondeos += 1
+            if response.status_code == 304:
+                self.no_modificados += 1
+                return []
+            self.etag = response.headers.get('ETag')
+            cambios = self.diferencias(response.json())
+            self.cambios_emitidos += len(cambios)
+        for funcion in self.suscriptores:
+            funcion(cambios)
+        return cambios
+
+    def diferencias(self, devices):
+        """Compara con la consulta anterior; los hosts con el mismo lastSeen no se reexaminan"""
+        if isinstance(devices, dict):
+            devices = devices.get('devices', [])
+        cambios = []
+        presentes = set()
+        for device in devices:
+            clave = tuple(device.get('mac', []))
+            presentes.add(clave)
+            ultimo = device.get('lastSeen')
+            anterior = self.vistos.get(clave)
+            if anterior is not None and ultimo is not None and anterior[0] == ultimo:
+                continue
+            puntos = device.get('attachmentPoint')
+            punto = (puntos[0].get('switchDPID'), puntos[0].get('port')) if puntos else None
+            ips = tuple(device.get('ipv4', []))
+            self.vistos[clave] = (ultimo, punto, ips)
+            if anterior is None or anterior[1] != punto or anterior[2] != ips:
+                cambios.append({'macs': list(clave), 'ips': list(ips), 'punto': punto,
+                                'anterior': anterior[1] if anterior else None,
+                                'ips_anteriores': list(anterior[2]) if anterior else []})
+        for clave in set(self.vistos) - presentes:
+            _, punto, ips = self.vistos.pop(clave)
+            cambios.append({'macs': list(clave), 'ips': [], 'punto': None,
+                            'anterior': punto, 'ips_anteriores': list(ips)})
+        return cambios
+
+    def estadisticas(self):
+        return {
+            'dispositivos': len(self.vistos),
+            'sondeos': self.sondeos,
+            'no_modificados': self.no_modificados,
+            'cambios_emitidos': self.cambios_emitidos,
+        }
+
+device_feed = DeviceFeed()
+device_feed.suscribir(device_cache.aplicar_cambios)
+
+def get_attachment_point(mac, forzar=False):
     """Se obtiene el switch y puerto donde está conectado un host por su MAC"""
-    url = f"{FL_BASE_URL}/device/"
     try:
-        response = requests.get(url)
-        response.raise_for_status() 
-        
-        devices = response.json()
-        for device in devices:
-            if device.get('mac') and device['mac'][0] == mac:
-                if device.get('attachmentPoint'):
-                     # Obtener el primer punto de conexión del host
-                    attachment_point = device['attachmentPoint'][0]
-                    switch_dpid = attachment_point.get('switchDPID')
-                    port = attachment_point.get('port')
-                    return switch_dpid, port
-                
+        return device_cache.buscar_por_mac(mac, forzar)
     except requests.exceptions.RequestException as e:
         print(f"Ocurrió un error al obtener los puntos de conexión: {e}")
 
     return None, None
 
-def get_attachment_point_by_ip(host_ip):
+def get_attachment_point_by_ip(host_ip, forzar=False):
     """Se obtiene el switch y puerto donde está conectado un host por su IP"""
-    url = f"{FL_BASE_URL}/device/"
     try:
-        response = requests.get(url)
-        response.raise_for_status() 
-        
-        devices = response.json()
-        for device in devices:
-            # Buscar por IP en lugar de MAC
-            if device.get('ipv4') and len(device['ipv4']) > 0:
-                if device['ipv4'][0] == host_ip:
-                    if device.get('attachmentPoint'):
-                        # Obtener el primer punto de conexión del host
-                        attachment_point = device['attachmentPoint'][0]
-                        switch_dpid = attachment_point.get('switchDPID')
-                        port = attachment_point.get('port')
-                        return switch_dpid, port
-                
+        return device_cache.buscar_por_ip(host_ip, forzar)
     except requests.exceptions.RequestException as e:
         print(f"Ocurrió un error al obtener los puntos de conexión por IP: {e}")
 
     return None, None
 
-def get_route(src_switch, dst_switch):
+# Tamaño máximo de la caché de rutas y periodo mínimo entre consultas de topología
+PATH_CACHE_SIZE = 256
+TOPOLOGY_POLL_INTERVAL = 5
+
+class PathCache:
+    """Caché LRU de rutas (src_dpid, dst_dpid) invalidada por cambios de topología"""
+    def __init__(self, maxsize=PATH_CACHE_SIZE, intervalo=TOPOLOGY_POLL_INTERVAL):
+        self.maxsize = maxsize
+        self.intervalo = intervalo
+        self.rutas = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidaciones = 0
+        self.huella = None
+        self.ultima_consulta = None
+
+    def huella_topologia(self):
+        """Huella barata de la topología a partir de /wm/topology/links/json"""
+        enlaces = fl_client.get("/topology/links/json")
+        # La misma consulta mantiene al día el grafo del motor de rutas local
+        topologia.actualizar(enlaces)
+        return self.calcular_huella(enlaces)
+
+    @staticmethod
+    def calcular_huella(enlaces):
+        return hash(tuple(sorted(
+            (l.get('src-switch'), l.get('src-port'), l.get('dst-switch'), l.get('dst-port'))
+            for l in enlaces
+        )))
+
+    def toca_consultar(self):
+        """Indica si ya pasó el intervalo mínimo desde la última consulta de topología"""
+        ahora = time.monotonic()
+        if self.ultima_consulta is not None and ahora - self.ultima_consulta < self.intervalo:
+            return False
+        self.ultima_consulta = ahora
+        return True
+
+    def registrar_huella(self, huella):
+        if self.huella is not None and huella != self.huella:
+            self.invalidar()
+        self.huella = huella
+
+    def verificar_topologia(self):
+        """Vacía la caché si la topología cambió desde la última consulta"""
+        if self.toca_consultar():
+            self.registrar_huella(self.huella_topologia())
+
+    def obtener(self, src_switch, dst_switch, verificar=True):
+        if verificar:
+            self.verificar_topologia()
+        clave = (src_switch, dst_switch)
+        if clave in self.rutas:
+            self.rutas.move_to_end(clave)
+            self.hits += 1
+            return self.rutas[clave]
+        self.misses += 1
+        return None
+
+    def guardar(self, src_switch, dst_switch, ruta):
+        self.rutas[(src_switch, dst_switch)] = ruta
+        self.rutas.move_to_end((src_switch, dst_switch))
+        while len(self.rutas) > self.maxsize:
+            self.rutas.popitem(last=False)
+
+    def invalidar(self):
+        self.rutas.clear()
+        self.invalidaciones += 1
+
+    def estadisticas(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidaciones': self.invalidaciones,
+            'tamaño': len(self.rutas),
+        }
+
+path_cache = PathCache()
+
+# Motor de rutas por defecto: "rest" consulta /wm/path, "local" calcula sobre el grafo en caché
+# y "balanceado" elige, entre las k rutas más cortas del grafo, la de enlaces menos cargados
+ROUTING_ENGINE = "rest"
+
+class TopologyGraph:
+    """Grafo de switches construido a partir de /wm/topology/links/json"""
+    def __init__(self):
+        self.enlaces = set()
+        self.adyacencia = {}
+        self.arboles = {}
+        self.alternativas = {}
+
+    @staticmethod
+    def _clave(l):
+        return (l.get('src-switch'), l.get('src-port'), l.get('dst-switch'), l.get('dst-port'))
+
+    def _agregar(self, enlace):
+        src, src_port, dst, dst_port = enlace
+        # Los enlaces de Floodlight son bidireccionales
+        self.adyacencia.setdefault(src, []).append((dst, src_port, dst_port))
+        self.adyacencia.setdefault(dst, []).append((src, dst_port, src_port))
+
+    def _quitar(self, enlace):
+        src, src_port, dst, dst_port = enlace
+        for a, b, pa, pb in ((src, dst, src_port, dst_port), (dst, src, dst_port, src_port)):
+            vecinos = self.adyacencia.get(a, [])
+            if (b, pa, pb) in vecinos:
+                vecinos.remove((b, pa, pb))
+
+    def actualizar(self, enlaces):
+        """Aplica solo los enlaces nuevos y caídos; devuelve True si el grafo cambió"""
+        nuevos = {self._clave(l) for l in enlaces}
+        agregados = nuevos - self.enlaces
+        caidos = self.enlaces - nuevos
+        for enlace in caidos:
+            self._quitar(enlace)
+        for enlace in agregados:
+            self._agregar(enlace)
+        self.enlaces = nuevos
+        if agregados or caidos:
+            self.arboles.clear()
+            self.alternativas.clear()
+            return True
+        return False
+
+    def arbol(self, destino):
+        """BFS desde el destino: para cada switch, el enlace por el que sale hacia él"""
+        if destino not in self.arboles:
+            siguiente = {destino: None}
+            frontera = deque([destino])
+            while frontera:
+                actual = frontera.popleft()
+                for vecino, puerto_actual, puerto_vecino in sorted(self.adyacencia.get(actual, []), key=str):
+                    if vecino not in siguiente:
+                        siguiente[vecino] = (actual, puerto_vecino, puerto_actual)
+                        frontera.append(vecino)
+            self.arboles[destino] = siguiente
+        return self.arboles[destino]
+
+    def precalcular(self, destinos):
+        """Calcula de antemano los árboles hacia los switches de los servidores"""
+        for destino in destinos:
+            self.arbol(destino)
+
+    def ruta(self, src_switch, dst_switch):
+        """Ruta más corta en saltos con el mismo formato [{switch, port}] que /wm/path"""
+        siguiente = self.arbol(dst_switch)
+        if src_switch not in siguiente:
+            return []
+        ruta = []
+        actual = src_switch
+        while actual != dst_switch:
+            vecino, puerto_salida, puerto_entrada = siguiente[actual]
+            ruta.append({'switch': actual, 'port': puerto_salida})
+            ruta.append({'switch': vecino, 'port': puerto_entrada})
+            actual = vecino
+        return ruta
+
+    def _bfs(self, src_switch, dst_switch, nodos_vetados, enlaces_vetados):
+        """Camino más corto como lista de enlaces (u, puerto_u, v, puerto_v) evitando los vetados"""
+        previo = {src_switch: None}
+        frontera = deque([src_switch])
+        while frontera:
+            actual = frontera.popleft()
+            if actual == dst_switch:
+                camino = []
+                while previo[actual] is not None:
+                    camino.append(previo[actual])
+                    actual = previo[actual][0]
+                return camino[::-1]
+            for vecino, puerto_actual, puerto_vecino in sorted(self.adyacencia.get(actual, []), key=str):
+                enlace = (actual, puerto_actual, vecino, puerto_vecino)
+                if vecino in previo or vecino in nodos_vetados or enlace in enlaces_vetados:
+                    continue
+                previo[vecino] = enlace
+                frontera.append(vecino)
+        return None
+
+    def k_rutas(self, src_switch, dst_switch, k):
+        """Hasta k rutas sin ciclos ordenadas por cantidad de saltos (algoritmo de Yen)"""
+        clave = (src_switch, dst_switch, k)
+        if clave not in self.alternativas:
+            primera = self._bfs(src_switch, dst_switch, set(), set())
+            elegidas = [primera] if primera else []
+            candidatas = []
+            while elegidas and len(elegidas) < k:
+                previa = elegidas[-1]
+                for i in range(len(previa)):
+                    raiz = previa[:i]
+                    enlaces_vetados = {c[i] for c in elegidas if len(c) > i and c[:i] == raiz}
+                    nodos_vetados = {enlace[0] for enlace in raiz}
+                    desvio = self._bfs(previa[i][0], dst_switch, nodos_vetados, enlaces_vetados)
+                    if desvio and raiz + desvio not in elegidas and raiz + desvio not in candidatas:
+                        candidatas.append(raiz + desvio)
+                if not candidatas:
+                    break
+                candidatas.sort(key=len)
+                elegidas.append(candidatas.pop(0))
+            self.alternativas[clave] = [
+                [punto for u, pu, v, pv in camino for punto in ({'switch': u, 'port': pu}, {'switch': v, 'port': pv})]
+                for camino in elegidas]
+        return self.alternativas[clave]
+
+topologia = TopologyGraph()
+
+# Selección balanceada: entre K_RUTAS candidatas se elige la de enlaces menos cargados
+K_RUTAS = 4
+# Si está activo, el tráfico medido en los puertos también cuenta como carga
+LINK_LOAD_PORT_STATS = False
+PORT_STATS_TTL = 10
+# Cada tantos bits por segundo observados en un enlace equivalen a una conexión más
+PORT_STATS_BPS_POR_CONEXION = 1_000_000
+
+def _enlace(a, b):
+    """Enlace no dirigido entre dos extremos (switch, puerto)"""
+    a = (a[0], str(_numero_puerto(a[1])))
+    b = (b[0], str(_numero_puerto(b[1])))
+    return (a, b) if a <= b else (b, a)
+
+def enlaces_de_ruta(ruta):
+    return [_enlace((ruta[i]['switch'], ruta[i]['port']), (ruta[i + 1]['switch'], ruta[i + 1]['port']))
+            for i in range(0, len(ruta) - 1, 2)]
+
+def enlaces_de_hops(hops):
+    return [_enlace((a[0], a[2]), (b[0], b[1])) for a, b in zip(hops, hops[1:])]
+
+class LinkLoad:
+    """Cantidad de conexiones fijadas a cada enlace entre switches"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.por_enlace = {}
+        self.por_conexion = {}
+        self.bps = {}
+        self.ultima_medicion = 0
+
+    def asignar(self, handler, hops):
+        """Fija la conexión a los enlaces de sus hops, reemplazando los que tuviera antes"""
+        with self.lock:
+            self._liberar(handler)
+            enlaces = enlaces_de_hops(hops or [])
+            self.por_conexion[handler] = enlaces
+            for enlace in enlaces:
+                self.por_enlace[enlace] = self.por_enlace.get(enlace, 0) + 1
+
+    def _liberar(self, handler):
+        for enlace in self.por_conexion.pop(handler, ()):
+            restantes = self.por_enlace.get(enlace, 0) - 1
+            if restantes > 0:
+                self.por_enlace[enlace] = restantes
+            else:
+                self.por_enlace.pop(enlace, None)
+
+    def liberar(self, handler):
+        with self.lock:
+            self._liberar(handler)
+
+    def reconstruir(self, conexiones):
+        self.limpiar()
+        for conexion in conexiones:
+            self.asignar(conexion.handler, conexion.hops)
+
+    def limpiar(self):
+        with self.lock:
+            self.por_enlace.clear()
+            self.por_conexion.clear()
+
+    def medir_puertos(self, forzar=False):
+        """Ancho de banda por puerto según /wm/statistics (requiere las estadísticas habilitadas)"""
+        if not forzar and time.monotonic() - self.ultima_medicion < PORT_STATS_TTL:
+            return self.bps
+        bps = {}
+        for p in fl_client.get("/statistics/bandwidth/all/all/json") or []:
+            try:
+                total = int(p.get('bits-per-second-rx', 0)) + int(p.get('bits-per-second-tx', 0))
+            except (TypeError, ValueError):
+                continue
+            bps[(p.get('dpid'), str(p.get('port')))] = total
+        self.bps = bps
+        self.ultima_medicion = time.monotonic()
+        return bps
+
+    def carga(self, enlace):
+        """Conexiones en el enlace, más el tráfico medido si LINK_LOAD_PORT_STATS está activo"""
+        carga = self.por_enlace.get(enlace, 0)
+        if LINK_LOAD_PORT_STATS:
+            carga += max(self.bps.get(extremo, 0) for extremo in enlace) / PORT_STATS_BPS_POR_CONEXION
+        return carga
+
+    def elegir(self, candidatas):
+        """Ruta candidata cuyo enlace más cargado tenga menos carga (desempata la suma y el largo)"""
+        if not candidatas:
+            return []
+        if LINK_LOAD_PORT_STATS:
+            try:
+                self.medir_puertos()
+            except requests.exceptions.RequestException as e:
+                print(f"Error al obtener estadísticas de puertos: {e}")
+        with self.lock:
+            def costo(ruta):
+                cargas = [self.carga(enlace) for enlace in enlaces_de_ruta(ruta)]
+                return (max(cargas, default=0), sum(cargas), len(cargas))
+            return min(candidatas, key=costo)
+
+    def tabla(self, enlaces=()):
+        """Carga por enlace, de mayor a menor; incluye en cero los enlaces indicados"""
+        with self.lock:
+            todos = list(set(self.por_enlace) | set(enlaces))
+            filas = [{'enlace': f"{a[0]}:{a[1]} <-> {b[0]}:{b[1]}",
+                      'conexiones': self.por_enlace.get((a, b), 0),
+                      'carga': round(self.carga((a, b)), 3)}
+                     for a, b in todos]
+            if self.bps:
+                for fila, (a, b) in zip(filas, todos):
+                    fila['bps'] = max(self.bps.get(a, 0), self.bps.get(b, 0))
+        return sorted(filas, key=lambda f: (-f['carga'], f['enlace']))
+
+carga_enlaces = LinkLoad()
+
+def tabla_carga_enlaces(puertos=False):
+    """Tabla de carga de todos los enlaces conocidos de la topología"""
+    try:
+        path_cache.verificar_topologia()
+    except requests.exceptions.RequestException as e:
+        print(f"Error al verificar la topología: {e}")
+    if puertos:
+        try:
+            carga_enlaces.medir_puertos(forzar=True)
+        except requests.exceptions.RequestException as e:
+            print(f"Error al obtener estadísticas de puertos: {e}")
+    enlaces = [_enlace((src, sp), (dst, dp)) for src, sp, dst, dp in topologia.enlaces]
+    return carga_enlaces.tabla(enlaces)
+
+def get_route(src_switch, dst_switch, motor=None):
     """Obtiene la ruta entre dos switches"""
-    url = f"{FL_BASE_URL}/path/{src_switch}/{dst_switch}/json"
+    motor = motor or ROUTING_ENGINE
+    if motor in ("local", "balanceado"):
+        try:
+            path_cache.verificar_topologia()
+        except Exception as e:
+            print(f"Error al verificar la topología: {e}")
+        if motor == "balanceado":
+            return carga_enlaces.elegir(topologia.k_rutas(src_switch, dst_switch, K_RUTAS))
+        return topologia.ruta(src_switch, dst_switch)
+
+    try:
+        ruta = path_cache.obtener(src_switch, dst_switch)
+        if ruta is not None:
+            return ruta
+    except Exception as e:
+        print(f"Error al verificar la topología: {e}")
+
     try:
-        response = requests.get(url)
-        return response.json().get('path', [])
+        ruta = fl_client.get(f"/path/{src_switch}/{dst_switch}/json").get('path', [])
     except Exception as e:
         print(f"Error al obtener ruta: {e}")
         return []
 
-def build_route(conexion, alumnos, cursos, servidores):
-    """Crea los flows necesarios para una conexión"""
-    # Validar autorización
-    alumno = next((a for a in alumnos if a.mac == conexion.alumno_mac), None)
-    if not alumno:
-        print("Alumno no encontrado")
+    if ruta:
+        path_cache.guardar(src_switch, dst_switch, ruta)
+    return ruta
+
+# Flows instalados a través del Static Flow Pusher de Floodlight
+FLOW_PRIORITY = "32768"
+FLOW_PUSH_WORKERS = FL_POOL_SIZE
+IP_PROTO = {'TCP': '0x06', 'UDP': '0x11'}
+
+def _numero_puerto(port):
+    """Floodlight puede devolver el puerto como número o como diccionario"""
+    if isinstance(port, dict):
+        return port.get('portNumber', port.get('shortPortNumber'))
+    return port
+
+def construir_hops(src_switch, src_port, ruta, dst_switch, dst_port):
+    """Convierte la ruta en una lista de (switch, puerto_entrada, puerto_salida)"""
+    puntos = [{'switch': src_switch, 'port': src_port}] + list(ruta) + \
+             [{'switch': dst_switch, 'port': dst_port}]
+
+    hops = []
+    for punto in puntos:
+        switch = punto['switch']
+        port = str(_numero_puerto(punto['port']))
+        if hops and hops[-1][0] == switch:
+            hops[-1][2] = port
+        else:
+            hops.append([switch, port, port])
+    return [tuple(hop) for hop in hops]
+
+def construir_flows_hop(conexion, hop):
+    """Flows de ida y vuelta de la conexión en un switch de la ruta (el ARP va aparte, por alumno y servidor)"""
+    switch, in_port, out_port = hop
+    # Una ruta pasa una sola vez por cada switch, así que el DPID identifica el salto
+    prefijo = f"{conexion.handler}_{str(switch).replace(':', '')}"
+    servicio = conexion.servicio
+    protocolo = str(servicio.protocolo).upper()
+    campo = 'udp' if protocolo == 'UDP' else 'tcp'
+
+    base = {'switch': switch, 'priority': FLOW_PRIORITY, 'active': 'true'}
+    return [
+        dict(base,
+            name=f"{prefijo}_fwd", in_port=in_port,
+            eth_type='0x0800', eth_src=conexion.alumno_mac, ipv4_dst=conexion.servidor_ip,
+            ip_proto=IP_PROTO.get(protocolo, '0x06'), **{f'{campo}_dst': str(servicio.puerto)},
+            actions=f"output={out_port}"),
+        dict(base,
+            name=f"{prefijo}_rev", in_port=out_port,
+            eth_type='0x0800', eth_dst=conexion.alumno_mac, ipv4_src=conexion.servidor_ip,
+            ip_proto=IP_PROTO.get(protocolo, '0x06'), **{f'{campo}_src': str(servicio.puerto)},
+            actions=f"output={in_port}"),
+    ]
+
+def construir_flows(conexion, hops):
+    """Genera los flows de ida y vuelta de cada salto de la conexión"""
+    return [flow for hop in hops for flow in construir_flows_hop(conexion, hop)]
+
+def construir_flows_arp(clave, in_port, out_port):
+    """Flows ARP de un alumno (o de todos, si la MAC está vacía) hacia un servidor en un switch"""
+    switch, _, alumno_mac, servidor_ip = clave
+    origen = alumno_mac.replace(':', '') if alumno_mac else 'any'
+    prefijo = f"arp_{origen}_{servidor_ip}_{str(switch).replace(':', '')}"
+    prioridad = FLOW_PRIORITY if alumno_mac else FLOW_PRIORITY_COMPARTIDO
+    alumno = {'eth_src': alumno_mac} if alumno_mac else {}
+    # La respuesta del servidor se filtra por el destino para no pisar la de otros alumnos
+    respuesta = {'eth_dst': alumno_mac} if alumno_mac else {}
+
+    base = {'switch': switch, 'priority': prioridad, 'active': 'true'}
+    return [
+        dict(base,
+            name=f"{prefijo}_fwd", in_port=in_port,
+            eth_type='0x0806', arp_tpa=servidor_ip, **alumno,
+            actions=f"output={out_port}"),
+        dict(base,
+            name=f"{prefijo}_rev", in_port=out_port,
+            eth_type='0x0806', arp_spa=servidor_ip, **respuesta,
+            actions=f"output={in_port}"),
+    ]
+
+# Agregación: fuera del switch del alumno, las conexiones al mismo servicio que atraviesan un
+# switch por los mismos puertos comparten sus flows, que no filtran por MAC
+FLOW_AGGREGATION = False
+# Los flows propios de cada alumno tienen prioridad sobre los compartidos
+FLOW_PRIORITY_COMPARTIDO = "32767"
+
+def construir_flows_compartidos(clave):
+    """Flows de ida y vuelta de un salto compartido, sin MAC del alumno"""
+    switch, in_port, out_port, servidor_ip, protocolo, puerto = clave
+    prefijo = f"agg_{servidor_ip}_{protocolo.lower()}{puerto}_{str(switch).replace(':', '')}_{in_port}_{out_port}"
+    campo = 'udp' if protocolo == 'UDP' else 'tcp'
+
+    base = {'switch': switch, 'priority': FLOW_PRIORITY_COMPARTIDO, 'active': 'true'}
+    return [
+        dict(base,
+            name=f"{prefijo}_fwd", in_port=in_port,
+            eth_type='0x0800', ipv4_dst=servidor_ip,
+            ip_proto=IP_PROTO.get(protocolo, '0x06'), **{f'{campo}_dst': puerto},
+            actions=f"output={out_port}"),
+        dict(base,
+            name=f"{prefijo}_rev", in_port=out_port,
+            eth_type='0x0800', ipv4_src=servidor_ip,
+            ip_proto=IP_PROTO.get(protocolo, '0x06'), **{f'{campo}_src': puerto},
+            actions=f"output={in_port}"),
+    ]
+
+def es_clave_arp(clave):
+    return len(clave) == 4
+
+class FlowAggregator:
+    """Saltos compartidos entre conexiones y flows ARP por alumno y servidor, con conteo de referencias"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.grupos = {}
+        self.por_conexion = {}
+        # Clave ARP -> (puerto de entrada, puerto de salida) con que están instalados sus flows, y
+        # los puertos del salto de cada conexión que lo usa
+        self.arp = {}
+        self.arp_puertos = {}
+        # (switch, servidor, puerto de entrada) -> [puerto de salida, grupos] y viceversa; sin
+        # MAC, dos grupos del mismo servidor que discrepen en un puerto serían ambiguos
+        self.salidas = {}
+        self.entradas = {}
+
+    @staticmethod
+    def clave(conexion, hop):
+        switch, in_port, out_port = hop
+        servicio = conexion.servicio
+        return (switch, str(in_port), str(out_port), conexion.servidor_ip,
+                str(servicio.protocolo).upper(), str(servicio.puerto))
+
+    @staticmethod
+    def clave_arp(conexion, hop, compartido=False):
+        """(switch, 'arp', MAC, servidor): el ARP no depende del servicio, así que lo comparten
+        todas las conexiones del alumno al servidor (o todas, en un salto compartido)"""
+        return (hop[0], 'arp', '' if compartido else conexion.alumno_mac.lower(), conexion.servidor_ip)
+
+    def flows_de(self, clave):
+        if es_clave_arp(clave):
+            return construir_flows_arp(clave, *self.arp[clave])
+        return construir_flows_compartidos(clave)
+
+    def _indexar(self, clave, delta):
+        switch, in_port, out_port, servidor_ip = clave[:4]
+        for indice, k, valor in ((self.salidas, (switch, servidor_ip, in_port), out_port),
+                                 (self.entradas, (switch, servidor_ip, out_port), in_port)):
+            entrada = indice.setdefault(k, [valor, 0])
+            entrada[1] += delta
+            if entrada[1] <= 0:
+                del indice[k]
+
+    def _compatible(self, clave):
+        switch, in_port, out_port, servidor_ip = clave[:4]
+        return self.salidas.get((switch, servidor_ip, in_port), [out_port])[0] == out_port and \
+            self.entradas.get((switch, servidor_ip, out_port), [in_port])[0] == in_port
+
+    def unir(self, handler, clave, hop=None, repuntar=True):
+        """Suma la conexión al grupo; devuelve (compartido, flows a instalar). Un grupo ARP sigue
+        los puertos del salto de la última conexión que se une (salvo con repuntar=False); si
+        cambian, sus flows se devuelven para reinstalarlos con el mismo nombre"""
+        with self.lock:
+            nuevo = clave not in self.grupos
+            if es_clave_arp(clave):
+                puertos = (str(hop[1]), str(hop[2]))
+                self.arp_puertos.setdefault(clave, {})[handler] = puertos
+                if nuevo or (repuntar and self.arp[clave] != puertos):
+                    self.arp[clave] = puertos
+                    nuevo = True
+            elif nuevo:
+                if not self._compatible(clave):
+                    return False, []
+                self._indexar(clave, 1)
+            self.grupos.setdefault(clave, set()).add(handler)
+            self.por_conexion.setdefault(handler, set()).add(clave)
+            return True, self.flows_de(clave) if nuevo else []
+
+    def soltar(self, handler, claves):
+        """Quita la conexión de los grupos; devuelve (flows que ya nadie usa, flows ARP a
+        reinstalar porque seguían los puertos de esta conexión y las que quedan van por otros)"""
+        huerfanos, repuntes = [], []
+        with self.lock:
+            propias = self.por_conexion.get(handler, set())
+            for clave in list(claves):
+                if clave not in propias:
+                    continue
+                propias.discard(clave)
+                usuarios = self.grupos.get(clave)
+                usuarios.discard(handler)
+                if es_clave_arp(clave):
+                    puertos = self.arp_puertos[clave]
+                    puertos.pop(handler, None)
+                    if usuarios and self.arp[clave] not in puertos.values():
+                        self.arp[clave] = next(iter(puertos.values()))
+                        repuntes += self.flows_de(clave)
+                if not usuarios:
+                    huerfanos += [{'switch': f['switch'], 'name': f['name']} for f in self.flows_de(clave)]
+                    del self.grupos[clave]
+                    if es_clave_arp(clave):
+                        del self.arp[clave]
+                        del self.arp_puertos[clave]
+                    else:
+                        self._indexar(clave, -1)
+            if not propias:
+                self.por_conexion.pop(handler, None)
+        return huerfanos, repuntes
+
+    def claves_de(self, handler):
+        with self.lock:
+            return set(self.por_conexion.get(handler, ()))
+
+    def reconstruir(self, conexiones):
+        """Recupera los grupos a partir de las claves que cada conexión guardó al instalarse"""
+        self.limpiar()
+        conexiones = list(conexiones)
+        for conexion in conexiones:
+            hops = {hop[0]: hop for hop in conexion.hops or []}
+            for clave in conexion.grupos:
+                # Se conservan los puertos de la primera conexión, que es la que los instaló
+                if es_clave_arp(clave) and clave[0] in hops:
+                    self.unir(conexion.handler, clave, hops[clave[0]], repuntar=False)
+        if not FLOW_AGGREGATION:
+            return
+        for conexion in conexiones:
+            for clave in conexion.grupos:
+                if not es_clave_arp(clave):
+                    self.unir(conexion.handler, clave)
+
+    def limpiar(self):
+        with self.lock:
+            self.grupos.clear()
+            self.por_conexion.clear()
+            self.arp.clear()
+            self.arp_puertos.clear()
+            self.salidas.clear()
+            self.entradas.clear()
+
+    def reporte(self, conexiones):
+        """Entradas de tabla de flujo usadas frente a las que haría falta sin agregación"""
+        # Sin agregar, cada salto lleva dos flows IP y dos ARP por conexión
+        sin_agregar = sum(4 * len(c.hops or []) for c in conexiones)
+        propios = sum(len(c.flows) for c in conexiones)
+        with self.lock:
+            compartidos = 2 * len(self.grupos)
+            referencias = sum(len(u) for k, u in self.grupos.items() if not es_clave_arp(k))
+            arp = len(self.arp)
+            grupos = len(self.grupos) - arp
+        return {'grupos': grupos, 'grupos_arp': arp, 'referencias': referencias, 'flows_propios': propios,
+                'flows_compartidos': compartidos, 'flows_sin_agregar': sin_agregar,
+                'ahorrados': sin_agregar - propios - compartidos}
+
+flows_compartidos = FlowAggregator()
+
+def soltar_grupos(handler, claves=None):
+    """Suelta los grupos compartidos de la conexión (todos si claves es None), reinstala los ARP que
+    siguen en uso por otro camino y devuelve los flows que ya nadie usa, para retirarlos"""
+    if claves is None:
+        claves = flows_compartidos.claves_de(handler)
+    huerfanos, repuntes = flows_compartidos.soltar(handler, claves)
+    for nombre, error in push_flows(repuntes)[1] if repuntes else ():
+        print(f"Error al reinstalar el flow {nombre}: {error}")
+    return huerfanos
+
+def preparar_flows(conexion, hops, switches=None, agregador=None):
+    """Flows propios y compartidos nuevos de los saltos indicados (todos si switches es None);
+    devuelve (propios, compartidos, claves de los grupos a los que se unió)"""
+    agregador = agregador or flows_compartidos
+    propios, compartidos, claves = [], [], []
+    for i, hop in enumerate(hops):
+        if switches is not None and hop[0] not in switches:
+            continue
+        # El primer salto es el switch del alumno: sus flows siempre filtran por su MAC
+        compartido = False
+        if FLOW_AGGREGATION and i > 0:
+            clave = FlowAggregator.clave(conexion, hop)
+            compartido, nuevos = agregador.unir(conexion.handler, clave)
+            if compartido:
+                compartidos += nuevos
+                claves.append(clave)
+        if not compartido:
+            propios += construir_flows_hop(conexion, hop)
+        clave = FlowAggregator.clave_arp(conexion, hop, compartido)
+        _, nuevos = agregador.unir(conexion.handler, clave, hop)
+        compartidos += nuevos
+        claves.append(clave)
+    return propios, compartidos, claves
+
+def push_flows(flows, max_workers=FLOW_PUSH_WORKERS):
+    """Envía los flows en paralelo; devuelve (instalados, errores)"""
+    instalados = []
+    errores = []
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futuros = {executor.submit(fl_client.post, "/staticflowpusher/json", flow): flow
+                   for flow in flows}
+        for futuro in futures.as_completed(futuros):
+            flow = futuros[futuro]
+            try:
+                futuro.result()
+                instalados.append(flow)
+            except requests.exceptions.RequestException as e:
+                errores.append((flow['name'], str(e)))
+    return instalados, errores
+
+def delete_flows(flows):
+    """Elimina en paralelo los flows indicados (por nombre); devuelve los errores"""
+    errores = []
+    with futures.ThreadPoolExecutor(max_workers=FLOW_PUSH_WORKERS) as executor:
+        futuros = {executor.submit(fl_client.delete, "/staticflowpusher/json", {'name': flow['name']}): flow
+                   for flow in flows}
+        for futuro in futures.as_completed(futuros):
+            try:
+                futuro.result()
+            except requests.exceptions.RequestException as e:
+                errores.append((futuros[futuro]['name'], str(e)))
+    return errores
+
+def install_route(conexion, hops):
+    """Instala los flows de la conexión; si alguno falla se retiran los ya instalados"""
+    flows, compartidos, claves = preparar_flows(conexion, hops)
+    carga_enlaces.asignar(conexion.handler, hops)
+    instalados, errores = push_flows(flows + compartidos)
+    if errores:
+        for nombre, error in errores:
+            print(f"Error al instalar el flow {nombre}: {error}")
+        nombres = {f['name'] for f in instalados}
+        huerfanos = [f for f in soltar_grupos(conexion.handler, claves) if f['name'] not in nombres]
+        delete_flows(instalados + huerfanos)
+        carga_enlaces.liberar(conexion.handler)
         return False
+
+    conexion.hops = hops
+    conexion.flows = [{'switch': f['switch'], 'name': f['name']} for f in flows]
+    conexion.grupos = claves
+    return True
+
+def actualizar_hops(conexion, hops):
+    """Reinstala solo los saltos que cambiaron; devuelve la cantidad de saltos tocados o None si falla"""
+    anteriores = {h[0]: tuple(h) for h in conexion.hops}
+    hops = [tuple(h) for h in hops]
+    nuevos = {h[0]: h for h in hops}
+    cambiados = {switch for switch, hop in nuevos.items() if anteriores.get(switch) != hop}
+    cambiados.update(set(anteriores) - set(nuevos))
+    if not cambiados:
+        return 0
+
+    # Primero se instalan los saltos nuevos; los flows viejos se retiran solo si todos entraron,
+    # así el tráfico sigue por la ruta anterior mientras tanto
+    viejos = [f for f in conexion.flows if f['switch'] in cambiados]
+    claves_viejas = {c for c in flows_compartidos.claves_de(conexion.handler) if c[0] in cambiados}
+    propios, compartidos, claves = preparar_flows(conexion, hops, cambiados)
+    nombres_propios = {f['name'] for f in propios}
+    instalados, errores = push_flows(propios + compartidos)
+
+    if errores:
+        for nombre, error in errores:
+            print(f"Error al instalar el flow {nombre}: {error}")
+        _restaurar_hops(conexion, anteriores, cambiados, viejos, claves_viejas, claves,
+                        [f for f in instalados if f['name'] in nombres_propios])
+        return None
+
+    a_borrar = [f for f in viejos if f['name'] not in nombres_propios]
+    a_borrar += soltar_grupos(conexion.handler, claves_viejas - set(claves))
+    for nombre, error in delete_flows(a_borrar):
+        print(f"Error al eliminar el flow {nombre}: {error}")
+    conservados = [f for f in conexion.flows if f['switch'] not in cambiados]
+    conexion.flows = conservados + [{'switch': f['switch'], 'name': f['name']} for f in propios]
+    conexion.grupos = list(flows_compartidos.claves_de(conexion.handler))
+    conexion.hops = hops
+    carga_enlaces.asignar(conexion.handler, hops)
+    return len(cambiados)
+
+def _restaurar_hops(conexion, anteriores, cambiados, viejos, claves_viejas, claves, instalados):
+    """Deja los saltos cambiados como estaban antes de un actualizar_hops que falló"""
+    a_borrar = soltar_grupos(conexion.handler, set(claves) - claves_viejas)
+    # Los flows ARP que siguen en uso vuelven a los puertos de los saltos anteriores
+    a_reinstalar = []
+    for clave in claves_viejas & set(claves):
+        if es_clave_arp(clave):
+            a_reinstalar += flows_compartidos.unir(conexion.handler, clave, anteriores[clave[0]])[1]
+    # Los flows propios con el mismo nombre se reemplazaron y se vuelven a enviar como eran
+    nombres_viejos = {f['name'] for f in viejos}
+    a_reinstalar += [f for switch in cambiados if switch in anteriores
+                     for f in construir_flows_hop(conexion, anteriores[switch]) if f['name'] in nombres_viejos]
+    a_borrar += [f for f in instalados if f['name'] not in nombres_viejos]
+    for nombre, error in push_flows(a_reinstalar)[1]:
+        print(f"Error al restaurar el flow {nombre}: {error}")
+    for nombre, error in delete_flows(a_borrar):
+        print(f"Error al eliminar el flow {nombre}: {error}")
+    conexion.grupos = list(flows_compartidos.claves_de(conexion.handler))
+
+class PolicyIndex:
+    """Políticas compiladas: (alumno, servidor, servicio) -> cursos DICTANDO que lo permiten"""
+    def __init__(self):
+        self.permisos = {}
+        self.por_curso = {}
+        # Permisos que ningún curso otorga ya; el motor de revocación los consume
+        self.perdidos = set()
+
+    def reconstruir(self, cursos):
+        anteriores = set(self.permisos)
+        self.permisos.clear()
+        self.por_curso.clear()
+        for curso in cursos:
+            self.indexar_curso(curso)
+        self.perdidos |= anteriores - set(self.permisos)
+
+    def quitar_curso(self, codigo_curso):
+        for clave in self.por_curso.pop(codigo_curso, ()):
+            otorgantes = self.permisos.get(clave)
+            if otorgantes is not None:
+                otorgantes.discard(codigo_curso)
+                if not otorgantes:
+                    del self.permisos[clave]
+                    self.perdidos.add(clave)
+
+    def indexar_curso(self, curso):
+        """Vuelve a compilar solo las entradas que otorga este curso"""
+        self.quitar_curso(curso.codigo)
+        if curso.estado != "DICTANDO":
+            return
+        claves = set()
+        for codigo_alumno in curso.alumnos:
+            for srv in curso.servidores:
+                for nombre_servicio in srv.get('servicios_permitidos', []):
+                    claves.add((codigo_alumno, srv['nombre'], nombre_servicio))
+        for clave in claves:
+            self.permisos.setdefault(clave, set()).add(curso.codigo)
+        self.por_curso[curso.codigo] = claves
+        self.perdidos -= claves
+
+    def tomar_perdidos(self):
+        perdidos, self.perdidos = self.perdidos, set()
+        return perdidos
+
+    def autorizado(self, codigo_alumno, nombre_servidor, nombre_servicio):
+        return (codigo_alumno, nombre_servidor, nombre_servicio) in self.permisos
+
+    def por_que(self, codigo_alumno, nombre_servidor, nombre_servicio):
+        """Cursos que otorgan el acceso (lista vacía si no está permitido)"""
+        return sorted(self.permisos.get((codigo_alumno, nombre_servidor, nombre_servicio), ()))
+
+politicas = PolicyIndex()
+
+def autorizar_conexion(conexion):
+    """Devuelve (alumno, servidor, error); error es None si la conexión está autorizada"""
+    alumno = alumnos.buscar('mac', conexion.alumno_mac)
+    if not alumno:
+        return None, None, "Alumno no encontrado"
     
     # Buscar servidor
-    servidor = next((s for s in servidores if s.ip == conexion.servidor_ip), None)
+    servidor = servidores.buscar('ip', conexion.servidor_ip)
     if not servidor:
-        print("Servidor no encontrado")
-        return False
+        return alumno, None, "Servidor no encontrado"
     
     # Verificar si el alumno tiene acceso al servicio
-    autorizado = False
-    for curso in cursos:
-        if curso.estado == "DICTANDO" and alumno.codigo in curso.alumnos:
-            for srv in curso.servidores:
-                # srv es un diccionario, no un objeto
-                if srv['nombre'] == servidor.nombre:
-                    # Acceder a servicios_permitidos como clave del diccionario
-                    servicios_permitidos = srv.get('servicios_permitidos', [])
-                    for servicio_permitido in servicios_permitidos:
-                        if servicio_permitido == conexion.servicio.nombre:
-                            autorizado = True
-                            break
-                    if autorizado:
-                        break
-            if autorizado:
-                break
-    
-    if not autorizado:
-        print("Alumno no autorizado para este servicio")
+    if not politicas.autorizado(alumno.codigo, servidor.nombre, conexion.servicio.nombre):
+        return alumno, servidor, "Alumno no autorizado para este servicio"
+
+    return alumno, servidor, None
+
+def build_route(conexion, alumnos, cursos, servidores, motor=None):
+    """Crea los flows necesarios para una conexión"""
+    with metricas.cronometro('sdn_build_route_segundos', etapa='total'):
+        ok = _build_route(conexion, motor)
+    metricas.incrementar('sdn_build_route_total', resultado='ok' if ok else 'error')
+    return ok
+
+def _build_route(conexion, motor):
+    # Validar autorización
+    with metricas.cronometro('sdn_build_route_segundos', etapa='autorizacion'):
+        alumno, servidor, error = autorizar_conexion(conexion)
+    if error:
+        print(error)
         return False
     
     # Obtener puntos de conexión
-    src_switch, src_port = get_attachment_point(conexion.alumno_mac)
-    dst_switch, dst_port = get_attachment_point_by_ip(servidor.ip) 
+    with metricas.cronometro('sdn_build_route_segundos', etapa='dispositivos'):
+        src_switch, src_port = get_attachment_point(conexion.alumno_mac)
+        dst_switch, dst_port = get_attachment_point_by_ip(servidor.ip) 
        
     if not src_switch or not dst_switch:
         print("No se pudo determinar la ubicación de los hosts")
         return False
     
-    # Obtener ruta
-    ruta = get_route(src_switch, dst_switch)
-    if not ruta:
+    # Obtener ruta (vacía si ambos hosts cuelgan del mismo switch)
+    with metricas.cronometro('sdn_build_route_segundos', etapa='ruta'):
+        ruta = get_route(src_switch, dst_switch, motor) if src_switch != dst_switch else []
+    if src_switch != dst_switch and not ruta:
         print("No se encontró ruta entre los hosts")
         return False
     
@@ -157,17 +1616,875 @@ def build_route(conexion, alumnos, cursos, servidores):
     print(f"Alumno: {alumno.nombre} ({conexion.alumno_mac})")
     print(f"Servidor: {servidor.nombre} ({servidor.ip})")
     print(f"Servicio: {conexion.servicio.nombre} ({conexion.servicio.protocolo}:{conexion.servicio.puerto})")
-   
-   
 
-    
-    return True
+    hops = construir_hops(src_switch, src_port, ruta, dst_switch, dst_port)
+    with metricas.cronometro('sdn_build_route_segundos', etapa='flows'):
+        instalada = install_route(conexion, hops)
+    if not instalada:
+        print("No se pudieron instalar los flows de la conexión")
+        return False
+
+    print(f"{len(conexion.flows)} flows instalados en {len(hops)} switches")
+    return True
+
+# Motor asíncrono: muchas conexiones se resuelven e instalan a la vez en un solo event loop
+FL_ASYNC_CONCURRENCY = 50
+
+class AsyncFloodlightClient:
+    """Cliente REST asíncrono; usa aiohttp si está instalado y, si no, el cliente síncrono en hilos"""
+    def __init__(self, base_url=None, limite=FL_ASYNC_CONCURRENCY,
+                 connect_timeout=FL_CONNECT_TIMEOUT, read_timeout=FL_READ_TIMEOUT):
+        # Por defecto apunta al mismo controlador que el cliente síncrono
+        self.base_url = base_url or fl_client.base_url
+        self.limite = limite
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.session = None
+        self.semaforo = None
+        self.aiohttp = None
+
+    async def __aenter__(self):
+        self.semaforo = asyncio.Semaphore(self.limite)
+        self.aiohttp = aiohttp = _importar_opcional('aiohttp')
+        # Con varios controladores no hay una URL única y las peticiones pasan por el pool
+        if aiohttp is not None and self.base_url:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limite),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout,
+                                              sock_read=self.read_timeout))
+        return self
+
+    async def __aexit__(self, *exc):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, metodo, ruta, data=None):
+        async with self.semaforo:
+            if self.session is None:
+                kwargs = {} if data is None else {'json': data}
+                response = await asyncio.to_thread(fl_client.request, metodo, ruta, **kwargs)
+                return response.json() if metodo == 'GET' else None
+            endpoint = _plantilla_endpoint(ruta)
+            inicio = time.perf_counter()
+            try:
+                async with self.session.request(metodo, f"{self.base_url}{ruta}", json=data) as response:
+                    response.raise_for_status()
+                    return await response.json(content_type=None) if metodo == 'GET' else None
+            except self.aiohttp.ClientError:
+                metricas.incrementar('sdn_floodlight_errores_total', metodo=metodo, endpoint=endpoint)
+                raise
+            finally:
+                metricas.observar('sdn_floodlight_peticion_segundos', time.perf_counter() - inicio,
+                                  metodo=metodo, endpoint=endpoint)
+
+    async def get(self, ruta):
+        return await self.request('GET', ruta)
+
+    async def post(self, ruta, data):
+        return await self.request('POST', ruta, data)
+
+    async def delete(self, ruta, data):
+        return await self.request('DELETE', ruta, data)
+
+class AsyncEngine:
+    """Resuelve puntos de conexión y rutas e instala flows de forma concurrente"""
+    def __init__(self, cliente):
+        self.cliente = cliente
+        self.lock_dispositivos = asyncio.Lock()
+        self.rutas_en_curso = {}
+
+    async def _refrescar_dispositivos(self, forzar=False):
+        # Solo la primera tarea consulta la tabla; el resto espera y la reutiliza. Pasa por el feed
+        # (consulta condicional con ETag) para que los suscriptores reciban los cambios
+        async with self.lock_dispositivos:
+            if forzar or device_cache.expirado():
+                await asyncio.to_thread(device_cache.refrescar)
+
+    async def get_attachment_point(self, mac, forzar=False):
+        await self._refrescar_dispositivos(forzar)
+        return device_cache.por_mac.get(mac, (None, None))
+
+    async def get_attachment_point_by_ip(self, host_ip, forzar=False):
+        await self._refrescar_dispositivos(forzar)
+        return device_cache.por_ip.get(host_ip, (None, None))
+
+    async def get_route(self, src_switch, dst_switch, motor=None):
+        if path_cache.toca_consultar():
+            enlaces = await self.cliente.get("/topology/links/json")
+            topologia.actualizar(enlaces)
+            path_cache.registrar_huella(path_cache.calcular_huella(enlaces))
+        motor = motor or ROUTING_ENGINE
+        if motor == "balanceado":
+            return carga_enlaces.elegir(topologia.k_rutas(src_switch, dst_switch, K_RUTAS))
+        if motor == "local":
+            return topologia.ruta(src_switch, dst_switch)
+        ruta = path_cache.obtener(src_switch, dst_switch, verificar=False)
+        if ruta is not None:
+            return ruta
+
+        # Las consultas simultáneas del mismo par comparten una sola petición
+        clave = (src_switch, dst_switch)
+        if clave not in self.rutas_en_curso:
+            self.rutas_en_curso[clave] = asyncio.ensure_future(
+                self.cliente.get(f"/path/{src_switch}/{dst_switch}/json"))
+        try:
+            ruta = (await self.rutas_en_curso[clave]).get('path', [])
+        finally:
+            self.rutas_en_curso.pop(clave, None)
+        if ruta:
+            path_cache.guardar(src_switch, dst_switch, ruta)
+        return ruta
+
+    async def build_route(self, conexion, motor=None):
+        """Versión asíncrona de build_route; devuelve None si tuvo éxito o el motivo del fallo"""
+        alumno, servidor, error = autorizar_conexion(conexion)
+        if error:
+            return error
+
+        try:
+            (src_switch, src_port), (dst_switch, dst_port) = await asyncio.gather(
+                self.get_attachment_point(conexion.alumno_mac),
+                self.get_attachment_point_by_ip(servidor.ip))
+            if not src_switch or not dst_switch:
+                return "No se pudo determinar la ubicación de los hosts"
+
+            ruta = await self.get_route(src_switch, dst_switch, motor) if src_switch != dst_switch else []
+        except Exception as e:
+            return f"Error al consultar el controlador: {e}"
+        if src_switch != dst_switch and not ruta:
+            return "No se encontró ruta entre los hosts"
+
+        hops = construir_hops(src_switch, src_port, ruta, dst_switch, dst_port)
+        # Se reserva antes de ceder el turno para que las rutas elegidas a la vez vean esta carga
+        carga_enlaces.asignar(conexion.handler, hops)
+        # La instalación y su reversión son las del camino síncrono (install_route)
+        if not await asyncio.to_thread(install_route, conexion, hops):
+            return "No se pudieron instalar los flows de la conexión"
+        return None
+
+async def build_routes_async(lista, limite=FL_ASYNC_CONCURRENCY, motor=None):
+    """Construye todas las conexiones de la lista concurrentemente"""
+    async with AsyncFloodlightClient(limite=limite) as cliente:
+        motor_async = AsyncEngine(cliente)
+        return await asyncio.gather(*(motor_async.build_route(c, motor) for c in lista))
+
+def build_routes(lista, limite=FL_ASYNC_CONCURRENCY, motor=None):
+    """Envoltura síncrona de build_routes_async; devuelve el error de cada conexión (None si OK)"""
+    return asyncio.run(build_routes_async(lista, limite, motor))
+
+# Admisión de solicitudes de conexión: cola acotada y límites de tasa delante de build_route
+ADMISION_COLA_MAX = 200
+ADMISION_TASA_ALUMNO = 0.5
+ADMISION_RAFAGA_ALUMNO = 5
+ADMISION_TASA_CONTROLADOR = 100
+ADMISION_RAFAGA_CONTROLADOR = 100
+ADMISION_ESPERA_MAX = 30
+MOTIVOS_RECHAZO = {
+    'limite_alumno': "Demasiadas solicitudes del alumno; intente nuevamente en unos segundos",
+    'cola_llena': "El controlador está saturado; intente nuevamente más tarde",
+    'tiempo_agotado': "Se agotó la espera en la cola de admisión",
+}
+
+class TokenBucket:
+    """Cubeta de fichas: se recarga a tasa fichas por segundo hasta capacidad"""
+    __slots__ = ('tasa', 'capacidad', 'fichas', 'ultimo')
+
+    def __init__(self, tasa, capacidad):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.fichas = capacidad
+        self.ultimo = time.monotonic()
+
+    def tomar(self):
+        """Toma una ficha si hay; si no, devuelve los segundos que faltan para la próxima"""
+        ahora = time.monotonic()
+        self.fichas = min(self.capacidad, self.fichas + (ahora - self.ultimo) * self.tasa)
+        self.ultimo = ahora
+        if self.fichas >= 1:
+            self.fichas -= 1
+            return 0
+        return (1 - self.fichas) / self.tasa
+
+class Solicitud:
+    __slots__ = ('evento', 'resultado', 'error')
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.error = None
+
+class Admision:
+    """Cola acotada con límites por alumno y por controlador; las solicitudes iguales en curso comparten resultado"""
+    def __init__(self, cola_max=ADMISION_COLA_MAX, tasa_alumno=ADMISION_TASA_ALUMNO,
+                 rafaga_alumno=ADMISION_RAFAGA_ALUMNO, tasa_controlador=ADMISION_TASA_CONTROLADOR,
+                 rafaga_controlador=ADMISION_RAFAGA_CONTROLADOR, espera_max=ADMISION_ESPERA_MAX):
+        self.cola_max = cola_max
+        self.tasa_alumno = tasa_alumno
+        self.rafaga_alumno = rafaga_alumno
+        self.tasa_controlador = tasa_controlador
+        self.rafaga_controlador = rafaga_controlador
+        self.espera_max = espera_max
+        self.cond = threading.Condition()
+        # Clave de la solicitud -> Solicitud en curso
+        self.en_vuelo = {}
+        # Controlador -> turnos en espera, en orden de llegada
+        self.filas = {}
+        self.por_alumno = {}
+        self.por_controlador = {}
+        self.en_cola = 0
+        self.admitidas = 0
+        self.unidas = 0
+        self.rechazadas = {}
+        self.espera_total = 0.0
+
+    @staticmethod
+    def _controlador(alumno_mac):
+        """Controlador del switch del alumno según la caché de dispositivos (0 con uno solo)"""
+        if not isinstance(fl_client, ControllerPool):
+            return 0
+        punto = device_cache.por_mac.get(alumno_mac)
+        return fl_client.indice_de(punto[0]) if punto else 0
+
+    def _rechazar(self, motivo):
+        self.rechazadas[motivo] = self.rechazadas.get(motivo, 0) + 1
+        metricas.incrementar('sdn_admision_total', resultado='rechazada', motivo=motivo)
+        return None, MOTIVOS_RECHAZO[motivo]
+
+    def _esperar_turno(self, controlador, limite):
+        """Espera en la fila del controlador hasta tener una ficha; False si se pasa el límite"""
+        with self.cond:
+            fila = self.filas.setdefault(controlador, deque())
+            turno = object()
+            fila.append(turno)
+            try:
+                while True:
+                    espera = None
+                    if fila[0] is turno:
+                        if not self.tasa_controlador:
+                            return True
+                        cubeta = self.por_controlador.get(controlador)
+                        if cubeta is None:
+                            cubeta = self.por_controlador[controlador] = TokenBucket(
+                                self.tasa_controlador, self.rafaga_controlador)
+                        espera = cubeta.tomar()
+                        if not espera:
+                            return True
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        return False
+                    self.cond.wait(min(espera, restante) if espera else restante)
+            finally:
+                fila.remove(turno)
+                self.en_cola -= 1
+                self.cond.notify_all()
+
+    def solicitar(self, clave, alumno_mac, funcion):
+        """Ejecuta funcion() cuando se admite la solicitud; devuelve (resultado, error)"""
+        with self.cond:
+            solicitud = self.en_vuelo.get(clave)
+            lider = solicitud is None
+            if lider:
+                if self.en_cola >= self.cola_max:
+                    return self._rechazar('cola_llena')
+                if self.tasa_alumno:
+                    cubeta = self.por_alumno.get(alumno_mac)
+                    if cubeta is None:
+                        cubeta = self.por_alumno[alumno_mac] = TokenBucket(self.tasa_alumno, self.rafaga_alumno)
+                    if cubeta.tomar():
+                        return self._rechazar('limite_alumno')
+                solicitud = self.en_vuelo[clave] = Solicitud()
+                self.en_cola += 1
+            else:
+                self.unidas += 1
+        if not lider:
+            metricas.incrementar('sdn_admision_total', resultado='unida')
+            solicitud.evento.wait()
+            return solicitud.resultado, solicitud.error
+
+        try:
+            inicio = time.monotonic()
+            admitida = self._esperar_turno(self._controlador(alumno_mac), inicio + self.espera_max)
+            espera = time.monotonic() - inicio
+            metricas.observar('sdn_admision_espera_segundos', espera)
+            with self.cond:
+                self.espera_total += espera
+                if admitida:
+                    self.admitidas += 1
+                    metricas.incrementar('sdn_admision_total', resultado='admitida')
+                else:
+                    solicitud.resultado, solicitud.error = self._rechazar('tiempo_agotado')
+            if admitida:
+                solicitud.resultado = funcion()
+        except Exception as e:
+            solicitud.error = f"Error al crear la conexión: {e}"
+            raise
+        finally:
+            with self.cond:
+                del self.en_vuelo[clave]
+            solicitud.evento.set()
+        return solicitud.resultado, solicitud.error
+
+    def estadisticas(self):
+        with self.cond:
+            return {
+                'en_cola': self.en_cola,
+                'en_vuelo': len(self.en_vuelo),
+                'admitidas': self.admitidas,
+                'unidas': self.unidas,
+                'rechazadas': dict(self.rechazadas),
+                'espera_media_s': self.espera_total / self.admitidas if self.admitidas else 0.0,
+            }
+
+    def limpiar(self):
+        with self.cond:
+            self.por_alumno.clear()
+            self.por_controlador.clear()
+            self.admitidas = self.unidas = 0
+            self.rechazadas.clear()
+            self.espera_total = 0.0
+
+admision = Admision()
+
+# Flows que se envían en paralelo durante el aprovisionamiento masivo; no más que el pool HTTP
+PROVISION_WORKERS = min(8, FL_POOL_SIZE)
+
+def provisionar_curso(codigo_curso, max_workers=PROVISION_WORKERS, motor=None):
+    """Crea las conexiones de todos los alumnos del curso a todos sus servicios permitidos"""
+    inicio = time.perf_counter()
+    curso = cursos.get(codigo_curso)
+    if not curso:
+        return None
+
+    # Una sola descarga de la tabla de dispositivos para todo el curso
+    try:
+        device_cache.refrescar()
+    except requests.exceptions.RequestException as e:
+        print(f"Ocurrió un error al obtener los puntos de conexión: {e}")
+        return None
+
+    resultados = []
+    pendientes = []
+    for codigo_alumno in sorted(curso.alumnos, key=str):
+        alumno = alumnos.get(codigo_alumno)
+        if not alumno:
+            continue
+        for srv in curso.servidores:
+            servidor = servidores.get(srv['nombre'])
+            if not servidor:
+                continue
+            for nombre_servicio in srv.get('servicios_permitidos', []):
+                servicio = next((sv for sv in servidor.servicios if sv.nombre == nombre_servicio), None)
+                if not servicio or conexiones.buscar('identidad', identidad_conexion(alumno.mac, servidor.ip, servicio)):
+                    continue
+                conexion = Conexion(handler_de(alumno.mac, servidor.ip, servicio), alumno.mac, servidor.ip, servicio)
+                resultado = {'alumno': alumno.codigo, 'servidor': servidor.nombre,
+                             'servicio': servicio.nombre, 'handler': None, 'ok': False, 'error': None}
+                resultados.append(resultado)
+
+                _, _, error = autorizar_conexion(conexion)
+                src = device_cache.por_mac.get(alumno.mac)
+                dst = device_cache.por_ip.get(servidor.ip)
+                if error:
+                    resultado['error'] = error
+                elif not src or not dst:
+                    resultado['error'] = "No se pudo determinar la ubicación de los hosts"
+                else:
+                    pendientes.append((conexion, src, dst, resultado))
+
+    # Con el motor local se precalculan los árboles hacia los switches de los servidores
+    motor = motor or ROUTING_ENGINE
+    if motor in ("local", "balanceado"):
+        try:
+            path_cache.verificar_topologia()
+        except requests.exceptions.RequestException as e:
+            print(f"Error al verificar la topología: {e}")
+        topologia.precalcular({dst[0] for _, _, dst, _ in pendientes})
+
+    # Una consulta de ruta por cada par de switches distinto; en modo balanceado cada
+    # conexión elige la suya y reserva sus enlaces antes de que elija la siguiente
+    rutas = {}
+    a_instalar = []
+    for conexion, src, dst, resultado in pendientes:
+        par = (src[0], dst[0])
+        if par[0] == par[1]:
+            ruta = []
+        elif motor == "balanceado" or par not in rutas:
+            ruta = rutas[par] = get_route(*par, motor)
+        else:
+            ruta = rutas[par]
+        if par[0] != par[1] and not ruta:
+            resultado['error'] = "No se encontró ruta entre los hosts"
+            continue
+        hops = construir_hops(src[0], src[1], ruta, dst[0], dst[1])
+        carga_enlaces.asignar(conexion.handler, hops)
+        a_instalar.append((conexion, hops, resultado))
+
+    with conexiones_lock:
+        # Todos los flows del curso van en un solo envío paralelo, acotado por max_workers (que no
+        # debe superar el pool HTTP); las conexiones solo se registran una vez instaladas
+        preparadas = []
+        for conexion, hops, resultado in a_instalar:
+            if conexiones.buscar('identidad', conexion.identidad):
+                # Otro hilo la creó mientras se calculaban las rutas
+                carga_enlaces.liberar(conexion.handler)
+                resultado['error'] = "La conexión ya existe"
+                continue
+            preparadas.append((conexion, hops, resultado) + preparar_flows(conexion, hops))
+        instalados, errores = push_flows([f for p in preparadas for f in p[3] + p[4]], max_workers)
+        fallidos = {nombre for nombre, _ in errores}
+        instalados = {f['name'] for f in instalados}
+
+        a_retirar = []
+        with transaccion_estado():
+            for conexion, hops, resultado, flows, _, claves in preparadas:
+                # Falla si no se instaló uno de sus flows o uno de los grupos compartidos que usa
+                nombres = [f['name'] for f in flows] + \
+                    [f['name'] for clave in claves for f in flows_compartidos.flows_de(clave)]
+                if any(nombre in fallidos for nombre in nombres):
+                    resultado['error'] = "No se pudieron instalar los flows de la conexión"
+                    continue
+                conexion.hops = hops
+                conexion.flows = [{'switch': f['switch'], 'name': f['name']} for f in flows]
+                conexion.grupos = claves
+                conexiones.agregar(conexion)
+                resultado['handler'] = conexion.handler
+                resultado['ok'] = True
+            # Las que fallaron sueltan sus grupos (ya resueltos los de las demás) y retiran lo instalado
+            for conexion, _, resultado, flows, _, claves in preparadas:
+                if not resultado['ok']:
+                    a_retirar += [f for f in flows if f['name'] in instalados]
+                    a_retirar += [f for f in soltar_grupos(conexion.handler, claves)
+                                  if f['name'] in instalados]
+                    carga_enlaces.liberar(conexion.handler)
+        for nombre, error in errores:
+            print(f"Error al instalar el flow {nombre}: {error}")
+        delete_flows(a_retirar)
+
+    return {'curso': curso.codigo, 'resultados': resultados,
+            'tiempo': time.perf_counter() - inicio}
+
+# Variables globales
+alumnos = Registro('codigo', 'mac', normalizar={'codigo': _normalizar_codigo})
+cursos = Registro('codigo', normalizar={'codigo': _normalizar_nombre})
+servidores = Registro('nombre', 'ip', normalizar={'nombre': _normalizar_nombre})
+# Por handler y por identidad (MAC, IP, protocolo, puerto): crear dos veces la misma conexión devuelve la existente
+# Los grupos por alumno y por servidor son los índices inversos que usa la revocación
+conexiones = Registro('handler', 'identidad', grupos=('alumno_mac', 'servidor_ip'),
+                      normalizar={'alumno_mac': str.lower})
+# Serializa los cambios de flows entre los menús y el reconciliador en segundo plano
+conexiones_lock = threading.RLock()
+
+# Índices inversos: alumno -> cursos en que está matriculado, servidor -> cursos que lo otorgan
+cursos_por_alumno = {}
+cursos_por_servidor = {}
+
+def _vincular_curso(curso):
+    for codigo_alumno in curso.alumnos:
+        cursos_por_alumno.setdefault(_normalizar_codigo(codigo_alumno), set()).add(curso.codigo)
+    for srv in curso.servidores:
+        cursos_por_servidor.setdefault(_normalizar_nombre(srv['nombre']), set()).add(curso.codigo)
+
+def _desvincular_curso(curso):
+    for indice, claves in ((cursos_por_alumno, map(_normalizar_codigo, curso.alumnos)),
+                           (cursos_por_servidor, (_normalizar_nombre(s['nombre']) for s in curso.servidores))):
+        for clave in claves:
+            codigos = indice.get(clave)
+            if codigos is not None:
+                codigos.discard(curso.codigo)
+                if not codigos:
+                    del indice[clave]
+
+def registrar_curso(curso):
+    cursos.agregar(curso)
+    _vincular_curso(curso)
+    politicas.indexar_curso(curso)
+
+def retirar_curso(curso):
+    _desvincular_curso(curso)
+    cursos.quitar(curso)
+    politicas.quitar_curso(curso.codigo)
+
+def actualizar_curso(curso, **cambios):
+    _desvincular_curso(curso)
+    cursos.actualizar(curso, **cambios)
+    _vincular_curso(curso)
+    politicas.indexar_curso(curso)
+
+def matricular(curso, codigo_alumno):
+    curso.alumnos.add(codigo_alumno)
+    cursos.tocar(curso)
+    cursos_por_alumno.setdefault(_normalizar_codigo(codigo_alumno), set()).add(curso.codigo)
+    politicas.indexar_curso(curso)
+
+def desmatricular(curso, codigo_alumno):
+    curso.alumnos.discard(codigo_alumno)
+    cursos.tocar(curso)
+    codigos = cursos_por_alumno.get(_normalizar_codigo(codigo_alumno))
+    if codigos is not None:
+        codigos.discard(curso.codigo)
+        if not codigos:
+            del cursos_por_alumno[_normalizar_codigo(codigo_alumno)]
+    politicas.indexar_curso(curso)
+
+def reconstruir_indices():
+    cursos_por_alumno.clear()
+    cursos_por_servidor.clear()
+    for curso in cursos:
+        _vincular_curso(curso)
+    politicas.reconstruir(cursos)
+
+# Estado persistente: cada mutación se escribe en SQLite (modo WAL) en el momento en que ocurre
+STATE_DB = "sdn_state.db"
+
+def _servicio_a_dict(sv):
+    return {'nombre': sv.nombre, 'protocolo': sv.protocolo, 'puerto': sv.puerto}
+
+def _a_dict(tipo, obj):
+    if tipo == 'alumno':
+        return {'nombre': obj.nombre, 'codigo': obj.codigo, 'mac': obj.mac}
+    if tipo == 'curso':
+        return {'codigo': obj.codigo, 'nombre': obj.nombre, 'estado': obj.estado,
+                'alumnos': sorted(obj.alumnos, key=str), 'servidores': obj.servidores}
+    if tipo == 'servidor':
+        return {'nombre': obj.nombre, 'ip': obj.ip,
+                'servicios': [_servicio_a_dict(sv) for sv in obj.servicios]}
+    return {'handler': obj.handler, 'alumno_mac': obj.alumno_mac, 'servidor_ip': obj.servidor_ip,
+            'servicio': _servicio_a_dict(obj.servicio), 'hops': obj.hops, 'flows': obj.flows,
+            'grupos': obj.grupos}
+
+def _de_dict(tipo, datos):
+    if tipo == 'alumno':
+        return Alumno(datos['nombre'], datos['codigo'], datos['mac'])
+    if tipo == 'curso':
+        curso = Curso(datos['codigo'], datos['nombre'], datos['estado'])
+        curso.alumnos = set(datos['alumnos'])
+        curso.servidores = datos['servidores']
+        return curso
+    if tipo == 'servidor':
+        servidor = Servidor(datos['nombre'], datos['ip'])
+        servidor.servicios = [Servicio(**sv) for sv in datos['servicios']]
+        return servidor
+    conexion = Conexion(datos['handler'], datos['alumno_mac'], datos['servidor_ip'],
+                        Servicio(**datos['servicio']))
+    conexion.hops = [tuple(h) for h in datos['hops']]
+    conexion.flows = datos['flows']
+    if 'grupos' in datos:
+        conexion.grupos = [tuple(clave) for clave in datos['grupos']]
+    elif conexion.flows:
+        # Registros anteriores a las claves guardadas: los saltos sin flows propios eran compartidos
+        propios = {f['switch'] for f in conexion.flows}
+        for i, hop in enumerate(conexion.hops):
+            compartido = i > 0 and hop[0] not in propios
+            if compartido:
+                conexion.grupos.append(FlowAggregator.clave(conexion, hop))
+            conexion.grupos.append(FlowAggregator.clave_arp(conexion, hop, compartido))
+    return conexion
+
+class StateStore:
+    """Almacén SQLite de alumnos, cursos, servidores y conexiones"""
+    def __init__(self, ruta=STATE_DB):
+        self.ruta = ruta
+        self.lock = threading.RLock()
+        self.transacciones = 0
+        self.conn = sqlite3.connect(ruta, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # orden guarda el turno en que se registró cada entidad; el rowid no sirve porque
+        # INSERT OR REPLACE y VACUUM lo cambian
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS entidades (
+            tipo TEXT NOT NULL, clave TEXT NOT NULL, datos TEXT NOT NULL, orden INTEGER,
+            PRIMARY KEY (tipo, clave))""")
+        columnas = {fila[1] for fila in self.conn.execute("PRAGMA table_info(entidades)")}
+        if 'orden' not in columnas:
+            self.conn.execute("ALTER TABLE entidades ADD COLUMN orden INTEGER")
+            self.conn.execute("UPDATE entidades SET orden = rowid")
+        self.conn.commit()
+        self.orden = self.conn.execute("SELECT COALESCE(MAX(orden), 0) FROM entidades").fetchone()[0]
+
+    def _confirmar(self):
+        if not self.transacciones:
+            self.conn.commit()
+
+    @contextlib.contextmanager
+    def transaccion(self):
+        """Agrupa varias mutaciones en un solo commit (p. ej. una importación completa)"""
+        with self.lock:
+            self.transacciones += 1
+            try:
+                yield
+            except BaseException:
+                self.transacciones -= 1
+                if not self.transacciones:
+                    self.conn.rollback()
+                raise
+            self.transacciones -= 1
+            self._confirmar()
+
+    def observador(self, tipo, registro):
+        def registrar(evento, obj):
+            with self.lock:
+                if evento == 'guardar':
+                    # Actualizar una entidad ya guardada conserva su turno
+                    self.orden += 1
+                    self.conn.execute("""INSERT INTO entidades (tipo, clave, datos, orden) VALUES (?, ?, ?, ?)
+                        ON CONFLICT (tipo, clave) DO UPDATE SET datos = excluded.datos""",
+                                      (tipo, registro.clave_de(obj), json.dumps(_a_dict(tipo, obj)), self.orden))
+                elif evento == 'borrar':
+                    self.conn.execute("DELETE FROM entidades WHERE tipo = ? AND clave = ?",
+                                      (tipo, registro.clave_de(obj)))
+                else:
+                    self.conn.execute("DELETE FROM entidades WHERE tipo = ?", (tipo,))
+                self._confirmar()
+        return registrar
+
+    def cargar(self):
+        """Lee todas las entidades guardadas agrupadas por tipo"""
+        entidades = {'alumno': [], 'curso': [], 'servidor': [], 'conexion': []}
+        with self.lock:
+            for tipo, datos in self.conn.execute("SELECT tipo, datos FROM entidades ORDER BY orden"):
+                entidades[tipo].append(_de_dict(tipo, json.loads(datos)))
+        return entidades
+
+    def compactar(self):
+        with self.lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.conn.execute("VACUUM")
+
+    def cerrar(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+store = None
+
+def _registros_persistentes():
+    return (('alumno', alumnos), ('curso', cursos), ('servidor', servidores), ('conexion', conexiones))
+
+def abrir_estado(ruta=STATE_DB):
+    """Recupera el estado guardado y deja registradas las mutaciones futuras en el almacén"""
+    global store
+    store = StateStore(ruta)
+    entidades = store.cargar()
+    for tipo, registro in _registros_persistentes():
+        registro.observador = None
+        registro.limpiar()
+        for obj in entidades[tipo]:
+            registro.agregar(obj)
+        registro.observador = store.observador(tipo, registro)
+    reconstruir_indices()
+    carga_enlaces.reconstruir(conexiones)
+    flows_compartidos.reconstruir(conexiones)
+    return store
+
+def cerrar_estado():
+    global store
+    if store is None:
+        return
+    for _, registro in _registros_persistentes():
+        registro.observador = None
+    store.cerrar()
+    store = None
+
+def transaccion_estado():
+    return store.transaccion() if store is not None else contextlib.nullcontext()
+
+def cursos_con_acceso_a(nombre_servidor, nombre_servicio):
+    """Cursos DICTANDO que otorgan el servicio, a partir del índice servidor -> cursos"""
+    resultado = []
+    for codigo in sorted(cursos_por_servidor.get(_normalizar_nombre(nombre_servidor), ())):
+        curso = cursos.get(codigo)
+        if curso.estado != "DICTANDO":
+            continue  # Solo cursos activos
+        if any(srv['nombre'] == nombre_servidor and nombre_servicio in srv.get('servicios_permitidos', [])
+               for srv in curso.servidores):
+            resultado.append(curso)
+    return resultado
+
+def cursos_de_alumno(codigo_alumno):
+    return [cursos.get(c) for c in sorted(cursos_por_alumno.get(_normalizar_codigo(codigo_alumno), ()))]
+
+# Exposición de métricas
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+
+def _proporcion(hits, misses):
+    return hits / (hits + misses) if hits + misses else 0.0
+
+def conexiones_por_curso_y_servidor():
+    """Conexiones activas agrupadas por curso otorgante y por servidor"""
+    por_curso = {}
+    por_servidor = {}
+    for conexion in conexiones:
+        alumno = alumnos.buscar('mac', conexion.alumno_mac)
+        servidor = servidores.buscar('ip', conexion.servidor_ip)
+        nombre = servidor.nombre if servidor else conexion.servidor_ip
+        por_servidor[nombre] = por_servidor.get(nombre, 0) + 1
+        if alumno and servidor:
+            for codigo in politicas.por_que(alumno.codigo, servidor.nombre, conexion.servicio.nombre):
+                por_curso[codigo] = por_curso.get(codigo, 0) + 1
+    return por_curso, por_servidor
+
+def indicadores():
+    """Valores instantáneos: proporción de aciertos de las cachés y conexiones activas"""
+    rutas = path_cache.estadisticas()
+    por_curso, por_servidor = conexiones_por_curso_y_servidor()
+    return {
+        'cache_rutas_hit_ratio': _proporcion(rutas['hits'], rutas['misses']),
+        'cache_dispositivos_hit_ratio': _proporcion(device_cache.hits, device_cache.misses),
+        'flows_ahorrados': flows_compartidos.reporte(conexiones)['ahorrados'],
+        'conexiones': len(conexiones),
+        'conexiones_por_curso': por_curso,
+        'conexiones_por_servidor': por_servidor,
+        'admision': admision.estadisticas(),
+    }
+
+def exportar_metricas():
+    """Métricas acumuladas más los indicadores actuales, en formato Prometheus"""
+    ind = indicadores()
+    lineas = [
+        "# HELP sdn_cache_hit_ratio Proporción de consultas resueltas desde la caché",
+        "# TYPE sdn_cache_hit_ratio gauge",
+        f'sdn_cache_hit_ratio{{cache="rutas"}} {ind["cache_rutas_hit_ratio"]}',
+        f'sdn_cache_hit_ratio{{cache="dispositivos"}} {ind["cache_dispositivos_hit_ratio"]}',
+        "# HELP sdn_flows_ahorrados Entradas de tabla de flujo ahorradas por la agregación",
+        "# TYPE sdn_flows_ahorrados gauge",
+        f"sdn_flows_ahorrados {ind['flows_ahorrados']}",
+        "# HELP sdn_conexiones Conexiones activas",
+        "# TYPE sdn_conexiones gauge",
+        f"sdn_conexiones {ind['conexiones']}",
+        "# HELP sdn_admision_en_cola Solicitudes de conexión esperando turno en la admisión",
+        "# TYPE sdn_admision_en_cola gauge",
+        f"sdn_admision_en_cola {ind['admision']['en_cola']}",
+        "# HELP sdn_conexiones_curso Conexiones activas por curso que las otorga",
+        "# TYPE sdn_conexiones_curso gauge",
+    ]
+    lineas += [f"sdn_conexiones_curso{_etiquetas_prometheus([('curso', c)])} {n}"
+               for c, n in sorted(ind['conexiones_por_curso'].items())]
+    lineas += [
+        "# HELP sdn_conexiones_servidor Conexiones activas por servidor",
+        "# TYPE sdn_conexiones_servidor gauge",
+    ]
+    lineas += [f"sdn_conexiones_servidor{_etiquetas_prometheus([('servidor', s)])} {n}"
+               for s, n in sorted(ind['conexiones_por_servidor'].items())]
+    return metricas.exportar() + '\n'.join(lineas) + '\n'
+
+servidor_metricas = None
+
+def iniciar_metricas(puerto=METRICS_PORT, host=METRICS_HOST):
+    """Publica /metrics en un hilo aparte; devuelve la URL"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            cuerpo = exportar_metricas().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    global servidor_metricas
+    if servidor_metricas is None:
+        servidor_metricas = ThreadingHTTPServer((host, puerto), MetricsHandler)
+        servidor_metricas.daemon_threads = True
+        threading.Thread(target=servidor_metricas.serve_forever, daemon=True).start()
+    host, puerto = servidor_metricas.server_address[:2]
+    return f"http://{host}:{puerto}/metrics"
+
+def detener_metricas():
+    global servidor_metricas
+    if servidor_metricas is not None:
+        servidor_metricas.shutdown()
+        servidor_metricas.server_close()
+        servidor_metricas = None
+
+def perfilar(funcion, *args, archivo=None, lineas=25, **kwargs):
+    """Ejecuta la función bajo cProfile e imprime las llamadas más costosas"""
+    import cProfile
+    import pstats
+    perfil = cProfile.Profile()
+    try:
+        return perfil.runcall(funcion, *args, **kwargs)
+    finally:
+        salida = io.StringIO()
+        pstats.Stats(perfil, stream=salida).sort_stats('cumulative').print_stats(lineas)
+        print(salida.getvalue())
+        if archivo:
+            perfil.dump_stats(archivo)
+            print(f"Perfil guardado en {archivo}")
 
-# Variables globales
-alumnos = []
-cursos = []
-servidores = []
-conexiones = []
+def menu_estadisticas():
+    while True:
+        print("\nEstadísticas:")
+        print(f"  Endpoint de métricas: {'activo' if servidor_metricas else 'detenido'}")
+        print("1) Ver resumen")
+        print("2) Iniciar endpoint /metrics")
+        print("3) Detener endpoint /metrics")
+        print("4) Crear una conexión con perfilado")
+        print("5) Flows compartidos")
+        print("6) Volver")
+
+        opcion = input(">>> ")
+
+        if opcion == "1":
+            mostrar_estadisticas()
+        elif opcion == "2":
+            try:
+                print(f"Métricas publicadas en {iniciar_metricas()}")
+            except OSError as e:
+                print(f"No se pudo iniciar el endpoint de métricas: {e}")
+        elif opcion == "3":
+            detener_metricas()
+        elif opcion == "4":
+            archivo = input("Archivo para guardar el perfil (vacío para no guardar): ").strip()
+            perfilar(crear_conexion, archivo=archivo or None)
+        elif opcion == "5":
+            mostrar_reporte_flows()
+        elif opcion == "6":
+            break
+        else:
+            print("Opción no válida")
+
+def mostrar_reporte_flows():
+    r = flows_compartidos.reporte(conexiones)
+    print(f"\nAgregación de flows: {'activa' if FLOW_AGGREGATION else 'inactiva'}")
+    print(f"Grupos compartidos: {r['grupos']} ({r['referencias']} referencias) | Grupos ARP: {r['grupos_arp']}")
+    print(f"Flows instalados: {r['flows_propios']} propios + {r['flows_compartidos']} compartidos")
+    print(f"Sin agregación serían {r['flows_sin_agregar']}: {r['ahorrados']} entradas ahorradas")
+
+def mostrar_estadisticas():
+    ind = indicadores()
+    print(f"\nCaché de rutas: {ind['cache_rutas_hit_ratio']:.1%} aciertos")
+    print(f"Caché de dispositivos: {ind['cache_dispositivos_hit_ratio']:.1%} aciertos")
+    print(f"Conexiones activas: {ind['conexiones']}")
+    for curso, n in sorted(ind['conexiones_por_curso'].items()):
+        print(f"  Curso {curso}: {n}")
+    for servidor, n in sorted(ind['conexiones_por_servidor'].items()):
+        print(f"  Servidor {servidor}: {n}")
+    adm = ind['admision']
+    print(f"Admisión: {adm['admitidas']} admitidas, {adm['unidas']} unidas a otra igual, "
+          f"{sum(adm['rechazadas'].values())} rechazadas, {adm['en_cola']} en cola, "
+          f"espera media {adm['espera_media_s'] * 1000:.1f} ms")
+    for motivo, n in sorted(adm['rechazadas'].items()):
+        print(f"  {MOTIVOS_RECHAZO[motivo]}: {n}")
+    filas = metricas.resumen()
+    if filas:
+        print(f"\n{'Métrica':<36} {'Etiquetas':<40} {'Cuenta':>8} {'Media ms':>10} {'p95 ms':>8}")
+    for fila in filas:
+        etiquetas = ','.join(f"{k}={v}" for k, v in fila.items()
+                             if k not in ('metrica', 'cuenta', 'media_ms', 'p95_ms', 'valor'))
+        if 'valor' in fila:
+            print(f"{fila['metrica']:<36} {etiquetas:<40} {fila['valor']:>8}")
+        else:
+            print(f"{fila['metrica']:<36} {etiquetas:<40} {fila['cuenta']:>8} "
+                  f"{fila['media_ms']:>10} {fila['p95_ms']:>8}")
 
 def menu_principal():
     while True:
@@ -182,12 +2499,16 @@ def menu_principal():
         print("5) Servidores")
         print("6) Políticas")
         print("7) Conexiones")
-        print("8) Salir")
+        print("8) Estadísticas")
+        print("9) Salir")
         
         opcion = input(">>> ")
         
         if opcion == "1":
-            importar()
+            fusionar = input("¿Fusionar con los datos actuales? (s/N): ").strip().lower() == "s"
+            reporte = importar(fusionar=fusionar)
+            if reporte:
+                mostrar_reporte_importacion(reporte)
         elif opcion == "2":
             exportar()
         elif opcion == "3":
@@ -201,58 +2522,291 @@ def menu_principal():
         elif opcion == "7":
             menu_conexiones()
         elif opcion == "8":
+            menu_estadisticas()
+        elif opcion == "9":
             break
         else:
             print("Opción no válida")
 
-def importar():
-    filename = input("Nombre del archivo a importar: ")
+# Se usa el cargador en C (LibYAML) cuando PyYAML fue compilado con él
+def _yaml_loader():
+    return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+def _componer_nodo(loader, anclas):
+    """Arma el nodo YAML de una sola entidad a partir de los eventos del parser"""
+    evento = loader.get_event()
+    if isinstance(evento, yaml.AliasEvent):
+        return anclas[evento.anchor]
+    if isinstance(evento, yaml.ScalarEvent):
+        tag = evento.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.ScalarNode, evento.value, evento.implicit)
+        nodo = yaml.ScalarNode(tag, evento.value, evento.start_mark, evento.end_mark, evento.style)
+    elif isinstance(evento, yaml.SequenceStartEvent):
+        tag = evento.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.SequenceNode, None, evento.implicit)
+        nodo = yaml.SequenceNode(tag, [], evento.start_mark, None, evento.flow_style)
+        while not loader.check_event(yaml.SequenceEndEvent):
+            nodo.value.append(_componer_nodo(loader, anclas))
+        loader.get_event()
+    elif isinstance(evento, yaml.MappingStartEvent):
+        tag = evento.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.MappingNode, None, evento.implicit)
+        nodo = yaml.MappingNode(tag, [], evento.start_mark, None, evento.flow_style)
+        while not loader.check_event(yaml.MappingEndEvent):
+            clave = _componer_nodo(loader, anclas)
+            nodo.value.append((clave, _componer_nodo(loader, anclas)))
+        loader.get_event()
+    else:
+        raise yaml.YAMLError(f"Evento YAML inesperado: {evento}")
+
+    if getattr(evento, 'anchor', None):
+        anclas[evento.anchor] = nodo
+    return nodo
+
+def _construir(loader, nodo):
+    """Construye el objeto de un nodo y olvida lo construido, para no retener todo el documento"""
+    try:
+        return loader.construct_object(nodo, deep=True)
+    finally:
+        loader.constructed_objects = {}
+        loader.recursive_objects = {}
+
+def iterar_entidades(stream):
+    """Genera (sección, entidad) construyendo una entidad a la vez, sin cargar todo el documento"""
+    loader = _yaml_loader()(stream)
+    anclas = {}
+    try:
+        loader.get_event()  # StreamStart
+        if loader.check_event(yaml.StreamEndEvent):
+            return
+        loader.get_event()  # DocumentStart
+        if not loader.check_event(yaml.MappingStartEvent):
+            raise yaml.YAMLError("Se esperaba un mapeo con las secciones alumnos, cursos y servidores")
+        loader.get_event()
+        while not loader.check_event(yaml.MappingEndEvent):
+            seccion = _construir(loader, _componer_nodo(loader, anclas))
+            if loader.check_event(yaml.SequenceStartEvent):
+                loader.get_event()
+                yield seccion, None
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    yield seccion, _construir(loader, _componer_nodo(loader, anclas))
+                loader.get_event()
+            else:
+                # Secciones que no son listas (p. ej. "alumnos:" vacío) se ignoran
+                valor = _construir(loader, _componer_nodo(loader, anclas))
+                if valor is None:
+                    yield seccion, None
+    finally:
+        loader.dispose()
+
+def _leer_secciones(stream):
+    """Devuelve los alumnos, cursos y servidores del archivo como dicts por clave primaria"""
+    nuevos = {}
+    for seccion, data in iterar_entidades(stream):
+        if seccion == 'alumnos':
+            destino = nuevos.setdefault('alumnos', {})
+            if data is not None:
+                destino[data['codigo']] = Alumno(data['nombre'], data['codigo'], data['mac'])
+        elif seccion == 'cursos':
+            destino = nuevos.setdefault('cursos', {})
+            if data is not None:
+                curso = Curso(data['codigo'], data['nombre'], data['estado'])
+                curso.alumnos = set(data.get('alumnos') or [])
+                curso.servidores = data.get('servidores', [])
+                destino[curso.codigo] = curso
+        elif seccion == 'servidores':
+            destino = nuevos.setdefault('servidores', {})
+            if data is not None:
+                servidor = Servidor(data['nombre'], data['ip'])
+                servidor.servicios = [Servicio(sv['nombre'], sv['protocolo'], sv['puerto'])
+                                      for sv in data.get('servicios', [])]
+                destino[servidor.nombre] = servidor
+    return nuevos
+
+def _firma_servicios(servidor):
+    return [(sv.nombre, sv.protocolo, sv.puerto) for sv in servidor.servicios]
+
+def _fusionar(registro, nuevos, campos, reporte, agregar=None, quitar=None, actualizar=None):
+    """Aplica sobre el registro solo las diferencias con las entidades nuevas"""
+    agregar = agregar or registro.agregar
+    quitar = quitar or registro.quitar
+    actualizar = actualizar or registro.actualizar
+
+    nuevos_por_clave = {registro.clave_de(o): o for o in nuevos.values()}
+    for k, nuevo in nuevos_por_clave.items():
+        actual = registro.items.get(k)
+        if actual is None:
+            agregar(nuevo)
+            reporte['agregados'].append(getattr(nuevo, registro.clave))
+        elif any(campo(actual) != campo(nuevo) for campo in campos):
+            actualizar(actual, **{atributo: getattr(nuevo, atributo) for atributo in type(nuevo).__slots__})
+            reporte['modificados'].append(getattr(actual, registro.clave))
+    for o in registro:
+        if registro.clave_de(o) not in nuevos_por_clave:
+            quitar(o)
+            reporte['eliminados'].append(getattr(o, registro.clave))
+
+# Instantánea binaria del modelo y sus índices tras cada importación completa; si es más
+# nueva que el YAML se carga en su lugar y se evita volver a parsearlo. Se guarda en un directorio
+# privado del usuario y no junto al YAML, donde cualquiera que pueda escribir podría dejar un pickle
+SNAPSHOT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'sdn_controller')
+SNAPSHOT_SUFIJO = ".snapshot"
+SNAPSHOT_VERSION = 2
+
+def _ruta_snapshot(filename):
+    origen = os.path.abspath(filename)
+    return os.path.join(SNAPSHOT_DIR, hashlib.sha1(origen.encode()).hexdigest() + SNAPSHOT_SUFIJO)
+
+def _es_privado(ruta):
+    """El archivo o directorio es del usuario del proceso y nadie más puede escribirlo"""
+    info = os.stat(ruta)
+    if hasattr(os, 'getuid') and info.st_uid != os.getuid():
+        return False
+    return not info.st_mode & 0o022
+
+def guardar_snapshot(filename):
+    datos = {
+        'version': SNAPSHOT_VERSION,
+        'origen': os.path.abspath(filename),
+        'alumnos': list(alumnos),
+        'cursos': list(cursos),
+        'servidores': list(servidores),
+        'politicas': (politicas.permisos, politicas.por_curso),
+        'cursos_por_alumno': cursos_por_alumno,
+        'cursos_por_servidor': cursos_por_servidor,
+    }
+    ruta = _ruta_snapshot(filename)
+    try:
+        os.makedirs(SNAPSHOT_DIR, mode=0o700, exist_ok=True)
+        if not _es_privado(SNAPSHOT_DIR):
+            print(f"No se guarda la instantánea: {SNAPSHOT_DIR} no es privado")
+            return
+        with open(os.open(ruta + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as file:
+            pickle.dump(datos, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(ruta + '.tmp', ruta)
+    except OSError as e:
+        print(f"No se pudo guardar la instantánea: {e}")
+
+def cargar_snapshot(filename):
+    """Devuelve la instantánea del archivo si existe y es más nueva que él; si no, None"""
+    # pickle puede ejecutar código: solo se leen instantáneas privadas del usuario del proceso
+    ruta = _ruta_snapshot(filename)
+    try:
+        if os.path.getmtime(ruta) <= os.path.getmtime(filename):
+            return None
+        if not (_es_privado(SNAPSHOT_DIR) and _es_privado(ruta)):
+            return None
+        with open(ruta, 'rb') as file:
+            datos = pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+    if (not isinstance(datos, dict) or datos.get('version') != SNAPSHOT_VERSION
+            or datos.get('origen') != os.path.abspath(filename)):
+        return None
+    return datos
+
+def _restaurar_snapshot(datos, reporte):
+    for seccion, registro in (('alumnos', alumnos), ('cursos', cursos), ('servidores', servidores)):
+        reporte[seccion]['eliminados'] = [getattr(o, registro.clave) for o in registro]
+        registro.limpiar()
+        for o in datos[seccion]:
+            registro.agregar(o)
+        reporte[seccion]['agregados'] = [getattr(o, registro.clave) for o in datos[seccion]]
+    # Los índices se recuperan tal cual, sin recompilar las políticas
+    politicas.permisos, politicas.por_curso = datos['politicas']
+    cursos_por_alumno.clear()
+    cursos_por_alumno.update(datos['cursos_por_alumno'])
+    cursos_por_servidor.clear()
+    cursos_por_servidor.update(datos['cursos_por_servidor'])
+
+def importar(filename=None, fusionar=False):
+    """Importa el YAML; en modo fusión solo aplica las diferencias y conserva el resto del estado"""
+    if filename is None:
+        filename = input("Nombre del archivo a importar: ")
+    reporte = {seccion: {'agregados': [], 'modificados': [], 'eliminados': []}
+               for seccion in ('alumnos', 'cursos', 'servidores')}
+
+    # Estado previo para saber qué conexiones pueden quedar sin autorización
+    antes = (set(politicas.permisos), {a.codigo: a.mac for a in alumnos},
+             {s.nombre: s.ip for s in servidores}) if len(conexiones) else None
+
+    snapshot = None if fusionar else cargar_snapshot(filename)
+    if snapshot is not None:
+        with transaccion_estado():
+            _restaurar_snapshot(snapshot, reporte)
+        print("Datos importados correctamente (desde la instantánea)")
+        reporte['revocadas'] = _revocar_tras_importar(antes)
+        return reporte
+
     try:
         with open(filename, 'r') as file:
-            data = yaml.safe_load(file)
-            
-            # Importar alumnos
-            alumnos.clear()
-            for alumno_data in data.get('alumnos', []):
-                alumnos.append(Alumno(
-                    alumno_data['nombre'],
-                    alumno_data['codigo'],
-                    alumno_data['mac']
-                ))
-            
-            # Importar cursos
-            cursos.clear()
-            for curso_data in data.get('cursos', []):
-                curso = Curso(
-                    curso_data['codigo'],
-                    curso_data['nombre'],
-                    curso_data['estado']
-                )
-                curso.alumnos = curso_data.get('alumnos', [])
-                curso.servidores = curso_data.get('servidores', [])
-                cursos.append(curso)
-            
-            # Importar servidores
-            servidores.clear()
-            for servidor_data in data.get('servidores', []):
-                servidor = Servidor(
-                    servidor_data['nombre'],
-                    servidor_data['ip']
-                )
-                servidor.servicios = [Servicio(s['nombre'], s['protocolo'], s['puerto']) 
-                                  for s in servidor_data.get('servicios', [])]
-                servidores.append(servidor)
-            
-            print("Datos importados correctamente")
+            nuevos = _leer_secciones(file)
     except FileNotFoundError:
         print(f"Error: No se encontró el archivo '{filename}'")
+        return None
     except yaml.YAMLError as e:
         print(f"Error en el formato YAML: {e}")
+        return None
     except Exception as e:
         print(f"Error inesperado: {str(e)}")
+        return None
+
+    with transaccion_estado():
+        _aplicar_importacion(nuevos, fusionar, reporte)
+    if not fusionar:
+        guardar_snapshot(filename)
+    print("Datos fusionados correctamente" if fusionar else "Datos importados correctamente")
+    reporte['revocadas'] = _revocar_tras_importar(antes)
+    return reporte
+
+def _revocar_tras_importar(antes):
+    """Revoca lo que la importación dejó sin permiso, alumno o servidor; devuelve las revocadas"""
+    if antes is None:
+        politicas.tomar_perdidos()
+        return []
+    permisos, macs, ips = antes
+    # La instantánea reemplaza el índice de políticas sin pasar por quitar_curso
+    politicas.perdidos |= permisos - set(politicas.permisos)
+    macs_afectadas = [mac for codigo, mac in macs.items() if getattr(alumnos.get(codigo), 'mac', None) != mac]
+    ips_afectadas = [ip for nombre, ip in ips.items() if getattr(servidores.get(nombre), 'ip', None) != ip]
+    reporte = revocar_conexiones(macs=macs_afectadas, ips=ips_afectadas)
+    mostrar_revocaciones(reporte)
+    return reporte['revocadas']
+
+def _aplicar_importacion(nuevos, fusionar, reporte):
+    if not fusionar:
+        # Reemplazo completo del estado, como en la importación original
+        for seccion, registro in (('alumnos', alumnos), ('cursos', cursos), ('servidores', servidores)):
+            reporte[seccion]['eliminados'] = [getattr(o, registro.clave) for o in registro]
+            registro.limpiar()
+            for o in nuevos.get(seccion, {}).values():
+                registro.agregar(o)
+            reporte[seccion]['agregados'] = list(nuevos.get(seccion, {}))
+        reconstruir_indices()
+        return
+
+    # Las secciones ausentes del archivo no se tocan
+    if 'alumnos' in nuevos:
+        _fusionar(alumnos, nuevos['alumnos'], (lambda a: a.nombre, lambda a: a.mac), reporte['alumnos'])
+    if 'servidores' in nuevos:
+        _fusionar(servidores, nuevos['servidores'], (lambda s: s.ip, _firma_servicios), reporte['servidores'])
+    if 'cursos' in nuevos:
+        campos = (lambda c: c.nombre, lambda c: c.estado, lambda c: c.alumnos, lambda c: c.servidores)
+        _fusionar(cursos, nuevos['cursos'], campos, reporte['cursos'],
+                  registrar_curso, retirar_curso, actualizar_curso)
 
-def exportar():
-    filename = input("Nombre del archivo a exportar: ")
+def mostrar_reporte_importacion(reporte):
+    for seccion in ('alumnos', 'cursos', 'servidores'):
+        cambios = reporte[seccion]
+        print(f"{seccion.capitalize()}: {len(cambios['agregados'])} agregados, "
+              f"{len(cambios['modificados'])} modificados, {len(cambios['eliminados'])} eliminados")
+
+def exportar(filename=None):
+    if filename is None:
+        filename = input("Nombre del archivo a exportar: ")
     try:
         data = {
             'alumnos': [{'nombre': a.nombre, 'codigo': a.codigo, 'mac': a.mac} for a in alumnos],
@@ -260,7 +2814,7 @@ def exportar():
                 'codigo': c.codigo,
                 'nombre': c.nombre,
                 'estado': c.estado,
-                'alumnos': c.alumnos,
+                'alumnos': sorted(c.alumnos, key=str),
                 'servidores': c.servidores
             } for c in cursos],
             'servidores': [{
@@ -278,8 +2832,113 @@ def exportar():
             yaml.dump(data, file)
         
         print("Datos exportados correctamente")
+        return True
     except Exception as e:
         print(f"Error al exportar: {e}")
+    return False
+
+# Listados: generadores filtrados por los índices, ordenables y paginados con desde/limite
+LISTADO_PAGINA = 50
+
+ORDEN_CURSOS = {
+    'codigo': lambda c: c.codigo,
+    'nombre': lambda c: c.nombre,
+    'estado': lambda c: (c.estado, c.codigo),
+    'alumnos': lambda c: (len(c.alumnos), c.codigo),
+}
+ORDEN_ALUMNOS = {
+    'codigo': lambda a: str(a.codigo),
+    'nombre': lambda a: (a.nombre, str(a.codigo)),
+    'mac': lambda a: a.mac,
+}
+ORDEN_CONEXIONES = {
+    'handler': lambda c: c.handler,
+    'alumno': lambda c: (c.alumno_mac, c.handler),
+    'servidor': lambda c: (c.servidor_ip, c.handler),
+    'servicio': lambda c: (c.servicio.nombre, c.handler),
+}
+
+def _paginar(items, ordenes, orden=None, desde=0, limite=None):
+    """Ordena (si se pide) y recorta; con límite solo se ordenan los primeros desde+limite"""
+    if orden:
+        descendente = orden.startswith('-')
+        clave = ordenes[orden.lstrip('-')]
+        if limite is not None:
+            items = (heapq.nlargest if descendente else heapq.nsmallest)(desde + limite, items, key=clave)
+        else:
+            items = sorted(items, key=clave, reverse=descendente)
+    return itertools.islice(items, desde, None if limite is None else desde + limite)
+
+def iterar_cursos(estado=None, servidor=None, alumno=None, orden=None, desde=0, limite=None):
+    """Cursos filtrados por estado, por servidor otorgado o por alumno matriculado"""
+    codigos = None
+    for indice, clave in ((cursos_por_servidor, servidor and _normalizar_nombre(servidor)),
+                          (cursos_por_alumno, alumno and _normalizar_codigo(alumno))):
+        if clave:
+            encontrados = indice.get(clave, set())
+            codigos = encontrados if codigos is None else codigos & encontrados
+    seleccion = cursos if codigos is None else (c for c in map(cursos.get, codigos) if c)
+    if estado:
+        seleccion = (c for c in seleccion if c.estado == estado.upper())
+    return _paginar(seleccion, ORDEN_CURSOS, orden, desde, limite)
+
+def iterar_alumnos(curso=None, orden=None, desde=0, limite=None):
+    """Alumnos, todos o solo los matriculados en un curso; None si el curso no existe"""
+    seleccion = alumnos
+    if curso:
+        registrado = cursos.get(curso)
+        if not registrado:
+            return None
+        seleccion = (a for a in map(alumnos.get, registrado.alumnos) if a)
+        # Sin orden explícito se respeta el orden por código que ya mostraba el listado por curso
+        orden = orden or 'codigo'
+    return _paginar(seleccion, ORDEN_ALUMNOS, orden, desde, limite)
+
+def iterar_conexiones(servidor=None, servicio=None, alumno=None, curso=None, orden=None, desde=0, limite=None):
+    """Conexiones filtradas por servidor, servicio, alumno o curso"""
+    ips = macs = None
+    if servidor:
+        registrado = servidores.get(servidor)
+        ips = {registrado.ip} if registrado else set()
+    if alumno:
+        registrado = alumnos.get(alumno)
+        macs = {registrado.mac} if registrado else set()
+    if curso:
+        registrado = cursos.get(curso)
+        # Las conexiones de un curso son las de sus alumnos hacia sus servidores
+        del_curso = {a.mac for a in map(alumnos.get, registrado.alumnos) if a} if registrado else set()
+        macs = del_curso if macs is None else macs & del_curso
+        ips_curso = {s.ip for s in map(servidores.get, (srv['nombre'] for srv in registrado.servidores)) if s} \
+            if registrado else set()
+        ips = ips_curso if ips is None else ips & ips_curso
+    # Los candidatos salen del grupo más chico (por alumno o por servidor) en vez de recorrer todas
+    if macs is not None and (ips is None or len(macs) <= len(ips)):
+        candidatas = (c for mac in macs for c in conexiones.grupo('alumno_mac', mac))
+    elif ips is not None:
+        candidatas = (c for ip in ips for c in conexiones.grupo('servidor_ip', ip))
+    else:
+        candidatas = conexiones
+    seleccion = (c for c in candidatas
+                 if (ips is None or c.servidor_ip in ips)
+                 and (macs is None or c.alumno_mac in macs)
+                 and (servicio is None or c.servicio.nombre == servicio))
+    return _paginar(seleccion, ORDEN_CONEXIONES, orden, desde, limite)
+
+def escribir_ndjson(filas, salida):
+    """Una línea JSON por elemento, a medida que el generador los produce"""
+    for fila in filas:
+        salida.write(json.dumps(fila, ensure_ascii=False, default=str))
+        salida.write('\n')
+
+def _mostrar_paginado(items, formatear, pagina=None):
+    """Imprime de a una página y pregunta antes de seguir; devuelve cuántos se mostraron"""
+    pagina = pagina or LISTADO_PAGINA
+    mostrados = 0
+    for mostrados, item in enumerate(items, 1):
+        print(formatear(mostrados, item))
+        if mostrados % pagina == 0 and input("-- Enter para continuar, q para terminar -- ").strip().lower() == 'q':
+            break
+    return mostrados
 
 def menu_cursos():
     while True:
@@ -287,7 +2946,8 @@ def menu_cursos():
         print("1) Listar cursos")
         print("2) Mostrar detalle de un curso")
         print("3) Actualizar alumnos (Agregar/Eliminar)")
-        print("4) Volver")
+        print("4) Cambiar estado")
+        print("5) Volver")
         
         opcion = input(">>> ").strip()
         
@@ -298,25 +2958,24 @@ def menu_cursos():
         elif opcion == "3":
             actualizar_alumnos_curso()
         elif opcion == "4":
+            codigo = input("\nIngrese el código del curso (ej. TEL354): ").strip().upper()
+            estado = input("Nuevo estado (ej. DICTANDO): ").strip().upper()
+            cambiar_estado_curso(codigo, estado)
+        elif opcion == "5":
             break
         else:
             print("Opción no válida. Intente nuevamente.")
 
-def listar_cursos():
+def listar_cursos(estado=None):
     print("\n=== LISTA DE CURSOS ===")
-    if not cursos:
+    formatear = lambda i, curso: (f"\n- Código: {curso.codigo}\n  Nombre: {curso.nombre}\n"
+                                  f"  Estado: {curso.estado}\n  Alumnos matriculados: {len(curso.alumnos)}")
+    if not _mostrar_paginado(iterar_cursos(estado=estado), formatear):
         print("No hay cursos registrados.")
-        return
-    
-    for curso in cursos:
-        print(f"\n- Código: {curso.codigo}")
-        print(f"  Nombre: {curso.nombre}")
-        print(f"  Estado: {curso.estado}")
-        print(f"  Alumnos matriculados: {len(curso.alumnos)}")
 
 def mostrar_detalle_curso():
     codigo = input("\nIngrese el código del curso (ej. TEL354): ").strip().upper()
-    curso = next((c for c in cursos if c.codigo == codigo), None)
+    curso = cursos.get(codigo)
     
     if not curso:
         print(f"Error: No existe un curso con código {codigo}.")
@@ -331,8 +2990,8 @@ def mostrar_detalle_curso():
     if not curso.alumnos:
         print("  No hay alumnos registrados.")
     else:
-        for codigo_alumno in curso.alumnos:
-            alumno = next((a for a in alumnos if a.codigo == codigo_alumno), None)
+        for codigo_alumno in sorted(curso.alumnos, key=str):
+            alumno = alumnos.get(codigo_alumno)
             if alumno:
                 print(f"  - {alumno.nombre} (Código: {alumno.codigo}, MAC: {alumno.mac})")
     
@@ -346,9 +3005,24 @@ def mostrar_detalle_curso():
             if 'servicios_permitidos' in servidor:
                 print("    Servicios permitidos:", ", ".join(servidor['servicios_permitidos']))        
 
+def cambiar_estado_curso(codigo_curso, estado):
+    """Cambia el estado y revoca las conexiones que ya no otorga; devuelve el reporte o None"""
+    curso = cursos.get(codigo_curso)
+    if not curso:
+        print(f"Error: No existe un curso con código {codigo_curso}.")
+        return None
+
+    curso.estado = estado
+    cursos.tocar(curso)
+    politicas.indexar_curso(curso)
+    print(f"Curso {curso.codigo} ahora en estado {curso.estado}.")
+    reporte = revocar_conexiones()
+    mostrar_revocaciones(reporte)
+    return reporte
+
 def actualizar_alumnos_curso():
     codigo_curso = input("\nIngrese el código del curso (ej. TEL354): ").strip().upper()
-    curso = next((c for c in cursos if c.codigo == codigo_curso), None)
+    curso = cursos.get(codigo_curso)
     
     if not curso:
         print(f"Error: No existe un curso con código {codigo_curso}.")
@@ -366,7 +3040,8 @@ def actualizar_alumnos_curso():
         if opcion == "1":
             # Agregar alumno (ej. Oscar Wilde)
             print("\nAlumnos disponibles para agregar:")
-            alumnos_no_matriculados = [a for a in alumnos if a.codigo not in curso.alumnos]
+            alumnos_no_matriculados = [a for a in alumnos
+                                       if curso.codigo not in cursos_por_alumno.get(_normalizar_codigo(a.codigo), ())]
             
             if not alumnos_no_matriculados:
                 print("No hay alumnos disponibles para agregar.")
@@ -382,7 +3057,7 @@ def actualizar_alumnos_curso():
                     continue
                 
                 alumno = alumnos_no_matriculados[seleccion]
-                curso.alumnos.append(alumno.codigo)
+                matricular(curso, alumno.codigo)
                 print(f"\nAlumno '{alumno.nombre}' agregado al curso {curso.codigo}.")
             except ValueError:
                 print("Error: Ingrese un número válido.")
@@ -394,19 +3069,22 @@ def actualizar_alumnos_curso():
                 continue
             
             print("\nAlumnos matriculados:")
-            for i, codigo_alumno in enumerate(curso.alumnos, 1):
-                alumno = next((a for a in alumnos if a.codigo == codigo_alumno), None)
+            matriculados = sorted(curso.alumnos, key=str)
+            for i, codigo_alumno in enumerate(matriculados, 1):
+                alumno = alumnos.get(codigo_alumno)
                 if alumno:
                     print(f"{i}. {alumno.nombre} (Código: {alumno.codigo})")
             
             try:
                 seleccion = int(input("Seleccione el alumno a eliminar (número): ")) - 1
-                if seleccion < 0 or seleccion >= len(curso.alumnos):
+                if seleccion < 0 or seleccion >= len(matriculados):
                     print("Selección inválida.")
                     continue
                 
-                alumno_eliminado = curso.alumnos.pop(seleccion)
+                alumno_eliminado = matriculados[seleccion]
+                desmatricular(curso, alumno_eliminado)
                 print(f"\nAlumno con código '{alumno_eliminado}' eliminado del curso.")
+                mostrar_revocaciones(revocar_conexiones())
             except ValueError:
                 print("Error: Ingrese un número válido.")
         
@@ -451,39 +3129,25 @@ def listar_alumnos(filtro_curso=None):
 
     print("\n=== LISTA DE ALUMNOS ===")
     
-    alumnos_filtrados = []
-    
+    alumnos_filtrados = iterar_alumnos(curso=filtro_curso)
+    if alumnos_filtrados is None:
+        print(f"No se encontró el curso {filtro_curso}")
+        return
+
     if filtro_curso:
-        # Buscar el curso primero
-        curso = next((c for c in cursos if c.codigo == filtro_curso), None)
-        if not curso:
-            print(f"No se encontró el curso {filtro_curso}")
-            return
-        
-        # Filtrar alumnos matriculados en este curso
-        alumnos_filtrados = [a for a in alumnos if a.codigo in curso.alumnos]
+        curso = cursos.get(filtro_curso)
         print(f"Alumnos matriculados en {curso.codigo} - {curso.nombre}:")
     else:
-        alumnos_filtrados = alumnos
         print("Todos los alumnos registrados:")
     
-    if not alumnos_filtrados:
+    formatear = lambda i, alumno: f"{i}. {alumno.nombre} ({alumno.codigo}) - MAC: {alumno.mac}"
+    if not _mostrar_paginado(alumnos_filtrados, formatear):
         print("No se encontraron alumnos" + (" para este filtro" if filtro_curso else ""))
-        return
-    
-    for i, alumno in enumerate(alumnos_filtrados, 1):
-        # Obtener cursos del alumno para mostrar adicionalmente
-        cursos_alumno = [c.codigo for c in cursos if alumno.codigo in c.alumnos]
-        print(f"{i}. {alumno.nombre} ({alumno.codigo}) - MAC: {alumno.mac}")
 
 def mostrar_detalle_alumno():
     codigo_buscado = input("Ingrese código del alumno: ").strip() 
     
-    alumno = None
-    for a in alumnos:
-        if str(a.codigo).strip() == codigo_buscado:
-            alumno = a
-            break
+    alumno = alumnos.get(codigo_buscado)
     
     if not alumno:
         print(f"\n¡Error! No se encontró alumno con código {codigo_buscado}")
@@ -495,7 +3159,7 @@ def mostrar_detalle_alumno():
     print(f"Dirección MAC: {alumno.mac}")
     
     # Cursos matriculados con más detalles
-    cursos_matriculados = [c for c in cursos if str(alumno.codigo) in [str(cod) for cod in c.alumnos]]
+    cursos_matriculados = cursos_de_alumno(alumno.codigo)
     
     if not cursos_matriculados:
         print("\nEl alumno no está matriculado en ningún curso actualmente")
@@ -508,7 +3172,7 @@ def mostrar_detalle_alumno():
             if curso.servidores:
                 print("  Servidores accesibles:")
                 for servidor in curso.servidores:
-                    srv = next((s for s in servidores if s.nombre == servidor['nombre']), None)
+                    srv = servidores.get(servidor['nombre'])
                     if srv:
                         print(f"  - {srv.nombre} (IP: {srv.ip})")
                         if 'servicios_permitidos' in servidor:
@@ -519,11 +3183,14 @@ def crear_alumno():
     codigo = input("Código: ")
     mac = input("MAC: ")
     
-    if any(a.codigo == codigo for a in alumnos):
+    if codigo in alumnos:
         print("Ya existe un alumno con ese código")
         return
+    if alumnos.buscar('mac', mac):
+        print("Ya existe un alumno con esa MAC")
+        return
     
-    alumnos.append(Alumno(nombre, codigo, mac))
+    alumnos.agregar(Alumno(nombre, codigo, mac))
     print("Alumno creado exitosamente")
 
 def menu_servidores():
@@ -565,7 +3232,7 @@ def listar_servidores():
         print(f"{i}. {servidor.nombre} (IP: {servidor.ip})")
 
 def mostrar_detalle_servidor(nombre_servidor):
-    servidor = next((s for s in servidores if s.nombre.lower() == nombre_servidor.lower()), None)
+    servidor = servidores.get(nombre_servidor)
     
     if not servidor:
         print(f"\nError: No se encontró el servidor '{nombre_servidor}'")
@@ -599,13 +3266,16 @@ def menu_politicas():
     while True:
         print("\nMenú Políticas:")
         print("1) Listar cursos con acceso a un servicio")  # Nueva opción
-        print("2) Volver")
+        print("2) Verificar acceso de un alumno")
+        print("3) Volver")
         
         opcion = input(">>> ")
         
         if opcion == "1":
             listar_cursos_con_acceso_servicio()  # Nueva función
         elif opcion == "2":
+            verificar_acceso_alumno()
+        elif opcion == "3":
             break
         else:
             print("Opción no válida")
@@ -625,7 +3295,7 @@ def listar_cursos_con_acceso_servicio():
         print("Error: Ingrese un número válido")
         return
 
-    servidor = servidores[servidor_idx]
+    servidor = list(servidores)[servidor_idx]
 
     # Mostrar servicios disponibles en el servidor seleccionado
     print(f"\nServicios disponibles en {servidor.nombre}:")
@@ -644,16 +3314,7 @@ def listar_cursos_con_acceso_servicio():
     servicio = servidor.servicios[servicio_idx]
 
     # Filtrar cursos con acceso al servicio seleccionado
-    cursos_con_acceso = []
-    for curso in cursos:
-        if curso.estado != "DICTANDO":
-            continue  # Solo cursos activos
-        
-        for srv_curso in curso.servidores:
-            if srv_curso['nombre'] == servidor.nombre:
-                if 'servicios_permitidos' in srv_curso and servicio.nombre in srv_curso['servicios_permitidos']:
-                    cursos_con_acceso.append(curso)
-                    break
+    cursos_con_acceso = cursos_con_acceso_a(servidor.nombre, servicio.nombre)
 
     # Mostrar resultados
     print(f"\n=== CURSOS CON ACCESO A '{servicio.nombre.upper()}' EN {servidor.nombre.upper()} ===")
@@ -663,6 +3324,22 @@ def listar_cursos_con_acceso_servicio():
         for curso in cursos_con_acceso:
             print(f"- {curso.codigo}: {curso.nombre} (Estado: {curso.estado})")
             
+def verificar_acceso_alumno():
+    codigo = input("\nIngrese código del alumno: ").strip()
+    nombre_servidor = input("Nombre del servidor: ").strip()
+    nombre_servicio = input("Nombre del servicio: ").strip()
+
+    # Los códigos importados desde YAML pueden ser numéricos
+    alumno = alumnos.get(codigo)
+    if alumno:
+        codigo = alumno.codigo
+
+    cursos_otorgantes = politicas.por_que(codigo, nombre_servidor, nombre_servicio)
+    if cursos_otorgantes:
+        print(f"Acceso PERMITIDO por: {', '.join(cursos_otorgantes)}")
+    else:
+        print("Acceso DENEGADO: ningún curso DICTANDO otorga este servicio")
+
 def menu_conexiones():
     while True:
         print("\nMenú Conexiones:")
@@ -672,7 +3349,11 @@ def menu_conexiones():
         print("4) Recalcular")
         print("5) Actualizar")
         print("6) Borrar")
-        print("7) Volver")
+        print("7) Provisionar curso")
+        print("8) Reconciliación")
+        print("9) Carga de enlaces")
+        print("10) Plan y aplicación por lotes")
+        print("11) Volver")
         
         opcion = input(">>> ")
         
@@ -689,35 +3370,45 @@ def menu_conexiones():
         elif opcion == "6":
             borrar_conexion()
         elif opcion == "7":
+            menu_provisionar_curso()
+        elif opcion == "8":
+            menu_reconciliacion()
+        elif opcion == "9":
+            mostrar_carga_enlaces()
+        elif opcion == "10":
+            menu_plan_lote()
+        elif opcion == "11":
             break
         else:
             print("Opción no válida")
 
 def crear_conexion():
     print("\nCrear nueva conexión")
+    lista_alumnos = list(alumnos)
+    lista_servidores = list(servidores)
     
     # Mostrar alumnos
     print("\nAlumnos disponibles:")
-    for i, alumno in enumerate(alumnos, 1):
+    for i, alumno in enumerate(lista_alumnos, 1):
         print(f"{i}. {alumno.nombre} ({alumno.mac})")
     
     alumno_idx = int(input("Seleccione alumno (número): ")) - 1
-    if alumno_idx < 0 or alumno_idx >= len(alumnos):
+    if alumno_idx < 0 or alumno_idx >= len(lista_alumnos):
         print("Selección inválida")
         return
     
     # Mostrar servidores
     print("\nServidores disponibles:")
-    for i, servidor in enumerate(servidores, 1):
+    for i, servidor in enumerate(lista_servidores, 1):
         print(f"{i}. {servidor.nombre} ({servidor.ip})")
     
     servidor_idx = int(input("Seleccione servidor (número): ")) - 1
-    if servidor_idx < 0 or servidor_idx >= len(servidores):
+    if servidor_idx < 0 or servidor_idx >= len(lista_servidores):
         print("Selección inválida")
         return
     
     # Mostrar servicios del servidor seleccionado
-    servidor = servidores[servidor_idx]
+    servidor = lista_servidores[servidor_idx]
     print(f"\nServicios disponibles en {servidor.nombre}:")
     for i, servicio in enumerate(servidor.servicios, 1):
         print(f"{i}. {servicio.nombre} ({servicio.protocolo}:{servicio.puerto})")
@@ -730,43 +3421,1031 @@ def crear_conexion():
     servicio = servidor.servicios[servicio_idx]
     
     # Crear conexión
-    handler = f"conn_{len(conexiones)+1}"
-    conexion = Conexion(handler, alumnos[alumno_idx].mac, servidor.ip, servicio)
-    
-    if build_route(conexion, alumnos, cursos, servidores):
-        conexiones.append(conexion)
-        print(f"Conexión creada exitosamente. Handler: {handler}")
+    alumno_mac = lista_alumnos[alumno_idx].mac
+    existente = conexiones.buscar('identidad', identidad_conexion(alumno_mac, servidor.ip, servicio))
+    if existente:
+        print(f"La conexión ya existía. Handler: {existente.handler}")
+        return
+    conexion = registrar_conexion(alumno_mac, servidor.ip, servicio)
+    if conexion:
+        print(f"Conexión creada exitosamente. Handler: {conexion.handler}")
     else:
         print("No se pudo crear la conexión")
 
-def listar_conexiones():
+    stats = path_cache.estadisticas()
+    print(f"Caché de rutas: {stats['hits']} hits, {stats['misses']} misses")
+
+def registrar_conexion(alumno_mac, servidor_ip, servicio, motor=None):
+    """Pasa por la admisión, instala la conexión y la registra; devuelve la Conexion o None si falla.
+
+    Si la misma conexión ya existe se devuelve esa, sin instalar nada.
+    """
+    existente = conexiones.buscar('identidad', identidad_conexion(alumno_mac, servidor_ip, servicio))
+    if existente is not None:
+        return existente
+    conexion, error = admision.solicitar(
+        identidad_conexion(alumno_mac, servidor_ip, servicio), alumno_mac,
+        lambda: _registrar_conexion(alumno_mac, servidor_ip, servicio, motor))
+    if error:
+        print(error)
+    return conexion
+
+def _registrar_conexion(alumno_mac, servidor_ip, servicio, motor=None):
+    # Como en provisionar_curso, la comprobación, la instalación y el registro van bajo el mismo
+    # candado para que otra solicitud igual no instale la conexión en paralelo
+    with conexiones_lock:
+        # Pudo haberse creado mientras la solicitud esperaba en la cola
+        existente = conexiones.buscar('identidad', identidad_conexion(alumno_mac, servidor_ip, servicio))
+        if existente is not None:
+            return existente
+        conexion = Conexion(handler_de(alumno_mac, servidor_ip, servicio), alumno_mac, servidor_ip, servicio)
+        if not build_route(conexion, alumnos, cursos, servidores, motor):
+            return None
+        conexiones.agregar(conexion)
+        return conexion
+
+def _formatear_conexion(i, conexion):
+    alumno = alumnos.buscar('mac', conexion.alumno_mac)
+    servidor = servidores.buscar('ip', conexion.servidor_ip)
+    return (f"Handler: {conexion.handler}\n"
+            f"Alumno: {alumno.nombre if alumno else 'Desconocido'}\n"
+            f"Servidor: {servidor.nombre if servidor else 'Desconocido'}\n"
+            f"Servicio: {conexion.servicio.nombre} ({conexion.servicio.protocolo}:{conexion.servicio.puerto})\n"
+            + "-" * 30)
+
+def listar_conexiones(**filtros):
     print("\nLista de conexiones activas:")
-    for conexion in conexiones:
-        alumno = next((a for a in alumnos if a.mac == conexion.alumno_mac), None)
-        servidor = next((s for s in servidores if s.ip == conexion.servidor_ip), None)
-        
-        print(f"Handler: {conexion.handler}")
-        print(f"Alumno: {alumno.nombre if alumno else 'Desconocido'}")
-        print(f"Servidor: {servidor.nombre if servidor else 'Desconocido'}")
-        print(f"Servicio: {conexion.servicio.nombre} ({conexion.servicio.protocolo}:{conexion.servicio.puerto})")
-        print("-" * 30)
+    if not _mostrar_paginado(iterar_conexiones(**filtros), _formatear_conexion):
+        print("No hay conexiones" + (" para este filtro" if filtros else ""))
+
+def menu_provisionar_curso():
+    codigo = input("\nIngrese el código del curso (ej. TEL354): ").strip().upper()
+    reporte = provisionar_curso(codigo)
+    if reporte is None:
+        print(f"Error: No se pudo provisionar el curso {codigo}.")
+        return
+
+    exitosas = 0
+    for r in reporte['resultados']:
+        if r['ok']:
+            exitosas += 1
+            print(f"  OK    {r['handler']}: {r['alumno']} -> {r['servidor']} / {r['servicio']}")
+        else:
+            print(f"  ERROR {r['alumno']} -> {r['servidor']} / {r['servicio']}: {r['error']}")
+    print(f"\n{exitosas}/{len(reporte['resultados'])} conexiones creadas en {reporte['tiempo']:.2f} s")
+
+def eliminar_conexion(handler):
+    """Retira los flows de la conexión y la elimina; devuelve False si no existe"""
+    conexion = conexiones.get(handler)
+    if not conexion:
+        return False
+
+    with conexiones_lock:
+        # eliminar los flows del switch
+        print(f"Eliminando flows para la conexión {handler}...")
+        # Los flows compartidos solo se retiran si esta era la última conexión que los usaba
+        errores = delete_flows(conexion.flows + soltar_grupos(handler))
+        for nombre, error in errores:
+            print(f"Error al eliminar el flow {nombre}: {error}")
+
+        conexiones.quitar(conexion)
+        carga_enlaces.liberar(handler)
+    return True
+
+def conexiones_revocables(claves=(), macs=(), ips=(), todas=False):
+    """Conexiones tocadas por los cambios que ya no están autorizadas, con el motivo"""
+    # Solo se revisan las conexiones que cuelgan de los alumnos y servidores afectados
+    candidatas = {}
+    if todas:
+        candidatas = {c.handler: c for c in conexiones}
+    for codigo_alumno, nombre_servidor, nombre_servicio in claves:
+        alumno = alumnos.get(codigo_alumno)
+        servidor = servidores.get(nombre_servidor)
+        if not alumno or not servidor:
+            continue
+        for c in conexiones.grupo('alumno_mac', alumno.mac):
+            if c.servidor_ip == servidor.ip and c.servicio.nombre == nombre_servicio:
+                candidatas[c.handler] = c
+    for atributo, valores in (('alumno_mac', macs), ('servidor_ip', ips)):
+        for valor in valores:
+            for c in conexiones.grupo(atributo, valor):
+                candidatas[c.handler] = c
+
+    revocables = []
+    for c in candidatas.values():
+        alumno, _, error = autorizar_conexion(c)
+        if error:
+            revocables.append((c, alumno, error))
+    return revocables
+
+def revocar_conexiones(claves=None, macs=(), ips=(), todas=False):
+    """Retira en un solo lote las conexiones que dejaron de estar autorizadas; devuelve el reporte"""
+    inicio = time.perf_counter()
+    perdidos = politicas.tomar_perdidos()
+    reporte = {'revocadas': [], 'errores': [], 'flows': 0, 'tiempo': 0.0}
+    with conexiones_lock:
+        revocables = conexiones_revocables(perdidos if claves is None else claves, macs, ips, todas)
+        if revocables:
+            # Todos los flows (propios y compartidos que quedan sin uso) van en una sola tanda paralela
+            flows = []
+            for conexion, _, _ in revocables:
+                flows += conexion.flows + soltar_grupos(conexion.handler)
+            reporte['flows'] = len(flows)
+            reporte['errores'] = delete_flows(flows)
+            with transaccion_estado():
+                for conexion, alumno, motivo in revocables:
+                    conexiones.quitar(conexion)
+                    carga_enlaces.liberar(conexion.handler)
+                    reporte['revocadas'].append({
+                        'handler': conexion.handler,
+                        'alumno': alumno.codigo if alumno else conexion.alumno_mac,
+                        'servidor': conexion.servidor_ip,
+                        'servicio': conexion.servicio.nombre,
+                        'motivo': motivo})
+            metricas.incrementar('sdn_revocaciones_total', len(revocables))
+    reporte['tiempo'] = time.perf_counter() - inicio
+    return reporte
+
+def mostrar_revocaciones(reporte):
+    for r in reporte['revocadas']:
+        print(f"  REVOCADA {r['handler']}: {r['alumno']} -> {r['servidor']} / {r['servicio']} ({r['motivo']})")
+    for nombre, error in reporte['errores']:
+        print(f"Error al eliminar el flow {nombre}: {error}")
+    if reporte['revocadas']:
+        print(f"{len(reporte['revocadas'])} conexiones revocadas ({reporte['flows']} flows) "
+              f"en {reporte['tiempo']:.2f} s")
+
+def mostrar_detalle_conexion():
+    handler = input("Ingrese el handler de la conexión: ").strip()
+    conexion = conexiones.get(handler)
+    if not conexion:
+        print("Conexión no encontrada")
+        return
+
+    alumno = alumnos.buscar('mac', conexion.alumno_mac)
+    servidor = servidores.buscar('ip', conexion.servidor_ip)
+    print(f"\n=== DETALLE DE LA CONEXIÓN: {conexion.handler} ===")
+    print(f"Alumno: {alumno.nombre + f' ({alumno.codigo})' if alumno else 'Desconocido'} - MAC: {conexion.alumno_mac}")
+    print(f"Servidor: {servidor.nombre if servidor else 'Desconocido'} - IP: {conexion.servidor_ip}")
+    print(f"Servicio: {conexion.servicio.nombre} ({conexion.servicio.protocolo}:{conexion.servicio.puerto})")
+    claves = flows_compartidos.claves_de(handler)
+    arp = sum(1 for clave in claves if es_clave_arp(clave))
+    print(f"Flows propios: {len(conexion.flows)} | Saltos compartidos: {len(claves) - arp} | Grupos ARP: {arp}")
+    print("Ruta:")
+    for switch, entrada, salida in conexion.hops:
+        print(f"  {switch}: puerto {entrada} -> puerto {salida}")
 
 def borrar_conexion():
     handler = input("Ingrese el handler de la conexión a borrar: ")
-    conexion = next((c for c in conexiones if c.handler == handler), None)
-    
+    if eliminar_conexion(handler):
+        print("Conexión eliminada exitosamente")
+    else:
+        print("Conexión no encontrada")
+
+def calcular_hops(conexion, motor=None):
+    """Hops de la conexión según la ubicación actual de los hosts; (hops, error)"""
+    _, servidor, error = autorizar_conexion(conexion)
+    if error:
+        return None, error
+
+    src_switch, src_port = get_attachment_point(conexion.alumno_mac)
+    dst_switch, dst_port = get_attachment_point_by_ip(servidor.ip)
+    if not src_switch or not dst_switch:
+        return None, "No se pudo determinar la ubicación de los hosts"
+
+    ruta = get_route(src_switch, dst_switch, motor) if src_switch != dst_switch else []
+    if src_switch != dst_switch and not ruta:
+        return None, "No se encontró ruta entre los hosts"
+    return construir_hops(src_switch, src_port, ruta, dst_switch, dst_port), None
+
+def reubicar_conexion(conexion, motor=None):
+    """Recalcula la ruta y reinstala solo los saltos que cambiaron; (saltos cambiados, error)"""
+    with conexiones_lock:
+        # La conexión no compite contra su propia carga al elegir la ruta nueva
+        carga_enlaces.liberar(conexion.handler)
+        try:
+            hops, error = calcular_hops(conexion, motor)
+        except requests.exceptions.RequestException as e:
+            hops, error = None, f"Error al consultar el controlador: {e}"
+        finally:
+            carga_enlaces.asignar(conexion.handler, conexion.hops)
+        if error:
+            return None, error
+        cambiados = actualizar_hops(conexion, hops)
+        # También tras un fallo: sus grupos pudieron quedar distintos de los guardados
+        if cambiados != 0:
+            conexiones.tocar(conexion)
+        if cambiados is None:
+            return None, "No se pudieron instalar los flows de la conexión"
+        return cambiados, None
+
+def recalcular_conexion(handler=None):
+    """Vuelve a calcular la ruta de una conexión con la ubicación actual de los hosts"""
+    if handler is None:
+        handler = input("Ingrese el handler de la conexión a recalcular: ")
+    conexion = conexiones.get(handler)
+    if not conexion:
+        print("Conexión no encontrada")
+        return False
+
+    device_cache.invalidar()
+    cambiados, error = reubicar_conexion(conexion)
+    if error is None:
+        print(f"Conexión {handler} recalculada ({cambiados} saltos reinstalados)")
+        return True
+
+    # Un fallo puede ser pasajero (p. ej. el controlador no responde): la conexión conserva sus
+    # saltos y el reconciliador la vuelve a intentar en su próximo ciclo
+    print(error)
+    reconciliador.afectadas.add(handler)
+    print(f"No se pudo recalcular la conexión {handler}; se reintentará en la reconciliación")
+    return False
+
+def actualizar_conexion(handler=None, nombre_servicio=None):
+    """Cambia el servicio de una conexión por otro del mismo servidor"""
+    if handler is None:
+        handler = input("Ingrese el handler de la conexión a actualizar: ")
+    conexion = conexiones.get(handler)
     if not conexion:
         print("Conexión no encontrada")
+        return False
+
+    servidor = servidores.buscar('ip', conexion.servidor_ip)
+    if not servidor:
+        print("Servidor no encontrado")
+        return False
+    if nombre_servicio is None:
+        print(f"\nServicios disponibles en {servidor.nombre}:")
+        for i, servicio in enumerate(servidor.servicios, 1):
+            print(f"{i}. {servicio.nombre} ({servicio.protocolo}:{servicio.puerto})")
+        try:
+            servicio_idx = int(input("Seleccione el nuevo servicio (número): ")) - 1
+        except ValueError:
+            print("Error: Ingrese un número válido")
+            return False
+        if servicio_idx < 0 or servicio_idx >= len(servidor.servicios):
+            print("Selección inválida")
+            return False
+        servicio = servidor.servicios[servicio_idx]
+    else:
+        servicio = next((sv for sv in servidor.servicios if sv.nombre == nombre_servicio), None)
+        if not servicio:
+            print("Servicio no encontrado")
+            return False
+
+    if conexiones.buscar('identidad', identidad_conexion(conexion.alumno_mac, conexion.servidor_ip, servicio)):
+        print(f"Ya existe una conexión del alumno a {servidor.nombre} con el servicio {servicio.nombre}")
+        return False
+    # El handler se deriva del servicio, así que la conexión actualizada cambia de handler
+    nueva = Conexion(handler_de(conexion.alumno_mac, conexion.servidor_ip, servicio),
+                     conexion.alumno_mac, conexion.servidor_ip, servicio)
+    with conexiones_lock:
+        _, _, error = autorizar_conexion(nueva)
+        if error:
+            print(error)
+            return False
+        hops = conexion.hops
+        if not hops:
+            hops, error = calcular_hops(nueva)
+            if error:
+                print(error)
+                return False
+        # Los flows llevan los campos del servicio: se instalan los nuevos y solo si todo
+        # salió bien se retiran los anteriores; si falla, la conexión queda como estaba
+        if not install_route(nueva, hops):
+            print("No se pudieron instalar los flows del nuevo servicio; la conexión no cambió")
+            return False
+        for nombre, error in delete_flows(conexion.flows + soltar_grupos(handler)):
+            print(f"Error al eliminar el flow {nombre}: {error}")
+        carga_enlaces.liberar(handler)
+        with transaccion_estado():
+            conexiones.quitar(conexion)
+            conexiones.agregar(nueva)
+    print(f"Conexión {handler} actualizada al servicio {servicio.nombre}; nuevo handler {nueva.handler}")
+    return True
+
+# Plan y aplicación de lotes: se calcula el conjunto de flows deseado, se compara con el
+# Static Flow Pusher y solo se envía la diferencia; si algo falla el lote se revierte entero
+def _es_flow_gestionado(nombre):
+    """Flows creados por este gestor: <handler>_<dpid>_<tipo>, compartidos agg_... o ARP arp_..."""
+    return nombre.startswith(('agg_', 'arp_')) or \
+        re.fullmatch(r'.+_[0-9a-fA-F]{16}_(fwd|rev|arp_fwd|arp_rev)', nombre) is not None
+
+def _huella_flow(flow):
+    """(puerto de entrada, acciones) de un flow, tanto en formato de envío como de listado"""
+    in_port = flow.get('in_port', flow.get('match', {}).get('in_port'))
+    acciones = flow.get('actions')
+    if acciones is None:
+        acciones = flow.get('instructions', {}).get('instruction_apply_actions', {}).get('actions')
+    return (None if in_port is None else str(in_port), acciones)
+
+def _flow_desde_listado(switch, nombre, flow):
+    """Reconstruye el cuerpo de envío de un flow listado por el controlador; None si no se puede"""
+    if 'match' not in flow:
+        # Ya viene en formato de envío
+        return dict(flow, switch=switch, name=nombre) if 'actions' in flow else None
+    _, acciones = _huella_flow(flow)
+    if acciones is None:
+        return None
+    return dict(flow['match'], switch=switch, name=nombre, priority=str(flow.get('priority', FLOW_PRIORITY)),
+                active='true', actions=acciones)
+
+def flows_en_controlador():
+    """{(switch, nombre): flow} de los flows gestionados según /wm/staticflowpusher/list/all/json"""
+    instalados = {}
+    for switch, entradas in (fl_client.get("/staticflowpusher/list/all/json") or {}).items():
+        for entrada in entradas or []:
+            for nombre, flow in entrada.items():
+                if _es_flow_gestionado(nombre):
+                    instalados[(switch, nombre)] = flow if isinstance(flow, dict) else {}
+    return instalados
+
+def flows_deseados(lista, agregador):
+    """{(switch, nombre): flow} que deberían estar instalados para las conexiones dadas"""
+    deseados = {}
+    for conexion in lista:
+        propios = {f['switch'] for f in conexion.flows}
+        for hop in conexion.hops or []:
+            if hop[0] in propios:
+                for flow in construir_flows_hop(conexion, hop):
+                    deseados[(flow['switch'], flow['name'])] = flow
+    for clave in list(agregador.grupos):
+        for flow in agregador.flows_de(clave):
+            deseados[(flow['switch'], flow['name'])] = flow
+    return deseados
+
+class PlanConexiones:
+    """Conexiones a crear y borrar en un lote y la diferencia de flows que implican"""
+    def __init__(self):
+        self.crear = []
+        self.borrar = []
+        self.errores = []
+        self.agregar = []
+        self.modificar = []
+        self.quitar = []
+        self.sin_cambios = 0
+        # Definición de los flows tal como estaban en el controlador, para restaurarlos al revertir
+        self.anteriores = {}
+        # Huella de las conexiones y los flows sobre los que se calculó; ver _huella_estado
+        self.huella = None
+
+    def vacio(self):
+        return not (self.agregar or self.modificar or self.quitar or self.crear or self.borrar)
+
+    def resumen(self):
+        def por_switch(flows):
+            agrupados = {}
+            for f in flows:
+                agrupados.setdefault(f['switch'], []).append(f['name'])
+            return {switch: sorted(nombres) for switch, nombres in sorted(agrupados.items())}
+        return {
+            'crear': [_conexion_dict(c) for c in self.crear],
+            'borrar': [c.handler for c in self.borrar],
+            'errores': self.errores,
+            'agregar': por_switch(self.agregar),
+            'modificar': por_switch(self.modificar),
+            'quitar': por_switch(self.quitar),
+            'sin_cambios': self.sin_cambios,
+        }
+
+def _huella_estado(actuales):
+    """Resume las conexiones registradas y los flows del controlador sobre los que se planifica"""
+    modelo = sorted((c.handler, [list(h) for h in c.hops or []], sorted(map(list, c.grupos)))
+                    for c in conexiones)
+    controlador = sorted((switch, nombre, _huella_flow(flow)) for (switch, nombre), flow in actuales.items())
+    return hashlib.sha1(json.dumps([modelo, controlador], default=str).encode()).hexdigest()
+
+def planificar(crear=(), borrar=()):
+    """Plan del lote: crear es una lista de (alumno, servidor, servicio) y borrar de handlers"""
+    plan = PlanConexiones()
+    for handler in borrar:
+        conexion = conexiones.get(handler)
+        if conexion:
+            plan.borrar.append(conexion)
+        else:
+            plan.errores.append(f"Conexión {handler} no encontrada")
+    a_borrar = {c.handler for c in plan.borrar}
+    quedan = [c for c in conexiones if c.handler not in a_borrar]
+
+    # Los grupos compartidos se simulan aparte para no tocar los reales hasta aplicar
+    agregador = FlowAggregator()
+    agregador.reconstruir(quedan)
+    identidades = {c.identidad for c in quedan}
+    for codigo_alumno, nombre_servidor, nombre_servicio in crear:
+        alumno = _buscar_alumno(codigo_alumno)
+        servidor = _buscar_servidor(nombre_servidor)
+        servicio = servidor and next((sv for sv in servidor.servicios if sv.nombre == nombre_servicio), None)
+        if not alumno or not servicio:
+            plan.errores.append(f"{codigo_alumno} -> {nombre_servidor}/{nombre_servicio}: "
+                                "alumno, servidor o servicio no encontrado")
+            continue
+        # Crear una conexión que ya existe (o que ya está en el lote) no cambia nada
+        if identidad_conexion(alumno.mac, servidor.ip, servicio) in identidades:
+            continue
+        conexion = Conexion(handler_de(alumno.mac, servidor.ip, servicio), alumno.mac, servidor.ip, servicio)
+        identidades.add(conexion.identidad)
+        hops, error = calcular_hops(conexion)
+        if error:
+            plan.errores.append(f"{codigo_alumno} -> {nombre_servidor}/{nombre_servicio}: {error}")
+            continue
+        propios, _, claves = preparar_flows(conexion, hops, agregador=agregador)
+        conexion.hops = hops
+        conexion.flows = [{'switch': f['switch'], 'name': f['name']} for f in propios]
+        conexion.grupos = claves
+        plan.crear.append(conexion)
+
+    deseados = flows_deseados(quedan + plan.crear, agregador)
+    actuales = flows_en_controlador()
+    plan.huella = _huella_estado(actuales)
+    for clave, flow in deseados.items():
+        if clave not in actuales:
+            plan.agregar.append(flow)
+            continue
+        huella = _huella_flow(actuales[clave])
+        # Si el listado no trae los campos no se puede comparar y se da por bueno
+        if None not in huella and huella != _huella_flow(flow):
+            plan.modificar.append(flow)
+            plan.anteriores[clave] = _flow_desde_listado(*clave, actuales[clave])
+        else:
+            plan.sin_cambios += 1
+    for switch, nombre in actuales:
+        if (switch, nombre) not in deseados:
+            plan.quitar.append({'switch': switch, 'name': nombre})
+            plan.anteriores[(switch, nombre)] = _flow_desde_listado(switch, nombre, actuales[(switch, nombre)])
+    return plan
+
+def aplicar_plan(plan):
+    """Envía solo la diferencia del plan; devuelve (ok, error) y si falla revierte lo que se alcanzó a cambiar"""
+    if plan.errores:
+        return False, "El plan tiene errores; no se aplicó ningún cambio"
+    with conexiones_lock:
+        # Si las conexiones o los flows cambiaron desde que se planificó, la diferencia ya no vale
+        try:
+            huella = _huella_estado(flows_en_controlador())
+        except requests.exceptions.RequestException as e:
+            return False, f"Error al consultar los flows del controlador: {e}"
+        if huella != plan.huella:
+            return False, "El estado cambió desde que se calculó el plan; vuelva a planificar el lote"
+        instalados, errores = push_flows(plan.agregar + plan.modificar)
+        if not errores:
+            fallidos = {nombre for nombre, _ in delete_flows(plan.quitar)}
+            errores = [(nombre, "no se pudo eliminar") for nombre in fallidos]
+            quitados = [f for f in plan.quitar if f['name'] not in fallidos]
+        else:
+            quitados = []
+        if errores:
+            for nombre, error in errores:
+                print(f"Error al aplicar el flow {nombre}: {error}")
+            # Se retiran los flows nuevos y se restauran los modificados y los quitados con la
+            # definición que tenían en el controlador
+            nuevos = {f['name'] for f in plan.agregar}
+            pendientes = [nombre for nombre, _ in delete_flows([f for f in instalados if f['name'] in nuevos])]
+            restaurar = []
+            for f in [f for f in instalados if f['name'] not in nuevos] + quitados:
+                anterior = plan.anteriores.get((f['switch'], f['name']))
+                if anterior is None:
+                    pendientes.append(f['name'])
+                else:
+                    restaurar.append(anterior)
+            pendientes += [nombre for nombre, _ in push_flows(restaurar)[1]]
+            if pendientes:
+                for nombre in sorted(pendientes):
+                    print(f"No se pudo revertir el flow {nombre}")
+                return False, (f"No se pudo aplicar el lote; la reversión fue parcial "
+                               f"({len(pendientes)} flows sin restaurar)")
+            return False, "No se pudo aplicar el lote; se revirtieron los cambios"
+
+        with transaccion_estado():
+            for conexion in plan.borrar:
+                conexiones.quitar(conexion)
+                carga_enlaces.liberar(conexion.handler)
+            for conexion in plan.crear:
+                conexiones.agregar(conexion)
+                carga_enlaces.asignar(conexion.handler, conexion.hops)
+        flows_compartidos.reconstruir(conexiones)
+    return True, None
+
+def mostrar_plan(plan):
+    r = plan.resumen()
+    for conexion in plan.crear:
+        print(f"  + conexión {conexion.handler}: {conexion.alumno_mac} -> {conexion.servidor_ip} "
+              f"({conexion.servicio.nombre}, {len(conexion.hops)} saltos)")
+    for handler in r['borrar']:
+        print(f"  - conexión {handler}")
+    for error in r['errores']:
+        print(f"  ERROR {error}")
+    switches = sorted(set(r['agregar']) | set(r['modificar']) | set(r['quitar']))
+    for switch in switches:
+        print(f"  {switch}: +{len(r['agregar'].get(switch, []))} "
+              f"~{len(r['modificar'].get(switch, []))} -{len(r['quitar'].get(switch, []))}")
+    print(f"Flows: {len(plan.agregar)} a agregar, {len(plan.modificar)} a modificar, "
+          f"{len(plan.quitar)} a quitar, {plan.sin_cambios} sin cambios")
+
+def menu_plan_lote():
+    print("\nIngrese las operaciones del lote, una por línea (vacío para terminar):")
+    print("  crear <código alumno> <servidor> <servicio>")
+    print("  borrar <handler>")
+    crear, borrar = [], []
+    while True:
+        partes = input("lote> ").split()
+        if not partes:
+            break
+        if partes[0] == "crear" and len(partes) == 4:
+            crear.append(tuple(partes[1:]))
+        elif partes[0] == "borrar" and len(partes) == 2:
+            borrar.append(partes[1])
+        else:
+            print("Operación no válida")
+
+    try:
+        plan = planificar(crear, borrar)
+    except requests.exceptions.RequestException as e:
+        print(f"Error al consultar los flows del controlador: {e}")
         return
-    
-    # eliminar los flows del switch
-    print(f"Eliminando flows para la conexión {handler}...")
-    
-    conexiones.remove(conexion)
-    print("Conexión eliminada exitosamente")
+    print("\nPlan del lote:")
+    mostrar_plan(plan)
+    if plan.errores or plan.vacio():
+        return
+    if input("¿Aplicar el plan? (s/N): ").strip().lower() != "s":
+        return
+    ok, error = aplicar_plan(plan)
+    print("Lote aplicado exitosamente" if ok else error)
+
+# Reconciliación: detecta movimientos de hosts y caídas de enlaces y recalcula solo lo afectado
+RECONCILE_INTERVAL = 10
+RECONCILE_MAX_POR_SEGUNDO = 5
+
+class Reconciliador:
+    """Bucle en segundo plano que mantiene las rutas de las conexiones al día"""
+    def __init__(self, intervalo=RECONCILE_INTERVAL, max_por_segundo=RECONCILE_MAX_POR_SEGUNDO):
+        self.intervalo = intervalo
+        self.max_por_segundo = max_por_segundo
+        self.cola = deque()
+        self.en_cola = set()
+        self.hilo = None
+        self.detener_evento = threading.Event()
+        self.ciclos = 0
+        self.recalculadas = 0
+        self.errores = 0
+        self.ultima_latencia = None
+        self.revisadas = 0
+        # Conexiones cuyos hosts se movieron según el feed de dispositivos
+        self.afectadas = set()
+        self.huella = None
+
+    def encolar(self, handler):
+        if handler not in self.en_cola:
+            self.en_cola.add(handler)
+            self.cola.append(handler)
+
+    @staticmethod
+    def _enlaces_activos(links):
+        enlaces = set()
+        for l in links:
+            a = (l.get('src-switch'), str(l.get('src-port')))
+            b = (l.get('dst-switch'), str(l.get('dst-port')))
+            enlaces.add((a, b))
+            enlaces.add((b, a))
+        return enlaces
+
+    def al_cambiar_dispositivos(self, cambios):
+        """Suscriptor del feed: marca las conexiones de los hosts nuevos, movidos o desaparecidos"""
+        if not cambios:
+            return
+        macs = {mac for cambio in cambios for mac in cambio['macs']}
+        ips = {ip for cambio in cambios for ip in cambio['ips'] + cambio['ips_anteriores']}
+        # Los grupos de conexiones por alumno y por servidor evitan recorrer todas las conexiones
+        for atributo, valores in (('alumno_mac', macs), ('servidor_ip', ips)):
+            for valor in valores:
+                self.afectadas.update(c.handler for c in conexiones.grupo(atributo, valor))
+
+    @staticmethod
+    def _desalineada(conexion, enlaces=None):
+        """Indica si los hops ya no coinciden con la ubicación de los hosts o con los enlaces activos"""
+        if not conexion.hops:
+            return True
+        primero, ultimo = conexion.hops[0], conexion.hops[-1]
+        src = device_cache.por_mac.get(conexion.alumno_mac)
+        dst = device_cache.por_ip.get(conexion.servidor_ip)
+        if (not src or not dst or (src[0], str(src[1])) != (primero[0], str(primero[1]))
+                or (dst[0], str(dst[1])) != (ultimo[0], str(ultimo[2]))):
+            return True
+        if enlaces is None:
+            return False
+        return any(((sw_a, str(out_a)), (sw_b, str(in_b))) not in enlaces
+                   for (sw_a, _, out_a), (sw_b, in_b, _) in zip(conexion.hops, conexion.hops[1:]))
+
+    def detectar(self):
+        """Revisa las conexiones afectadas por el feed; todas solo si cambió la topología"""
+        # El feed avisa a al_cambiar_dispositivos de los hosts que cambiaron
+        device_cache.refrescar()
+        links = fl_client.get("/topology/links/json")
+        huella = path_cache.calcular_huella(links)
+        afectadas, self.afectadas = self.afectadas, set()
+        if huella != self.huella:
+            self.huella = huella
+            enlaces = self._enlaces_activos(links)
+            revisar = [(conexion, enlaces) for conexion in conexiones]
+        else:
+            revisar = [(conexiones.get(handler), None) for handler in afectadas]
+        for conexion, enlaces in revisar:
+            if conexion is None:
+                continue
+            self.revisadas += 1
+            if self._desalineada(conexion, enlaces):
+                self.encolar(conexion.handler)
+
+    def procesar(self):
+        """Recalcula las conexiones en cola respetando el límite de recálculos por segundo"""
+        espera = 1.0 / self.max_por_segundo if self.max_por_segundo else 0
+        # Una caída de enlace debe verse en la caché de rutas de inmediato
+        path_cache.ultima_consulta = None
+        while self.cola and not self.detener_evento.is_set():
+            handler = self.cola.popleft()
+            self.en_cola.discard(handler)
+            conexion = conexiones.get(handler)
+            if conexion is None:
+                continue
+            cambiados, error = reubicar_conexion(conexion)
+            if error:
+                self.errores += 1
+                # Se vuelve a intentar en el siguiente ciclo aunque el feed no traiga cambios
+                self.afectadas.add(handler)
+                print(f"Reconciliación de {handler}: {error}")
+            elif cambiados:
+                self.recalculadas += 1
+            if espera and self.cola:
+                self.detener_evento.wait(espera)
+
+    def ciclo(self):
+        inicio = time.perf_counter()
+        try:
+            self.detectar()
+            self.procesar()
+        except requests.exceptions.RequestException as e:
+            print(f"Error de reconciliación: {e}")
+        self.ciclos += 1
+        self.ultima_latencia = time.perf_counter() - inicio
+
+    def _bucle(self):
+        while not self.detener_evento.is_set():
+            self.ciclo()
+            self.detener_evento.wait(self.intervalo)
+
+    def iniciar(self):
+        if self.hilo and self.hilo.is_alive():
+            return
+        self.detener_evento.clear()
+        self.hilo = threading.Thread(target=self._bucle, name="reconciliador", daemon=True)
+        self.hilo.start()
+
+    def detener(self):
+        self.detener_evento.set()
+        if self.hilo:
+            self.hilo.join()
+            self.hilo = None
+
+    def estadisticas(self):
+        return {
+            'activo': bool(self.hilo and self.hilo.is_alive()),
+            'profundidad_cola': len(self.cola),
+            'ciclos': self.ciclos,
+            'recalculadas': self.recalculadas,
+            'errores': self.errores,
+            'ultima_latencia_s': self.ultima_latencia,
+            'revisadas': self.revisadas,
+            'feed': device_feed.estadisticas(),
+        }
+
+reconciliador = Reconciliador()
+device_feed.suscribir(reconciliador.al_cambiar_dispositivos)
+
+def menu_reconciliacion():
+    while True:
+        stats = reconciliador.estadisticas()
+        print("\nReconciliación de conexiones:")
+        print(f"  Activa: {'sí' if stats['activo'] else 'no'} | Cola: {stats['profundidad_cola']} | "
+              f"Recalculadas: {stats['recalculadas']} | Errores: {stats['errores']}")
+        if stats['ultima_latencia_s'] is not None:
+            print(f"  Último ciclo: {stats['ultima_latencia_s'] * 1000:.1f} ms")
+        feed = stats['feed']
+        print(f"  Feed de dispositivos: {feed['sondeos']} sondeos, {feed['no_modificados']} sin cambios, "
+              f"{feed['cambios_emitidos']} cambios emitidos")
+        print("1) Iniciar")
+        print("2) Detener")
+        print("3) Ejecutar un ciclo ahora")
+        print("4) Volver")
+
+        opcion = input(">>> ")
+
+        if opcion == "1":
+            reconciliador.iniciar()
+        elif opcion == "2":
+            reconciliador.detener()
+        elif opcion == "3":
+            reconciliador.ciclo()
+        elif opcion == "4":
+            break
+        else:
+            print("Opción no válida")
+
+def mostrar_carga_enlaces():
+    filas = tabla_carga_enlaces(puertos=LINK_LOAD_PORT_STATS)
+    if not filas:
+        print("No hay enlaces entre switches registrados")
+        return
+    print("\nCarga de enlaces:")
+    print(f"{'Enlace':<60} {'Conexiones':>10} {'Carga':>8}")
+    for fila in filas:
+        print(f"{fila['enlace']:<60} {fila['conexiones']:>10} {fila['carga']:>8}")
+
+# Interfaz de línea de comandos (modo no interactivo)
+def _buscar_alumno(codigo):
+    return alumnos.get(codigo)
+
+def _buscar_servidor(nombre):
+    return servidores.get(nombre)
+
+def _conexion_dict(c):
+    return {
+        'handler': c.handler,
+        'alumno_mac': c.alumno_mac,
+        'servidor_ip': c.servidor_ip,
+        'servicio': _servicio_a_dict(c.servicio),
+        'hops': [list(h) for h in c.hops],
+        'flows': len(c.flows),
+    }
+
+def _opciones_listado(p, ordenes):
+    p.add_argument('--orden', choices=sorted(ordenes))
+    p.add_argument('--desc', action='store_true', help='Orden descendente')
+    p.add_argument('--desde', type=int, default=0, help='Elementos a saltear')
+    p.add_argument('--limite', type=int, help='Cantidad máxima de elementos')
+
+def _paginacion(args):
+    orden = args.orden and ('-' if args.desc else '') + args.orden
+    return {'orden': orden, 'desde': args.desde, 'limite': args.limite}
+
+def construir_parser():
+    parser = argparse.ArgumentParser(
+        prog='sdn_controller.py',
+        description='Network Policy manager de La UPSM (modo no interactivo)')
+    parser.add_argument('--datos', metavar='ARCHIVO', help='YAML a importar antes de ejecutar el comando')
+    # Destino propio: 'estado' es el argumento posicional de estado-curso
+    parser.add_argument('--estado', dest='ruta_estado', metavar='ARCHIVO', default=STATE_DB,
+                        help='Base SQLite con el estado persistente')
+    parser.add_argument('--motor', choices=('rest', 'local', 'balanceado'), help='Motor de cálculo de rutas')
+    parser.add_argument('--metricas', metavar='PUERTO', type=int, help='Publica /metrics en este puerto')
+    parser.add_argument('--agregar-flows', action='store_true',
+                        help='Comparte los flows de los saltos posteriores al switch del alumno')
+    parser.add_argument('--controlador', metavar='URL', action='append',
+                        help='URL base (…/wm) de un controlador; se repite para usar varios')
+    parser.add_argument('--enlace-dominio', nargs=4, action='append', default=[],
+                        metavar=('SWITCH_A', 'PUERTO_A', 'SWITCH_B', 'PUERTO_B'),
+                        help='Enlace entre switches de controladores distintos')
+    parser.add_argument('--ndjson', action='store_true',
+                        help='En los listados, escribe un objeto JSON por línea a medida que se generan')
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    p = sub.add_parser('importar')
+    p.add_argument('archivo')
+    p.add_argument('--fusionar', action='store_true', help='Aplicar solo las diferencias con el estado actual')
+    sub.add_parser('exportar').add_argument('archivo')
+
+    p = sub.add_parser('cursos')
+    p.add_argument('--codigo')
+    p.add_argument('--con-estado', metavar='ESTADO', help='Solo los cursos en este estado')
+    p.add_argument('--servidor', help='Solo los cursos que otorgan acceso a este servidor')
+    p.add_argument('--alumno', help='Solo los cursos en que está matriculado este alumno')
+    _opciones_listado(p, ORDEN_CURSOS)
+    p = sub.add_parser('alumnos')
+    p.add_argument('--curso')
+    _opciones_listado(p, ORDEN_ALUMNOS)
+    sub.add_parser('servidores')
+    p = sub.add_parser('estado-curso')
+    p.add_argument('codigo')
+    p.add_argument('estado')
+    sub.add_parser('revocar', help='Retira todas las conexiones que ya no están autorizadas')
+
+    p = sub.add_parser('politica', help='Cursos que otorgan a un alumno un servicio')
+    p.add_argument('alumno')
+    p.add_argument('servidor')
+    p.add_argument('servicio')
+    p = sub.add_parser('acceso', help='Cursos con acceso a un servicio de un servidor')
+    p.add_argument('servidor')
+    p.add_argument('servicio')
+
+    p = sub.add_parser('conexion')
+    acciones = p.add_subparsers(dest='accion', required=True)
+    c = acciones.add_parser('crear')
+    c.add_argument('alumno', help='Código del alumno')
+    c.add_argument('servidor', help='Nombre del servidor')
+    c.add_argument('servicio', help='Nombre del servicio')
+    c.add_argument('--perfil', metavar='ARCHIVO', nargs='?', const='',
+                   help='Perfila la creación con cProfile (y guarda el perfil si se indica archivo)')
+    c = acciones.add_parser('listar')
+    c.add_argument('--servidor')
+    c.add_argument('--servicio')
+    c.add_argument('--alumno', help='Código del alumno')
+    c.add_argument('--curso')
+    _opciones_listado(c, ORDEN_CONEXIONES)
+    acciones.add_parser('borrar').add_argument('handler')
+    acciones.add_parser('recalcular').add_argument('handler')
+    c = acciones.add_parser('actualizar')
+    c.add_argument('handler')
+    c.add_argument('servicio', help='Nombre del nuevo servicio')
+
+    p = sub.add_parser('reconciliar', help='Recalcula las conexiones afectadas por cambios en la red')
+    p.add_argument('--continuo', action='store_true', help='Repite el ciclo hasta Ctrl+C')
+
+    sub.add_parser('provisionar').add_argument('curso')
+    sub.add_parser('stats', help='Latencias, contadores y aciertos de caché')
+    sub.add_parser('flows', help='Flows compartidos y entradas ahorradas por la agregación')
+    for nombre, ayuda in (('plan', 'Diferencia de flows que produciría un lote de conexiones'),
+                          ('aplicar', 'Aplica un lote de conexiones de forma transaccional')):
+        p = sub.add_parser(nombre, help=ayuda)
+        p.add_argument('--crear', nargs=3, action='append', default=[],
+                       metavar=('ALUMNO', 'SERVIDOR', 'SERVICIO'))
+        p.add_argument('--borrar', action='append', default=[], metavar='HANDLER')
+    p = sub.add_parser('carga', help='Conexiones fijadas a cada enlace entre switches')
+    p.add_argument('--puertos', action='store_true', help='Pondera con las estadísticas de puertos de Floodlight')
+    sub.add_parser('controladores', help='Switches de los que es dueño cada controlador')
+    sub.add_parser('batch', help='Ejecuta un comando por línea de un archivo').add_argument('archivo')
+    return parser
+
+def ejecutar_comando(args):
+    """Ejecuta un comando ya parseado y devuelve un resultado serializable a JSON"""
+    comando = args.comando
+    global ROUTING_ENGINE, FLOW_AGGREGATION, fl_client
+    if args.controlador:
+        fl_client = crear_cliente(args.controlador, [
+            {'src-switch': a, 'src-port': pa, 'dst-switch': b, 'dst-port': pb}
+            for a, pa, b, pb in args.enlace_dominio])
+    if args.motor:
+        ROUTING_ENGINE = args.motor
+    if args.agregar_flows:
+        FLOW_AGGREGATION = True
+    if comando == 'importar':
+        reporte = importar(args.archivo, args.fusionar)
+        return {'ok': reporte is not None, 'cambios': reporte}
+    if comando == 'exportar':
+        return {'ok': exportar(args.archivo)}
+
+    if comando == 'cursos':
+        if args.codigo:
+            return [_a_dict('curso', c) for c in [cursos.get(args.codigo)] if c]
+        return (_a_dict('curso', c) for c in iterar_cursos(args.con_estado, args.servidor, args.alumno,
+                                                           **_paginacion(args)))
+    if comando == 'alumnos':
+        seleccion = iterar_alumnos(args.curso, **_paginacion(args))
+        if seleccion is None:
+            return {'ok': False, 'error': f"No se encontró el curso {args.curso}"}
+        return (_a_dict('alumno', a) for a in seleccion)
+    if comando == 'servidores':
+        return [{'nombre': s.nombre, 'ip': s.ip, 'servicios': [_servicio_a_dict(sv) for sv in s.servicios]}
+                for s in servidores]
+    if comando == 'estado-curso':
+        reporte = cambiar_estado_curso(args.codigo.upper(), args.estado.upper())
+        return {'ok': reporte is not None, 'revocadas': reporte['revocadas'] if reporte else []}
+    if comando == 'revocar':
+        reporte = revocar_conexiones(todas=True)
+        return {'ok': not reporte['errores'], 'revocadas': reporte['revocadas'],
+                'flows': reporte['flows'], 'errores': [n for n, _ in reporte['errores']]}
+
+    if comando == 'politica':
+        alumno = _buscar_alumno(args.alumno)
+        codigo = alumno.codigo if alumno else args.alumno
+        otorgantes = politicas.por_que(codigo, args.servidor, args.servicio)
+        return {'permitido': bool(otorgantes), 'cursos': otorgantes}
+    if comando == 'acceso':
+        return [c.codigo for c in cursos_con_acceso_a(args.servidor, args.servicio)]
+
+    if comando == 'conexion':
+        if args.accion == 'listar':
+            return (_conexion_dict(c) for c in iterar_conexiones(args.servidor, args.servicio, args.alumno,
+                                                                 args.curso, **_paginacion(args)))
+        if args.accion == 'borrar':
+            return {'ok': eliminar_conexion(args.handler)}
+        if args.accion == 'recalcular':
+            return {'ok': recalcular_conexion(args.handler)}
+        if args.accion == 'actualizar':
+            return {'ok': actualizar_conexion(args.handler, args.servicio)}
+        alumno = _buscar_alumno(args.alumno)
+        servidor = _buscar_servidor(args.servidor)
+        servicio = servidor and next((sv for sv in servidor.servicios if sv.nombre == args.servicio), None)
+        if not alumno or not servicio:
+            return {'ok': False, 'error': "Alumno, servidor o servicio no encontrado"}
+        existente = conexiones.buscar('identidad', identidad_conexion(alumno.mac, servidor.ip, servicio))
+        if existente:
+            return dict(_conexion_dict(existente), ok=True, existente=True)
+        if args.perfil is not None:
+            conexion = perfilar(registrar_conexion, alumno.mac, servidor.ip, servicio, archivo=args.perfil or None)
+        else:
+            conexion = registrar_conexion(alumno.mac, servidor.ip, servicio)
+        if not conexion:
+            return {'ok': False, 'error': "No se pudo crear la conexión"}
+        return dict(_conexion_dict(conexion), ok=True)
+
+    if comando == 'provisionar':
+        reporte = provisionar_curso(args.curso.upper())
+        return reporte if reporte is not None else {'ok': False, 'error': f"No se pudo provisionar {args.curso}"}
+
+    if comando == 'carga':
+        return tabla_carga_enlaces(args.puertos)
+    if comando == 'stats':
+        return dict(indicadores(), metricas=metricas.resumen())
+    if comando == 'flows':
+        return flows_compartidos.reporte(conexiones)
+    if comando in ('plan', 'aplicar'):
+        try:
+            plan = planificar(args.crear, args.borrar)
+        except requests.exceptions.RequestException as e:
+            return {'ok': False, 'error': f"Error al consultar los flows del controlador: {e}"}
+        if comando == 'plan':
+            return plan.resumen()
+        ok, error = aplicar_plan(plan)
+        return dict(plan.resumen(), ok=ok, error=error)
+
+    if comando == 'reconciliar':
+        if args.continuo:
+            reconciliador.iniciar()
+            try:
+                while True:
+                    time.sleep(reconciliador.intervalo)
+            except KeyboardInterrupt:
+                reconciliador.detener()
+        else:
+            reconciliador.ciclo()
+        return reconciliador.estadisticas()
+
+    if comando == 'controladores':
+        if not isinstance(fl_client, ControllerPool):
+            return [{'url': fl_client.base_url}]
+        try:
+            fl_client.descubrir()
+        except requests.exceptions.RequestException as e:
+            return {'ok': False, 'error': f"Error al consultar los controladores: {e}"}
+        return fl_client.estado()
+
+    if comando == 'batch':
+        return ejecutar_batch(args.archivo)
+
+def ejecutar_batch(archivo):
+    """Ejecuta cada línea del archivo como un comando, en el mismo proceso y con la misma caché"""
+    parser = construir_parser()
+    resultados = []
+    with open(archivo) as f:
+        for linea in f:
+            linea = linea.strip()
+            if not linea or linea.startswith('#'):
+                continue
+            try:
+                args = parser.parse_args(shlex.split(linea))
+            except SystemExit:
+                resultados.append({'comando': linea, 'resultado': {'ok': False, 'error': 'Comando inválido'}})
+                continue
+            if args.datos:
+                importar(args.datos)
+            resultado = ejecutar_comando(args)
+            if hasattr(resultado, '__next__'):
+                resultado = list(resultado)
+            resultados.append({'comando': linea, 'resultado': resultado})
+    return resultados
+
+def cli(argv):
+    args = construir_parser().parse_args(argv)
+    salida = sys.stdout
+    # Los mensajes informativos van a stderr para que stdout sea solo JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        abrir_estado(args.ruta_estado)
+        if args.metricas:
+            print(f"Métricas publicadas en {iniciar_metricas(args.metricas)}")
+        try:
+            if args.datos and importar(args.datos) is None:
+                return 1
+            resultado = ejecutar_comando(args)
+            # Los listados son generadores: en NDJSON se escriben sin armar la lista completa
+            if hasattr(resultado, '__next__'):
+                if args.ndjson:
+                    escribir_ndjson(resultado, salida)
+                    return 0
+                resultado = list(resultado)
+        finally:
+            detener_metricas()
+            cerrar_estado()
+    json.dump(resultado, salida, ensure_ascii=False, indent=2, default=str)
+    print()
+    return 0
 
 def main():
-    menu_principal()
+    if len(sys.argv) > 1:
+        sys.exit(cli(sys.argv[1:]))
+    abrir_estado()
+    try:
+        menu_principal()
+    finally:
+        reconciliador.detener()
+        cerrar_estado()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,106 @@
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import benchmark
+import sdn_controller as sdn
+
+
+@pytest.fixture(autouse=True)
+def estado_limpio(monkeypatch, tmp_path):
+    """Cada prueba arranca con cachés, índices y registros vacíos"""
+    monkeypatch.setattr(sdn, 'SNAPSHOT_DIR', str(tmp_path / 'instantaneas'))
+    for nombre, clase in (('metricas', sdn.Metricas), ('device_cache', sdn.DeviceCache),
+                          ('device_feed', sdn.DeviceFeed), ('path_cache', sdn.PathCache),
+                          ('topologia', sdn.TopologyGraph), ('carga_enlaces', sdn.LinkLoad),
+                          ('flows_compartidos', sdn.FlowAggregator), ('politicas', sdn.PolicyIndex),
+                          ('admision', sdn.Admision), ('reconciliador', sdn.Reconciliador)):
+        monkeypatch.setattr(sdn, nombre, clase())
+    sdn.device_feed.suscribir(sdn.device_cache.aplicar_cambios)
+    sdn.device_feed.suscribir(sdn.reconciliador.al_cambiar_dispositivos)
+    sdn.reconciliador.max_por_segundo = 0
+    monkeypatch.setattr(sdn, 'cursos_por_alumno', {})
+    monkeypatch.setattr(sdn, 'cursos_por_servidor', {})
+    monkeypatch.setattr(sdn, 'FLOW_AGGREGATION', False)
+    monkeypatch.setattr(sdn, 'ROUTING_ENGINE', 'rest')
+    registros = (sdn.alumnos, sdn.cursos, sdn.servidores, sdn.conexiones)
+    for registro in registros:
+        registro.observador = None
+        registro.limpiar()
+    yield
+    sdn.cerrar_estado()
+    for registro in registros:
+        registro.limpiar()
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    """Floodlight simulado con cuatro switches en línea (puerto 1 hacia atrás, 2 hacia adelante)"""
+    floodlight = benchmark.FakeFloodlight(4)
+    monkeypatch.setattr(sdn, 'fl_client', sdn.FloodlightClient(floodlight.iniciar(), max_retries=0))
+    yield floodlight
+    floodlight.detener()
+
+
+@pytest.fixture
+def red(fake):
+    return poblar(fake)
+
+
+def poblar(fake):
+    """Alumnos 1 y 2 en el switch 1, alumno 3 en el 2 y el servidor S1 (ssh, web) en el 4;
+    los tres matriculados en TEL354, que otorga ssh y web"""
+    for i, switch in ((1, 0), (2, 0), (3, 1)):
+        fake.agregar_host(f'aa:00:00:00:00:0{i}', None, switch)
+        sdn.alumnos.agregar(sdn.Alumno(f'Alumno {i}', str(i), f'aa:00:00:00:00:0{i}'))
+    fake.agregar_host('ff:00:00:00:00:01', '10.0.0.3', 3)
+    servidor = sdn.Servidor('S1', '10.0.0.3')
+    servidor.servicios = [sdn.Servicio('ssh', 'TCP', 22), sdn.Servicio('web', 'TCP', 80)]
+    sdn.servidores.agregar(servidor)
+    curso = sdn.Curso('TEL354', 'Redes', 'DICTANDO')
+    curso.alumnos = {'1', '2', '3'}
+    curso.servidores = [{'nombre': 'S1', 'servicios_permitidos': ['ssh', 'web']}]
+    sdn.registrar_curso(curso)
+    return fake
+
+
+def mac(i):
+    return f'aa:00:00:00:00:0{i}'
+
+
+def servicio(nombre):
+    return next(sv for sv in sdn.servidores.get('S1').servicios if sv.nombre == nombre)
+
+
+def conectar(i, nombre_servicio='ssh'):
+    """Crea la conexión del alumno i a S1 sin imprimir el progreso"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        conexion = sdn.registrar_conexion(mac(i), '10.0.0.3', servicio(nombre_servicio))
+    assert conexion is not None
+    return conexion
+
+
+def silencio(funcion, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return funcion(*args, **kwargs)
+
+
+def flows_arp(fake):
+    return {nombre: flow for nombre, flow in fake.flows.items() if nombre.startswith('arp_')}
+
+
+def contar_peticiones(fake):
+    """Envuelve el Floodlight simulado; devuelve la lista (método, ruta) de lo que recibe"""
+    responder, peticiones = fake.responder, []
+
+    def registrar(metodo, ruta, cuerpo, cabeceras=None, dominio=None):
+        peticiones.append((metodo, ruta))
+        return responder(metodo, ruta, cuerpo, cabeceras, dominio)
+
+    fake.responder = registrar
+    return peticiones
@@ -0,0 +1,46 @@
+import threading
+import time
+
+import sdn_controller as sdn
+
+
+def test_limite_por_alumno():
+    admision = sdn.Admision(tasa_alumno=0.001, rafaga_alumno=2, tasa_controlador=0)
+    resultados = [admision.solicitar(i, 'aa', lambda: 'ok') for i in range(3)]
+    assert resultados[:2] == [('ok', None), ('ok', None)]
+    assert resultados[2] == (None, sdn.MOTIVOS_RECHAZO['limite_alumno'])
+    # Otro alumno no comparte la cubeta
+    assert admision.solicitar(3, 'bb', lambda: 'ok') == ('ok', None)
+    assert admision.estadisticas()['rechazadas'] == {'limite_alumno': 1}
+
+
+def test_solicitudes_iguales_comparten_resultado():
+    admision = sdn.Admision(tasa_alumno=0, tasa_controlador=0)
+    liberar, llamadas, resultados = threading.Event(), [], []
+
+    def crear():
+        llamadas.append(1)
+        liberar.wait(5)
+        return 'conexion'
+
+    hilos = [threading.Thread(target=lambda: resultados.append(admision.solicitar('misma', 'aa', crear)))
+             for _ in range(3)]
+    for hilo in hilos:
+        hilo.start()
+    while admision.estadisticas()['unidas'] < 2:
+        time.sleep(0.001)
+    liberar.set()
+    for hilo in hilos:
+        hilo.join()
+    assert llamadas == [1]
+    assert resultados == [('conexion', None)] * 3
+
+
+def test_cola_llena_y_espera_agotada():
+    admision = sdn.Admision(cola_max=0, tasa_alumno=0)
+    assert admision.solicitar(1, 'aa', lambda: 'ok') == (None, sdn.MOTIVOS_RECHAZO['cola_llena'])
+
+    admision = sdn.Admision(tasa_alumno=0, tasa_controlador=0.001, rafaga_controlador=1, espera_max=0.05)
+    assert admision.solicitar(1, 'aa', lambda: 'ok') == ('ok', None)
+    assert admision.solicitar(2, 'bb', lambda: 'ok') == (None, sdn.MOTIVOS_RECHAZO['tiempo_agotado'])
+    assert admision.estadisticas()['en_cola'] == 0
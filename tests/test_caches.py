@@ -0,0 +1,51 @@
+import sdn_controller as sdn
+from conftest import contar_peticiones, mac
+
+
+def test_consultas_de_dispositivos_salen_de_la_cache(red):
+    peticiones = contar_peticiones(red)
+    assert sdn.get_attachment_point(mac(1)) == (red.switches[0], 3)
+    assert sdn.get_attachment_point(mac(3)) == (red.switches[1], 3)
+    assert sdn.get_attachment_point_by_ip('10.0.0.3') == (red.switches[3], 3)
+    assert peticiones == [('GET', '/wm/device/')]
+    assert (sdn.device_cache.hits, sdn.device_cache.misses) == (2, 1)
+    assert sdn.get_attachment_point('aa:00:00:00:00:09') == (None, None)
+
+
+def test_refresco_sin_cambios_no_trae_la_tabla(red):
+    sdn.device_cache.refrescar()
+    assert sdn.device_feed.sondear() == []
+    assert sdn.device_feed.no_modificados == 1
+
+    red.mover_host(mac(1), 2)
+    cambios = sdn.device_feed.sondear()
+    assert [(c['macs'], c['anterior'], c['punto']) for c in cambios] == \
+        [([mac(1)], (red.switches[0], 3), (red.switches[2], 3))]
+    assert sdn.device_cache.por_mac[mac(1)] == (red.switches[2], 3)
+
+
+def test_rutas_en_cache_hasta_que_cambia_la_topologia(red, monkeypatch):
+    sdn.path_cache.intervalo = 0
+    peticiones = contar_peticiones(red)
+    rutas = lambda: [r for m, r in peticiones if r.startswith('/wm/path/')]
+    origen, destino = red.switches[0], red.switches[3]
+
+    ruta = sdn.get_route(origen, destino)
+    assert {p['switch'] for p in ruta} == set(red.switches)
+    assert sdn.get_route(origen, destino) == ruta
+    assert len(rutas()) == 1
+    assert sdn.path_cache.estadisticas()['hits'] == 1
+
+    enlaces = red.enlaces
+    monkeypatch.setattr(red, 'enlaces', lambda: enlaces()[1:])
+    sdn.get_route(origen, destino)
+    assert len(rutas()) == 2
+    assert sdn.path_cache.invalidaciones == 1
+
+
+def test_cache_de_rutas_acotada():
+    cache = sdn.PathCache(maxsize=2)
+    for i in range(3):
+        cache.guardar(i, i + 1, [i])
+    assert cache.obtener(0, 1, verificar=False) is None
+    assert cache.obtener(2, 3, verificar=False) == [2]
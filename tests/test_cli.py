@@ -0,0 +1,50 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import sdn_controller as sdn
+
+DATOS = """\
+alumnos:
+- nombre: Ana
+  codigo: 20200001
+  mac: '44:11:22:33:44:01'
+cursos:
+- codigo: TEL354
+  nombre: Redes
+  estado: DICTANDO
+  alumnos: [20200001]
+  servidores:
+  - nombre: Servidor 1
+    servicios_permitidos: [ssh]
+servidores:
+- nombre: Servidor 1
+  ip: 10.0.0.3
+  servicios:
+  - nombre: ssh
+    protocolo: TCP
+    puerto: 22
+"""
+
+
+def _cli(capsys, *argv):
+    assert sdn.cli(list(argv)) == 0
+    return json.loads(capsys.readouterr().out)
+
+
+def test_estado_curso_con_estado_persistido(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'datos.yaml').write_text(DATOS)
+    db = str(tmp_path / 'estado.db')
+
+    assert _cli(capsys, '--estado', db, 'importar', 'datos.yaml')['ok']
+    resultado = _cli(capsys, '--estado', db, 'estado-curso', 'tel354', 'cerrado')
+    assert resultado == {'ok': True, 'revocadas': []}
+    # El estado del curso no se confunde con la ruta de la base
+    assert not (tmp_path / 'CERRADO').exists()
+
+    cursos = _cli(capsys, '--estado', db, 'cursos', '--codigo', 'TEL354')
+    assert [c['estado'] for c in cursos] == ['CERRADO']
+    assert _cli(capsys, '--estado', db, 'politica', '20200001', 'Servidor 1', 'ssh')['permitido'] is False
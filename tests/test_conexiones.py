@@ -0,0 +1,67 @@
+import threading
+
+import sdn_controller as sdn
+from conftest import conectar, mac, servicio, silencio
+
+
+def test_solicitudes_iguales_en_paralelo_instalan_una_vez(red):
+    red.latencia = 0.01
+    resultados = []
+    hilos = [threading.Thread(target=lambda: resultados.append(
+                 silencio(sdn._registrar_conexion, mac(1), '10.0.0.3', servicio('ssh'))))
+             for _ in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert len({id(conexion) for conexion in resultados}) == 1
+    assert len(sdn.conexiones) == 1
+    assert len([n for n in red.flows if not n.startswith('arp_')]) == 2 * len(resultados[0].hops)
+
+
+def test_crear_conexion_existente_lo_indica(red, monkeypatch, capsys):
+    conexion = conectar(1)
+    respuestas = iter(['1', '1', '1'])
+    monkeypatch.setattr('builtins.input', lambda _: next(respuestas))
+    sdn.crear_conexion()
+    salida = capsys.readouterr().out
+    assert f"La conexión ya existía. Handler: {conexion.handler}" in salida
+    assert "exitosamente" not in salida
+
+
+def test_build_routes_revierte_como_el_camino_sincrono(red):
+    responder = red.responder
+
+    def fallar_en_el_ultimo_switch(metodo, ruta, cuerpo, cabeceras=None, dominio=None):
+        if metodo == 'POST' and cuerpo.get('switch') == red.switches[3] and cuerpo['name'].endswith('_rev'):
+            return 500, {'error': 'falla simulada'}
+        return responder(metodo, ruta, cuerpo, cabeceras, dominio)
+
+    red.responder = fallar_en_el_ultimo_switch
+    lote = [sdn.Conexion(f'c{i}', mac(i), '10.0.0.3', servicio('ssh')) for i in (1, 3)]
+    errores = silencio(sdn.build_routes, lote)
+    assert all(errores)
+    assert red.flows == {}
+    assert sdn.carga_enlaces.por_enlace == {}
+    assert sdn.flows_compartidos.grupos == {}
+
+    red.responder = responder
+    assert silencio(sdn.build_routes, lote) == [None, None]
+    assert all(conexion.flows and conexion.grupos for conexion in lote)
+
+
+def test_filtros_de_conexiones_usan_los_grupos(red, monkeypatch):
+    uno, dos, tres = conectar(1), conectar(2, 'web'), conectar(3)
+
+    def recorrido_completo(self):
+        raise AssertionError("no debería recorrer todas las conexiones")
+
+    handlers = lambda **filtros: {c.handler for c in sdn.iterar_conexiones(**filtros)}
+    with monkeypatch.context() as parche:
+        parche.setattr(sdn.Registro, '__iter__', recorrido_completo)
+        assert handlers(alumno='1') == {uno.handler}
+        assert handlers(servidor='S1', servicio='ssh') == {uno.handler, tres.handler}
+        assert handlers(curso='TEL354', servicio='web') == {dos.handler}
+        assert handlers(alumno='9') == set()
+    assert handlers() == {uno.handler, dos.handler, tres.handler}
@@ -0,0 +1,39 @@
+import benchmark
+import pytest
+import sdn_controller as sdn
+from conftest import conectar, poblar, silencio
+
+
+@pytest.fixture
+def dominios(monkeypatch):
+    """Cuatro switches repartidos entre dos controladores (01-02 y 03-04)"""
+    floodlight = benchmark.FakeFloodlight(4)
+    urls = floodlight.iniciar_dominios(2)
+    monkeypatch.setattr(sdn, 'fl_client', sdn.ControllerPool(
+        [sdn.FloodlightClient(url, max_retries=0) for url in urls], floodlight.enlaces_entre_dominios()))
+    yield poblar(floodlight)
+    floodlight.detener()
+
+
+def test_cada_flow_va_al_controlador_del_switch(dominios):
+    conexion = conectar(1)
+    # Si un controlador hubiera recibido flows de un switch ajeno los habría rechazado
+    assert {f['switch'] for f in conexion.flows} == set(dominios.switches)
+    assert set(sdn.fl_client.flows_por_nombre.values()) == {0, 1}
+    assert all(sdn.fl_client.flows_por_nombre[n] == dominios.dominios[f['switch']]
+               for n, f in dominios.flows.items())
+
+    # Las consultas globales fusionan lo que responde cada controlador
+    listado = sdn.flows_en_controlador()
+    assert {nombre for _, nombre in listado} == set(dominios.flows)
+
+    silencio(sdn.eliminar_conexion, conexion.handler)
+    assert dominios.flows == {}
+
+
+def test_ruta_entre_dominios_usa_los_enlaces_de_borde(dominios):
+    ruta = sdn.get_route(dominios.switches[0], dominios.switches[3])
+    assert {p['switch'] for p in ruta} == set(dominios.switches)
+    # El salto entre dominios sale por el puerto 2 del switch 02 y entra por el 1 del 03
+    borde = [(p['switch'], str(p['port'])) for p in ruta]
+    assert borde.index((dominios.switches[2], '1')) == borde.index((dominios.switches[1], '2')) + 1
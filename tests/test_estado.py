@@ -0,0 +1,59 @@
+import sqlite3
+
+import sdn_controller as sdn
+from conftest import conectar
+
+
+def _codigos():
+    return [a.codigo for a in sdn.alumnos]
+
+
+def test_el_estado_se_recupera_en_el_orden_de_registro(tmp_path):
+    ruta = str(tmp_path / 'estado.db')
+    sdn.abrir_estado(ruta)
+    for codigo in ('3', '1', '2'):
+        sdn.alumnos.agregar(sdn.Alumno(f'Alumno {codigo}', codigo, f'aa:00:00:00:00:0{codigo}'))
+    # Guardar de nuevo una entidad (p. ej. tras recalcular) no la manda al final
+    sdn.alumnos.tocar(sdn.alumnos.get('3'))
+    sdn.store.compactar()
+    sdn.cerrar_estado()
+
+    sdn.abrir_estado(ruta)
+    assert _codigos() == ['3', '1', '2']
+
+
+def test_migra_la_tabla_sin_columna_de_orden(tmp_path):
+    ruta = str(tmp_path / 'estado.db')
+    conn = sqlite3.connect(ruta)
+    conn.execute("""CREATE TABLE entidades (tipo TEXT NOT NULL, clave TEXT NOT NULL, datos TEXT NOT NULL,
+                    PRIMARY KEY (tipo, clave))""")
+    for codigo in ('2', '1'):
+        alumno = sdn.Alumno(f'Alumno {codigo}', codigo, f'aa:00:00:00:00:0{codigo}')
+        conn.execute("INSERT INTO entidades VALUES (?, ?, ?)",
+                     ('alumno', codigo, sdn.json.dumps(sdn._a_dict('alumno', alumno))))
+    conn.commit()
+    conn.close()
+
+    sdn.abrir_estado(ruta)
+    sdn.alumnos.agregar(sdn.Alumno('Alumno 3', '3', 'aa:00:00:00:00:03'))
+    sdn.cerrar_estado()
+    sdn.abrir_estado(ruta)
+    assert _codigos() == ['2', '1', '3']
+
+
+def test_conexiones_persistidas_recuperan_sus_grupos(red, tmp_path):
+    ruta = str(tmp_path / 'estado.db')
+    modelo = [(registro, list(registro)) for registro in (sdn.alumnos, sdn.cursos, sdn.servidores)]
+    sdn.abrir_estado(ruta)
+    for registro, objetos in modelo:
+        for obj in objetos:
+            registro.agregar(obj)
+    sdn.reconstruir_indices()
+    conexion = conectar(1)
+    grupos = sdn.flows_compartidos.claves_de(conexion.handler)
+    sdn.cerrar_estado()
+    sdn.flows_compartidos.limpiar()
+
+    sdn.abrir_estado(ruta)
+    assert sdn.conexiones.get(conexion.handler).hops == conexion.hops
+    assert sdn.flows_compartidos.claves_de(conexion.handler) == grupos
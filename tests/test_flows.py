@@ -0,0 +1,109 @@
+import sdn_controller as sdn
+from conftest import conectar, flows_arp, mac, silencio
+
+
+def _puertos_arp(fake, switch, alumno_mac=''):
+    clave = (switch, 'arp', alumno_mac, '10.0.0.3')
+    fwd = next(flow for nombre, flow in fake.flows.items()
+               if nombre == sdn.construir_flows_arp(clave, 0, 0)[0]['name'])
+    return str(fwd['in_port']), fwd['actions']
+
+
+def _salto(conexion, switch):
+    return next(hop for hop in conexion.hops if hop[0] == switch)
+
+
+def test_arp_de_dos_alumnos_no_se_pisan(red):
+    uno, dos = conectar(1), conectar(2)
+    arp = flows_arp(red)
+    # Cada alumno tiene su par ARP por switch de la ruta
+    assert len(arp) == 2 * (len(uno.hops) + len(dos.hops))
+    for flow in arp.values():
+        if flow['name'].endswith('_rev'):
+            assert flow['eth_dst'] in (mac(1), mac(2))
+
+
+def test_arp_sigue_al_host_movido(red):
+    ssh, web = conectar(1, 'ssh'), conectar(1, 'web')
+    red.mover_host(mac(1), 1)
+    silencio(sdn.reconciliador.ciclo)
+
+    switch = red.switches[1]
+    for conexion in (ssh, web):
+        assert conexion.hops[0][0] == switch
+    _, in_port, out_port = _salto(ssh, switch)
+    assert _puertos_arp(red, switch, mac(1)) == (str(in_port), f'output={out_port}')
+    # Los flows ARP del switch que el alumno dejó ya no se usan
+    assert not any(flow['switch'] == red.switches[0] for flow in flows_arp(red).values())
+
+
+def test_arp_compartido_cambia_de_puertos_al_irse_el_primero():
+    # Con rutas balanceadas dos conexiones del alumno pueden cruzar el switch por puertos distintos
+    agregador = sdn.FlowAggregator()
+    clave = ('00:00:00:00:00:00:00:02', 'arp', mac(1), '10.0.0.3')
+    _, nuevos = agregador.unir('a', clave, (clave[0], 1, 2))
+    assert [f['in_port'] for f in nuevos] == ['1', '2']
+    assert agregador.unir('b', clave, (clave[0], 3, 2), repuntar=False) == (True, [])
+
+    huerfanos, repuntes = agregador.soltar('a', {clave})
+    assert huerfanos == []
+    assert [(f['in_port'], f['actions']) for f in repuntes] == [('3', 'output=2'), ('2', 'output=3')]
+
+    huerfanos, repuntes = agregador.soltar('b', {clave})
+    assert len(huerfanos) == 2 and repuntes == []
+    assert agregador.arp == {} and agregador.arp_puertos == {}
+
+
+def _registrar_peticiones(fake, fallar=None):
+    responder, peticiones = fake.responder, []
+
+    def registrar(metodo, ruta, cuerpo, cabeceras=None, dominio=None):
+        if ruta == '/wm/staticflowpusher/json':
+            peticiones.append((metodo, cuerpo['name']))
+            if fallar and metodo == 'POST' and fallar(cuerpo):
+                return 500, {'error': 'falla simulada'}
+        return responder(metodo, ruta, cuerpo, cabeceras, dominio)
+
+    fake.responder = registrar
+    return peticiones
+
+
+def test_reubicar_instala_antes_de_retirar(red):
+    conexion = conectar(1)
+    peticiones = _registrar_peticiones(red)
+    red.mover_host(mac(1), 1)
+    silencio(sdn.reconciliador.ciclo)
+
+    assert conexion.hops[0][0] == red.switches[1]
+    metodos = [metodo for metodo, _ in peticiones]
+    assert 'DELETE' in metodos
+    assert 'POST' not in metodos[metodos.index('DELETE'):]
+    assert set(red.flows) == {f['name'] for f in conexion.flows} | set(flows_arp(red))
+
+
+def test_reubicar_fallido_deja_la_ruta_anterior(red):
+    conexion = conectar(1)
+    hops, flows = list(conexion.hops), {nombre: dict(flow) for nombre, flow in red.flows.items()}
+    nuevo = red.switches[1]
+    _registrar_peticiones(red, fallar=lambda flow: flow['switch'] == nuevo and flow['name'].endswith('_rev'))
+    red.mover_host(mac(1), 1)
+    silencio(sdn.reconciliador.ciclo)
+
+    assert conexion.hops == hops
+    assert red.flows == flows
+    assert sorted(conexion.grupos) == sorted(sdn.flows_compartidos.claves_de(conexion.handler))
+
+
+def test_agregacion_comparte_los_saltos_centrales(red, monkeypatch):
+    monkeypatch.setattr(sdn, 'FLOW_AGGREGATION', True)
+    uno, dos = conectar(1), conectar(2)
+    agregados = {n for n in red.flows if n.startswith('agg_')}
+    # Fuera del switch de los alumnos cada salto central se instala una sola vez
+    assert len(agregados) == 2 * (len(uno.hops) - 1)
+    assert {f['switch'] for f in uno.flows} == {red.switches[0]}
+
+    silencio(sdn.eliminar_conexion, uno.handler)
+    assert agregados <= set(red.flows)
+    silencio(sdn.eliminar_conexion, dos.handler)
+    assert red.flows == {}
+    assert sdn.flows_compartidos.grupos == {}
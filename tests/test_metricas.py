@@ -0,0 +1,18 @@
+import re
+
+import sdn_controller as sdn
+
+MUESTRA = re.compile(r'^[a-z_]+(\{([a-z_]+="([^"\\\n]|\\[\\"n])*",?)*\})? \S+$')
+
+
+def test_etiquetas_escapadas_en_toda_la_exposicion(monkeypatch):
+    monkeypatch.setattr(sdn, 'conexiones_por_curso_y_servidor',
+                        lambda: ({'TEL"354': 1}, {'Lab \\ 1\n"norte"': 2}))
+    sdn.metricas.incrementar('sdn_admision_total', resultado='linea\nnueva "y" \\')
+    texto = sdn.exportar_metricas()
+
+    for linea in texto.splitlines():
+        assert linea.startswith('#') or MUESTRA.match(linea), linea
+    assert 'sdn_conexiones_curso{curso="TEL\\"354"} 1' in texto
+    assert 'sdn_conexiones_servidor{servidor="Lab \\\\ 1\\n\\"norte\\""} 2' in texto
+    assert 'resultado="linea\\nnueva \\"y\\" \\\\"' in texto
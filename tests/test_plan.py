@@ -0,0 +1,40 @@
+import sdn_controller as sdn
+from conftest import conectar, silencio
+
+
+def test_plan_desactualizado_se_rechaza(red):
+    plan = sdn.planificar(crear=[('1', 'S1', 'ssh')])
+    assert len(plan.crear) == 1 and plan.agregar
+    # Otra conexión entra entre el plan y su aplicación
+    conectar(2)
+    flows = dict(red.flows)
+
+    ok, error = silencio(sdn.aplicar_plan, plan)
+    assert not ok and 'vuelva a planificar' in error
+    assert red.flows == flows
+    assert len(sdn.conexiones) == 1
+
+
+def test_plan_revierte_a_lo_que_tenia_el_controlador(red):
+    conexion = conectar(1)
+    plan = sdn.planificar(crear=[('2', 'S1', 'ssh')], borrar=[conexion.handler])
+    flows = {nombre: dict(flow) for nombre, flow in red.flows.items()}
+    responder = red.responder
+
+    def fallar_al_borrar(metodo, ruta, cuerpo, cabeceras=None, dominio=None):
+        if metodo == 'DELETE' and cuerpo['name'] == plan.quitar[-1]['name']:
+            return 500, {'error': 'falla simulada'}
+        return responder(metodo, ruta, cuerpo, cabeceras, dominio)
+
+    red.responder = fallar_al_borrar
+    ok, error = silencio(sdn.aplicar_plan, plan)
+    assert not ok and 'se revirtieron' in error
+    assert set(red.flows) == set(flows)
+    assert sdn.conexiones.get(conexion.handler) is conexion
+
+
+def test_plan_aplicado(red):
+    plan = sdn.planificar(crear=[('1', 'S1', 'ssh'), ('3', 'S1', 'web')])
+    assert silencio(sdn.aplicar_plan, plan) == (True, None)
+    assert len(sdn.conexiones) == 2
+    assert sdn.planificar().vacio()
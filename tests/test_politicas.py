@@ -0,0 +1,51 @@
+import sdn_controller as sdn
+from conftest import conectar, mac, servicio, silencio
+
+
+def _curso(codigo, estado, alumnos, servicios):
+    curso = sdn.Curso(codigo, codigo, estado)
+    curso.alumnos = set(alumnos)
+    curso.servidores = [{'nombre': 'S1', 'servicios_permitidos': servicios}]
+    return curso
+
+
+def test_permisos_compilados_por_curso():
+    politicas = sdn.PolicyIndex()
+    politicas.indexar_curso(_curso('A', 'DICTANDO', ['1', '2'], ['ssh']))
+    politicas.indexar_curso(_curso('B', 'DICTANDO', ['1'], ['ssh', 'web']))
+    politicas.indexar_curso(_curso('C', 'CERRADO', ['3'], ['ssh']))
+
+    assert politicas.por_que('1', 'S1', 'ssh') == ['A', 'B']
+    assert politicas.autorizado('2', 'S1', 'ssh') and not politicas.autorizado('2', 'S1', 'web')
+    assert not politicas.autorizado('3', 'S1', 'ssh')
+
+    # Reindexar un curso solo toca sus entradas; lo que nadie más otorga queda como perdido
+    politicas.indexar_curso(_curso('B', 'CERRADO', ['1'], ['ssh', 'web']))
+    assert politicas.por_que('1', 'S1', 'ssh') == ['A']
+    assert politicas.tomar_perdidos() == {('1', 'S1', 'web')}
+    politicas.quitar_curso('A')
+    assert politicas.permisos == {}
+    assert politicas.tomar_perdidos() == {('1', 'S1', 'ssh'), ('2', 'S1', 'ssh')}
+
+
+def test_build_route_consulta_el_indice(red):
+    assert conectar(1)
+    curso = sdn.cursos.get('TEL354')
+    sdn.desmatricular(curso, '2')
+    conexion = sdn.Conexion('c2', mac(2), '10.0.0.3', servicio('ssh'))
+    assert not silencio(sdn.build_route, conexion, sdn.alumnos, sdn.cursos, sdn.servidores)
+    assert not any(n.startswith('c2_') for n in red.flows)
+
+
+def test_cerrar_el_curso_revoca_sus_conexiones(red):
+    uno, dos = conectar(1), conectar(2, 'web')
+    otro = sdn.Curso('TEL999', 'Otro', 'DICTANDO')
+    otro.alumnos = {'1'}
+    otro.servidores = [{'nombre': 'S1', 'servicios_permitidos': ['ssh']}]
+    sdn.registrar_curso(otro)
+
+    reporte = silencio(sdn.cambiar_estado_curso, 'TEL354', 'CERRADO')
+    # La conexión que otro curso sigue otorgando se conserva
+    assert [r['handler'] for r in reporte['revocadas']] == [dos.handler]
+    assert sdn.conexiones.get(uno.handler) is uno and sdn.conexiones.get(dos.handler) is None
+    assert {n for n in red.flows if n.startswith(dos.handler)} == set()
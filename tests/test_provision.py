@@ -0,0 +1,33 @@
+import sdn_controller as sdn
+from conftest import mac, silencio
+
+
+def _resultados(reporte):
+    return {(r['alumno'], r['servicio']): r for r in reporte['resultados']}
+
+
+def test_provisiona_todo_el_curso(red):
+    reporte = silencio(sdn.provisionar_curso, 'TEL354')
+    assert len(reporte['resultados']) == 6 and all(r['ok'] for r in reporte['resultados'])
+    assert len(sdn.conexiones) == 6
+    assert {f['name'] for c in sdn.conexiones for f in c.flows} <= set(red.flows)
+    # Provisionar de nuevo no duplica nada
+    assert silencio(sdn.provisionar_curso, 'TEL354')['resultados'] == []
+
+
+def test_las_que_fallan_no_se_registran_ni_dejan_flows(red):
+    responder = red.responder
+
+    def fallar_web_del_alumno_3(metodo, ruta, cuerpo, cabeceras=None, dominio=None):
+        if metodo == 'POST' and cuerpo.get('tcp_dst') == '80' and cuerpo.get('eth_src') == mac(3):
+            return 500, {'error': 'falla simulada'}
+        return responder(metodo, ruta, cuerpo, cabeceras, dominio)
+
+    red.responder = fallar_web_del_alumno_3
+    resultados = _resultados(silencio(sdn.provisionar_curso, 'TEL354'))
+    assert not resultados[('3', 'web')]['ok']
+    assert sum(r['ok'] for r in resultados.values()) == 5
+    assert sdn.conexiones.buscar('identidad', sdn.identidad_conexion(
+        mac(3), '10.0.0.3', sdn.servidores.get('S1').servicios[1])) is None
+    registrados = {f['name'] for c in sdn.conexiones for f in c.flows}
+    assert {n for n in red.flows if not n.startswith(('arp_', 'agg_'))} == registrados
@@ -0,0 +1,35 @@
+import sdn_controller as sdn
+from conftest import conectar, mac, silencio
+
+
+def test_solo_revisa_las_conexiones_del_host_movido(red):
+    uno, tres = conectar(1), conectar(3)
+    silencio(sdn.reconciliador.ciclo)
+    revisadas = sdn.reconciliador.revisadas
+
+    red.mover_host(mac(3), 2)
+    silencio(sdn.reconciliador.ciclo)
+    assert sdn.reconciliador.revisadas == revisadas + 1
+    assert sdn.reconciliador.recalculadas == 1
+    assert tres.hops[0][:2] == (red.switches[2], '3')
+    assert uno.hops[0][0] == red.switches[0]
+
+
+def test_enlace_caido_se_reintenta_sin_tocar_la_ruta(red, monkeypatch):
+    monkeypatch.setattr(sdn, 'ROUTING_ENGINE', 'local')
+    conexion = conectar(1)
+    hops, flows = list(conexion.hops), dict(red.flows)
+    silencio(sdn.reconciliador.ciclo)
+
+    enlaces = red.enlaces
+    monkeypatch.setattr(red, 'enlaces', lambda: enlaces()[:-1])
+    silencio(sdn.reconciliador.ciclo)
+    # Sin ruta alternativa la conexión conserva sus flows y queda marcada para el próximo ciclo
+    assert sdn.reconciliador.errores == 1
+    assert conexion.handler in sdn.reconciliador.afectadas
+    assert conexion.hops == hops and red.flows == flows
+
+    monkeypatch.setattr(red, 'enlaces', enlaces)
+    silencio(sdn.reconciliador.ciclo)
+    assert sdn.reconciliador.errores == 1
+    assert not sdn.reconciliador.afectadas
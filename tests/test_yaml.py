@@ -0,0 +1,96 @@
+import contextlib
+import io
+import os
+import pickle
+
+import sdn_controller as sdn
+
+DATOS = """\
+alumnos:
+- &ana {nombre: Ana, codigo: 1, mac: '44:11:22:33:44:01'}
+- {nombre: Beto, codigo: 2, mac: '44:11:22:33:44:02'}
+cursos:
+servidores:
+- nombre: S1
+  ip: 10.0.0.3
+  servicios: &servicios
+  - {nombre: ssh, protocolo: TCP, puerto: 22}
+- nombre: S2
+  ip: 10.0.0.4
+  servicios: *servicios
+"""
+
+
+def test_iterar_entidades_no_retiene_lo_construido():
+    entidades = sdn.iterar_entidades(io.StringIO(DATOS))
+    vistas = []
+    for seccion, entidad in entidades:
+        vistas.append((seccion, entidad and entidad.get('nombre')))
+        loader = entidades.gi_frame.f_locals['loader']
+        assert loader.constructed_objects == {} and loader.recursive_objects == {}
+    assert vistas == [('alumnos', None), ('alumnos', 'Ana'), ('alumnos', 'Beto'), ('cursos', None),
+                      ('servidores', None), ('servidores', 'S1'), ('servidores', 'S2')]
+
+
+def test_alias_entre_entidades():
+    servidores = [e for s, e in sdn.iterar_entidades(io.StringIO(DATOS)) if s == 'servidores' and e]
+    assert servidores[0]['servicios'] == servidores[1]['servicios']
+    # Cada entidad recibe su propia copia, no el objeto de la anterior
+    assert servidores[0]['servicios'] is not servidores[1]['servicios']
+
+
+def _importar(ruta):
+    with contextlib.redirect_stdout(io.StringIO()) as salida:
+        sdn.importar(str(ruta))
+    return salida.getvalue()
+
+
+def test_instantanea_privada_y_no_junto_al_yaml(tmp_path):
+    yaml_path = tmp_path / 'datos.yaml'
+    yaml_path.write_text(DATOS)
+    assert 'instantánea' not in _importar(yaml_path)
+    assert not list(tmp_path.glob('*.snapshot'))
+    ruta = sdn._ruta_snapshot(str(yaml_path))
+    assert os.stat(ruta).st_mode & 0o777 == 0o600
+    assert os.stat(sdn.SNAPSHOT_DIR).st_mode & 0o777 == 0o700
+    assert 'instantánea' in _importar(yaml_path)
+
+
+def test_instantanea_ajena_no_se_carga(tmp_path):
+    yaml_path = tmp_path / 'datos.yaml'
+    yaml_path.write_text(DATOS)
+    _importar(yaml_path)
+    ruta = sdn._ruta_snapshot(str(yaml_path))
+    # Un pickle que otro usuario pudo reescribir no se abre
+    os.chmod(ruta, 0o666)
+    assert sdn.cargar_snapshot(str(yaml_path)) is None
+    os.chmod(ruta, 0o600)
+    os.chmod(sdn.SNAPSHOT_DIR, 0o777)
+    assert sdn.cargar_snapshot(str(yaml_path)) is None
+    os.chmod(sdn.SNAPSHOT_DIR, 0o700)
+    assert sdn.cargar_snapshot(str(yaml_path)) is not None
+
+    # Un .snapshot junto al YAML ya no se toma en cuenta
+    with open(str(yaml_path) + '.snapshot', 'wb') as file:
+        pickle.dump({'version': sdn.SNAPSHOT_VERSION}, file)
+    os.remove(ruta)
+    assert sdn.cargar_snapshot(str(yaml_path)) is None
+
+
+def test_fusion_aplica_solo_las_diferencias(tmp_path):
+    original, cambios = tmp_path / 'datos.yaml', tmp_path / 'cambios.yaml'
+    original.write_text(DATOS)
+    _importar(original)
+    ana = sdn.alumnos.get(1)
+    s2 = sdn.servidores.get('S2')
+    cambios.write_text(DATOS.replace('nombre: Ana', 'nombre: Ana María').replace(
+        "- {nombre: Beto, codigo: 2, mac: '44:11:22:33:44:02'}\n",
+        "- {nombre: Carla, codigo: 3, mac: '44:11:22:33:44:03'}\n"))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        reporte = sdn.importar(str(cambios), fusionar=True)
+    assert reporte['alumnos'] == {'agregados': [3], 'modificados': [1], 'eliminados': [2]}
+    assert reporte['servidores'] == {'agregados': [], 'modificados': [], 'eliminados': []}
+    # Lo que no cambió conserva el mismo objeto
+    assert sdn.alumnos.get(1) is ana and ana.nombre == 'Ana María'
+    assert sdn.servidores.get('S2') is s2